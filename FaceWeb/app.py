@@ -9,11 +9,37 @@ import base64
 import numpy as np
 import warnings
 import argparse
+import bisect
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, Response, redirect, url_for, send_from_directory
+from flask import Flask, render_template, request, jsonify, Response, redirect, url_for, send_from_directory, send_file, abort
 import json
+import sqlite3
+import csv
+import io
+import shutil
+import urllib.request
+import urllib.error
+import hashlib
+import struct
+import zipfile
+import tempfile
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.serving import make_server
+import asyncio
 import threading
+import queue
+import socket
+import signal
+import gc
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
 
 # 添加父目录到路径，确保能导入核心库
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -37,25 +63,2351 @@ except ImportError:
     FAISS_AVAILABLE = False
 
 try:
-    from sklearn.cluster import KMeans
+    from sklearn.cluster import MiniBatchKMeans
     SKLEARN_AVAILABLE = True
 except ImportError:
     SKLEARN_AVAILABLE = False
 
+try:
+    import fcntl  # 预派生工作进程之间的人脸库变更日志锁 (Windows上没有，也不使用预派生服务器)
+except ImportError:
+    fcntl = None
+
 # 定义应用目录
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'tianshu_security_face_recognition'
 app.config['UPLOAD_FOLDER'] = os.path.join(parent_dir, 'data', 'database_faces')
 app.config['UPLOAD_TEMP'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg'}
+# 人脸特征持久化缓存文件 (打包存储所有图像的128D特征)
+app.config['DESCRIPTOR_CACHE'] = os.path.join(parent_dir, 'data', 'descriptor_cache.npz')
+# 录入后延迟保存特征缓存的秒数，期间的多次录入合并为一次写入 (缓存文件包含全部图像的特征，每次重写代价较大)
+app.config['DESCRIPTOR_CACHE_SAVE_DELAY'] = 5
+# 加载人脸库时每批一次性计算特征的图像数量
+app.config['DESCRIPTOR_BATCH_SIZE'] = 16
+# 代表特征: 每人最多的聚类中心数、聚类中心与已有代表特征的最小距离、异常值过滤时最多比较的特征数
+app.config['TEMPLATE_MAX_CLUSTERS'] = 3
+app.config['TEMPLATE_NOVELTY_DISTANCE'] = 0.1
+app.config['TEMPLATE_OUTLIER_SAMPLE'] = 1024
+# 识别精度/速度配置: 特征采样次数(num_jitters, 0表示不抖动)、检测前缩放的短边像素(short_side, 0表示不缩放)、
+# 检测上采样次数(upsample)以及是否进行直方图均衡化(equalize)和高斯模糊(blur)预处理。
+# 检测框映射回原图坐标，关键点和特征向量仍在原始分辨率上计算
+app.config['RECOGNITION_PROFILES'] = {
+    'realtime': {'num_jitters': 0, 'short_side': 480, 'upsample': 1, 'equalize': False, 'blur': False},
+    'balanced': {'num_jitters': 3, 'short_side': 720, 'upsample': 1, 'equalize': False, 'blur': False},
+    'enroll': {'num_jitters': 10, 'short_side': 960, 'upsample': 1, 'equalize': True, 'blur': True},
+}
+# 各接口默认使用的配置，识别请求可以通过 profile 参数覆盖
+app.config['ENDPOINT_PROFILES'] = {
+    'recognize': 'balanced',
+    'recognize_frame': 'realtime',
+    'stream': 'realtime',
+    'video': 'balanced',
+    'enroll': 'enroll',
+}
+# FAISS索引配置: 类型(auto/flat/ivf/hnsw)、启用阈值、检索参数和索引文件
+app.config['FAISS_INDEX_TYPE'] = 'auto'
+app.config['FAISS_MIN_TEMPLATES'] = 100
+app.config['FAISS_ANN_THRESHOLD'] = 100000
+app.config['FAISS_NPROBE'] = 16
+app.config['FAISS_EF_SEARCH'] = 64
+app.config['FAISS_HNSW_M'] = 32
+app.config['FAISS_EF_CONSTRUCTION'] = 80
+app.config['FAISS_INDEX_PATH'] = os.path.join(parent_dir, 'data', 'gallery.faiss')
+# 人脸库特征文件 (float32特征矩阵 + int32身份编号 + 身份名称表)，各进程以内存映射方式共享同一份页缓存，
+# 多进程部署时只由合并人脸库增量的进程写入。
+# Windows不能替换已被映射的文件，默认不启用 (None: 人脸库只保存在各进程内存中)
+app.config['GALLERY_FILE'] = os.path.join(parent_dir, 'data', 'gallery.bin') if os.name != 'nt' else None
+# 人脸库增量部分的上限: 录入和删除只修改快照的增量部分 (新增代表特征精确检索，删除的行在检索时过滤)，
+# 新增代表特征数或删除的行数超过上限时在后台合并为新的基础部分 (重写特征矩阵、修补FAISS索引)
+app.config['GALLERY_DELTA_MAX_EXTRA'] = 2048
+app.config['GALLERY_DELTA_MAX_DEAD'] = 512
+# 从其他节点导入的代表特征 (没有录入图像)，启动时与本地人脸库合并；有本地录入图像的身份以本地为准
+app.config['IMPORTED_FEATURES'] = os.path.join(parent_dir, 'data', 'imported_features.bin')
+# 导出特征时每块的行数
+app.config['FEATURE_EXPORT_CHUNK_ROWS'] = 4096
+# 从其他节点下载特征文件时连接和每次读取的超时 (秒)
+app.config['FEATURE_IMPORT_TIMEOUT'] = 30
+# 人脸库元数据目录 (SQLite): 每个身份的图像数量、预览图、时间和录入质量，管理页面分页查询
+app.config['FACE_CATALOG'] = os.path.join(parent_dir, 'data', 'face_catalog.sqlite3')
+app.config['FACE_CATALOG_PAGE_SIZE'] = 50
+app.config['FACE_CATALOG_MAX_PAGE_SIZE'] = 500
+# 录入图像缩略图: 按特征描述文件中的人脸框裁剪缩放，首次请求时生成并缓存到磁盘
+app.config['THUMBNAIL_FOLDER'] = os.path.join(parent_dir, 'data', 'thumbnails')
+# 允许的缩略图边长 (像素)，第一个为默认值: 列表小图 / 详情大图
+app.config['THUMBNAIL_SIZES'] = (120, 320)
+# 人脸框向外扩展的比例 (相对人脸框边长)，保留头发和下巴
+app.config['THUMBNAIL_MARGIN'] = 0.4
+app.config['THUMBNAIL_JPEG_QUALITY'] = 85
+# 浏览器缓存有效期 (秒)，过期后凭ETag/Last-Modified验证，未变化时返回304
+app.config['THUMBNAIL_MAX_AGE'] = 30 * 24 * 3600
+# 实时识别人脸跟踪: 关联阈值、复核间隔帧数、触发复核的置信度、轨迹最大丢失帧数、
+# 轨迹最长未出现秒数 (客户端暂停或降低帧率后，同一位置的人脸重新识别)、会话过期秒数
+app.config['TRACKER_IOU_THRESHOLD'] = 0.3
+app.config['TRACKER_REVERIFY_INTERVAL'] = 10
+app.config['TRACKER_MIN_CONFIDENCE'] = 0.6
+app.config['TRACKER_MAX_MISSED'] = 5
+app.config['TRACKER_MAX_IDLE'] = 2.0
+app.config['TRACKER_SESSION_TTL'] = 60
+# 服务器端视频源: 保留的识别结果条数、打开或读取失败后的重试间隔(秒)，连续失败时间隔加倍直到上限
+app.config['STREAM_EVENT_HISTORY'] = 200
+app.config['STREAM_RECONNECT_DELAY'] = 3
+app.config['STREAM_RECONNECT_MAX_DELAY'] = 60
+# 多摄像头接入网关: IO线程数、识别线程数、默认每路帧率上限和事件历史长度
+app.config['GATEWAY_IO_WORKERS'] = 8
+app.config['GATEWAY_CPU_WORKERS'] = max(1, os.cpu_count() or 1)
+app.config['GATEWAY_DEFAULT_FPS'] = 5
+app.config['GATEWAY_EVENT_HISTORY'] = 1000
+# 启动参数 --camera 指定的视频源使用的接入方式: thread (每路独立线程) 或 gateway (接入网关)
+app.config['CAMERA_BACKEND'] = 'thread'
+# 视频文件识别: 允许的格式、默认抽帧步长、识别线程数、并行解码线程数、进度输出间隔(秒)、
+# 合并出现时间段的最大间隔(秒)、任务结束后保留时间(秒)
+app.config['ALLOWED_VIDEO_EXTENSIONS'] = {'mp4', 'avi', 'mov', 'mkv', 'webm', 'flv'}
+app.config['VIDEO_DEFAULT_STRIDE'] = 10
+app.config['VIDEO_WORKERS'] = max(1, min(4, os.cpu_count() or 1))
+app.config['VIDEO_DECODE_THREADS'] = 2
+app.config['VIDEO_PROGRESS_INTERVAL'] = 1.0
+app.config['VIDEO_APPEARANCE_GAP'] = 2.0
+app.config['VIDEO_JOB_TTL'] = 3600
+# 批量导入: 质量检查和特征提取的进程数(0表示在当前进程中执行)、每块图像数
+app.config['BULK_IMPORT_WORKERS'] = max(1, min(4, os.cpu_count() or 1))
+app.config['BULK_IMPORT_CHUNK'] = 16
+# 冷启动加载人脸库时并行提取特征的进程数 (0或1: 在当前进程中提取)
+app.config['GALLERY_LOAD_WORKERS'] = os.cpu_count() or 1
+# 需要提取特征的图像少于该数量时不启动加载工作池 (进程启动和模型加载本身需要数秒)
+app.config['GALLERY_LOAD_MIN_IMAGES'] = 64
+# 批量识别: 每块图像数、解码线程数和单张图像大小上限
+app.config['BATCH_RECOGNIZE_CHUNK'] = 16
+app.config['BATCH_RECOGNIZE_DECODE_THREADS'] = 4
+app.config['BATCH_RECOGNIZE_MAX_IMAGE_BYTES'] = 20 * 1024 * 1024
+# 多进程识别工作池: 工作进程数(0表示在请求线程中识别)和进程启动方式
+app.config['RECOGNITION_WORKERS'] = 0
+app.config['WORKER_START_METHOD'] = 'spawn'
+# 识别请求微批处理: 是否启用、最大批大小、第一帧到达后的最长等待时间(毫秒)和最大排队请求数
+app.config['RECOGNITION_BATCHING'] = False
+app.config['BATCH_MAX_SIZE'] = 8
+app.config['BATCH_MAX_WAIT_MS'] = 5
+app.config['BATCH_QUEUE_DEPTH'] = 64
+# 生产部署 (serve): HTTP工作进程数、每个工作进程处理多少请求后回收(加随机抖动)、优雅停止超时(秒)、
+# 工作进程独占内存上限(MB，0表示不限制)、内存报告间隔(秒)和多进程人脸库变更日志
+app.config['SERVE_WORKERS'] = max(1, min(4, os.cpu_count() or 1))
+app.config['SERVE_MAX_REQUESTS'] = 10000
+app.config['SERVE_MAX_REQUESTS_JITTER'] = 1000
+app.config['SERVE_GRACEFUL_TIMEOUT'] = 30
+app.config['SERVE_WORKER_MEMORY_LIMIT_MB'] = 0
+app.config['SERVE_MEMORY_REPORT_INTERVAL'] = 300
+app.config['GALLERY_JOURNAL'] = os.path.join(parent_dir, 'data', 'gallery_journal.log')
+app.config['SERVER_MODE'] = 'development'
+# /metrics 延迟直方图的桶上界 (秒)；预派生部署时各工作进程计数文件的目录和写出间隔 (秒)
+app.config['METRICS_BUCKETS'] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+app.config['METRICS_FOLDER'] = os.path.join(parent_dir, 'data', 'metrics')
+app.config['METRICS_FLUSH_INTERVAL'] = 5
+
+# 确保上传目录存在
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['UPLOAD_TEMP'], exist_ok=True)
+
+# 人脸特征维度
+FEATURE_DIM = 128
+
+def resolve_profile(profile_name, endpoint):
+    """解析识别配置: 未指定时使用接口默认配置，返回 (配置名, 配置)
+
+    配置名不存在时抛出ValueError。
+    """
+    profiles = app.config['RECOGNITION_PROFILES']
+    name = profile_name or app.config['ENDPOINT_PROFILES'].get(endpoint, 'balanced')
+    if name not in profiles:
+        raise ValueError(f"未知的识别配置: {name} (可选: {', '.join(profiles)})")
+    return name, profiles[name]
+
+def profile_signature(profile):
+    """配置参数标识，用于使旧的特征缓存失效"""
+    return json.dumps(profile, sort_keys=True)
+
+def file_sha1(path, chunk_size=1 << 20):
+    """计算文件内容的SHA1哈希"""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+class ProgressReporter:
+    """长时间任务的进度输出: 每隔 interval 秒输出已处理数量、处理速度和预计剩余时间"""
+    def __init__(self, label, total=None, interval=5):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start_time = time.time()
+        self._last_report = self.start_time
+    
+    @property
+    def rate(self):
+        elapsed = time.time() - self.start_time
+        return self.done / elapsed if elapsed > 0 else 0.0
+    
+    def update(self, count, detail=""):
+        """记录新完成的数量，距上次输出超过 interval 秒时输出一行进度"""
+        self.done += count
+        now = time.time()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            print(self.format(detail))
+    
+    def format(self, detail=""):
+        rate = self.rate
+        done = f"{self.done}/{self.total}" if self.total else f"{self.done}"
+        eta = f", 预计剩余 {(self.total - self.done) / rate:.0f} 秒" if self.total and rate else ""
+        return f"{self.label}: 已处理 {done} 张 ({rate:.1f} 张/秒){detail}{eta}"
+
+class LatencyMetrics:
+    """分阶段延迟直方图，以Prometheus文本格式导出
+
+    按 (接口, 阶段) 记录耗时分布，另外按接口记录整个请求的耗时。桶为累计上界 (秒)，
+    与Prometheus的histogram类型一致，可以用 histogram_quantile 计算p99。
+    预派生部署时每个工作进程定期把自己的计数写入共享目录 (<进程号>.json)，退出前再写出一次；
+    主进程回收工作进程后把它的计数并入 retired.json 并删除其文件，回收重启不会使计数减少。
+    /metrics 由处理请求的工作进程合并共享目录中的全部计数后输出。
+    """
+    RETIRED_FILE = 'retired.json'
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        # (指标, 接口, 阶段) -> 各桶计数 (最后一个为+Inf) + 耗时总和
+        self.series = {}
+        self.share_dir = None
+        self.flush_interval = 5
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flusher_pid = None
+    
+    def observe(self, endpoint, stages, total=None):
+        """记录一次请求: stages 为 {阶段: 秒}，total 为整个请求的耗时 (秒)"""
+        with self._lock:
+            for stage, seconds in stages.items():
+                self._observe(('stage', endpoint, stage), seconds)
+            if total is not None:
+                self._observe(('request', endpoint, ''), total)
+            self._dirty = True
+            # fork后的工作进程中启动自己的写出线程
+            start_flusher = self.share_dir is not None and self._flusher_pid != os.getpid()
+            if start_flusher:
+                self._flusher_pid = os.getpid()
+        if start_flusher:
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+    
+    def _observe(self, key, seconds):
+        entry = self.series.get(key)
+        if entry is None:
+            entry = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(self.buckets, seconds)] += 1
+        entry[-1] += seconds
+    
+    def share(self, share_dir, flush_interval):
+        """启用多进程共享计数 (在fork前的主进程中调用，清除上次运行留下的计数文件)"""
+        os.makedirs(share_dir, exist_ok=True)
+        for name in os.listdir(share_dir):
+            if name.endswith('.json'):
+                os.unlink(os.path.join(share_dir, name))
+        self.share_dir = share_dir
+        self.flush_interval = flush_interval
+    
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+    
+    def flush(self):
+        """把本进程的计数写入共享目录 (先写临时文件再原子替换)"""
+        with self._lock:
+            if self.share_dir is None or not self._dirty:
+                return
+            data = [[list(key), list(entry)] for key, entry in self.series.items()]
+            self._dirty = False
+        path = os.path.join(self.share_dir, f"{os.getpid()}.json")
+        try:
+            with open(f"{path}.tmp", 'w') as f:
+                json.dump(data, f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            print(f"写出延迟统计失败: {e}")
+    
+    def _merge(self, merged, data):
+        """把 [[键, 计数], ...] 形式的计数累加到 merged"""
+        for key, entry in data:
+            key = tuple(key)
+            if len(entry) != len(self.buckets) + 2:
+                continue
+            current = merged.get(key)
+            merged[key] = entry if current is None else [a + b for a, b in zip(current, entry)]
+    
+    def _read_retired(self):
+        """读取已退出工作进程的累计计数，返回 (已并入的进程号集合, 计数字典)"""
+        try:
+            with open(os.path.join(self.share_dir, self.RETIRED_FILE), 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return set(), {}
+        series = {}
+        self._merge(series, data.get('series', []))
+        return set(data.get('pids', [])), series
+    
+    def retire(self, pid):
+        """主进程回收工作进程后调用: 把它的计数并入 retired.json，再删除它的计数文件
+
+        retired.json 同时记录已并入、计数文件尚未删除的进程号，collect() 跳过这些文件，
+        替换 retired.json 和删除计数文件之间读取的计数也不会重复。
+        """
+        if self.share_dir is None:
+            return
+        path = os.path.join(self.share_dir, f"{pid}.json")
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        pids, series = self._read_retired()
+        if pid in pids:
+            return
+        self._merge(series, data)
+        try:
+            self._write_retired({pid}, series)
+            os.unlink(path)
+            # 计数文件已删除，不再记录该进程号 (进程号可能被新的工作进程复用)
+            self._write_retired(set(), series)
+        except OSError as e:
+            print(f"合并工作进程 {pid} 的延迟统计失败: {e}")
+    
+    def _write_retired(self, pids, series):
+        path = os.path.join(self.share_dir, self.RETIRED_FILE)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump({'pids': sorted(pids), 'series': [[list(key), entry] for key, entry in series.items()]}, f)
+        os.replace(f"{path}.tmp", path)
+    
+    def collect(self):
+        """返回合并了其他工作进程 (包括已退出的工作进程) 计数的 {(指标, 接口, 阶段): 计数}"""
+        with self._lock:
+            merged = {key: list(entry) for key, entry in self.series.items()}
+        if self.share_dir is None:
+            return merged
+        retired_pids, retired = self._read_retired()
+        self._merge(merged, retired.items())
+        try:
+            names = os.listdir(self.share_dir)
+        except OSError:
+            return merged
+        for name in names:
+            pid, ext = os.path.splitext(name)
+            if ext != '.json' or not pid.isdigit() or int(pid) == os.getpid() or int(pid) in retired_pids:
+                continue
+            try:
+                with open(os.path.join(self.share_dir, name), 'r') as f:
+                    self._merge(merged, json.load(f))
+            except (OSError, ValueError):
+                continue
+        return merged
+    
+    def render(self):
+        """Prometheus文本格式的直方图行"""
+        series = self.collect()
+        lines = []
+        for metric, help_text in (('stage', '识别请求各阶段耗时 (秒)'), ('request', '识别请求总耗时 (秒)')):
+            name = f"tianshu_{metric}_duration_seconds"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for key in sorted(k for k in series if k[0] == metric):
+                _, endpoint, stage = key
+                labels = f'endpoint="{endpoint}"' + (f',stage="{stage}"' if stage else '')
+                entry = series[key]
+                cumulative = 0
+                for bound, count in zip(self.buckets + (None,), entry[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound is None else f"{bound:g}"
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{labels}}} {entry[-1]:.6f}')
+                lines.append(f'{name}_count{{{labels}}} {cumulative}')
+        return lines
+
+def analysis_stages(timings):
+    """把人脸分析的耗时记录转换为 {阶段: 秒}"""
+    return {'preprocess': timings.get('preprocess_time', 0.0),
+            'detection': timings.get('detection_time', 0.0),
+            'landmarks': timings.get('landmark_time', 0.0),
+            'descriptor': timings.get('descriptor_time', 0.0)}
+
+# 人脸特征持久化缓存
+class DescriptorCache:
+    """人脸特征持久化缓存
+
+    以图像相对路径为键，记录文件大小、修改时间和内容哈希。
+    缓存同时记录模型文件标识，模型或提取参数变化时整体失效。
+    """
+    def __init__(self, cache_path, root_dir, model_id):
+        self.cache_path = cache_path
+        self.root_dir = root_dir
+        self.model_id = model_id
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._disk_state = None
+        self._save_pending = False
+        self._lock = threading.Lock()
+        self.load()
+
+    def _key(self, img_path):
+        """缓存键: 相对于人脸库根目录的路径"""
+        return os.path.relpath(img_path, self.root_dir).replace(os.sep, '/')
+
+    def _file_state(self):
+        """缓存文件的 (修改时间, 大小)，文件不存在时为None"""
+        try:
+            st = os.stat(self.cache_path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _read(self):
+        """读取磁盘上的缓存记录，文件不存在时返回空字典，模型不一致或读取失败时返回None"""
+        self._disk_state = self._file_state()
+        if self._disk_state is None:
+            return {}
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as data:
+                if str(data['model_id'][0]) != self.model_id:
+                    print("模型文件或提取参数已变化，特征缓存失效")
+                    return None
+                paths = data['paths']
+                sizes = data['sizes']
+                mtimes = data['mtimes']
+                hashes = data['hashes']
+                valid = data['valid']
+                features = data['features']
+            entries = {}
+            for i, path in enumerate(paths):
+                entries[str(path)] = {
+                    'size': int(sizes[i]),
+                    'mtime': int(mtimes[i]),
+                    'sha1': str(hashes[i]),
+                    'feature': features[i].copy() if valid[i] else None
+                }
+            return entries
+        except Exception as e:
+            print(f"读取特征缓存失败，将重新提取: {e}")
+            return None
+
+    def load(self):
+        """从磁盘加载缓存"""
+        entries = self._read()
+        self.entries = entries or {}
+        if entries is None:
+            self._dirty = True
+        elif entries:
+            print(f"已加载特征缓存: {len(self.entries)} 条记录")
+
+    def _merge_disk(self):
+        """合并其他进程写入磁盘的缓存记录，文件自上次读写后未变化时不读取 (调用方需持有 _lock)"""
+        if self._file_state() == self._disk_state:
+            return
+        for key, entry in (self._read() or {}).items():
+            local = self.entries.get(key)
+            if local is None or entry['mtime'] > local['mtime']:
+                self.entries[key] = entry
+
+    def refresh(self):
+        """合并其他工作进程保存的缓存记录，避免重新提取它们已经提取过的图像"""
+        with self._lock:
+            self._merge_disk()
+
+    def save(self):
+        """将缓存写回磁盘 (先合并其他进程保存的记录，再写临时文件后原子替换)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._merge_disk()
+            keys = sorted(self.entries)
+            count = len(keys)
+            features = np.zeros((count, FEATURE_DIM), dtype=np.float64)
+            valid = np.zeros(count, dtype=bool)
+            for i, key in enumerate(keys):
+                feature = self.entries[key]['feature']
+                if feature is not None:
+                    features[i] = feature
+                    valid[i] = True
+            # 临时文件名带进程号，多个工作进程同时保存时互不覆盖
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f,
+                             model_id=np.array([self.model_id]),
+                             paths=np.array(keys, dtype=str),
+                             sizes=np.array([self.entries[k]['size'] for k in keys], dtype=np.int64),
+                             mtimes=np.array([self.entries[k]['mtime'] for k in keys], dtype=np.int64),
+                             hashes=np.array([self.entries[k]['sha1'] for k in keys], dtype=str),
+                             valid=valid,
+                             features=features)
+                os.replace(tmp_path, self.cache_path)
+                self._disk_state = self._file_state()
+                self._dirty = False
+            except Exception as e:
+                print(f"保存特征缓存失败: {e}")
+
+    def schedule_save(self, delay):
+        """在后台延迟保存，期间的多次修改合并为一次写入"""
+        with self._lock:
+            if self._save_pending:
+                return
+            self._save_pending = True
+        
+        def save_later():
+            time.sleep(delay)
+            with self._lock:
+                self._save_pending = False
+            self.save()
+        
+        threading.Thread(target=save_later, daemon=True).start()
+
+    def lookup(self, img_path):
+        """查找图像特征
+
+        返回 (命中, 特征, 文件信息)。大小和修改时间一致时直接命中；
+        否则比较内容哈希，内容未变时同样命中并更新修改时间。
+        """
+        key = self._key(img_path)
+        st = os.stat(img_path)
+        info = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha1': None}
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry['size'] == info['size'] and entry['mtime'] == info['mtime']:
+            self.hits += 1
+            return True, entry['feature'], info
+        info['sha1'] = file_sha1(img_path)
+        if entry is not None and entry['sha1'] == info['sha1']:
+            with self._lock:
+                entry['mtime'] = info['mtime']
+                entry['size'] = info['size']
+                self._dirty = True
+            self.hits += 1
+            return True, entry['feature'], info
+        self.misses += 1
+        return False, None, info
+
+    def store(self, img_path, feature, info):
+        """记录图像特征 (提取失败时记录为None，避免每次启动重复尝试)"""
+        key = self._key(img_path)
+        if info.get('sha1') is None:
+            info['sha1'] = file_sha1(img_path)
+        with self._lock:
+            self.entries[key] = {
+                'size': info['size'],
+                'mtime': info['mtime'],
+                'sha1': info['sha1'],
+                'feature': None if feature is None else np.asarray(feature, dtype=np.float64)
+            }
+            self._dirty = True
+
+    def prune(self, seen_paths):
+        """删除已不存在的图像对应的缓存记录"""
+        seen_keys = {self._key(p) for p in seen_paths}
+        with self._lock:
+            stale = [k for k in self.entries if k not in seen_keys]
+            for key in stale:
+                del self.entries[key]
+            if stale:
+                self._dirty = True
+        return len(stale)
+
+    def reset_stats(self):
+        """重置命中统计"""
+        self.hits = 0
+        self.misses = 0
+
+# FAISS特征索引
+class GalleryIndex:
+    """FAISS特征索引封装
+
+    支持三种索引类型:
+      flat - 精确检索 (IndexFlatL2)，适合小规模人脸库
+      ivf  - 倒排索引 (IndexIVFFlat)，nprobe控制召回率与速度
+      hnsw - 图索引 (IndexHNSWFlat)，efSearch控制召回率与速度
+    FAISS返回的是平方L2距离，search() 统一换算为欧氏距离，与精确检索路径的阈值一致。
+    """
+    TYPES = ('flat', 'ivf', 'hnsw')
+    
+    def __init__(self, index_type='flat', nprobe=16, ef_search=64, hnsw_m=32, ef_construction=80):
+        if index_type not in self.TYPES:
+            raise ValueError(f"不支持的索引类型: {index_type}")
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.index = None
+        # 以内存映射方式加载时记录来源 (索引文件, 指纹)，修改前从文件读出可写副本
+        self.mapped_from = None
+    
+    @staticmethod
+    def resolve_type(configured_type, count, ann_threshold):
+        """解析索引类型: auto模式下小规模用flat，超过阈值用ivf"""
+        if configured_type == 'auto':
+            return 'ivf' if count >= ann_threshold else 'flat'
+        return configured_type
+    
+    @property
+    def ntotal(self):
+        return 0 if self.index is None else self.index.ntotal
+    
+    def params_signature(self):
+        """影响索引结构的参数 (不含可随时调整的检索参数)"""
+        if self.index_type == 'hnsw':
+            return f"hnsw|M={self.hnsw_m}|efc={self.ef_construction}"
+        return self.index_type
+    
+    def build(self, matrix):
+        """根据特征矩阵构建索引"""
+        dim = matrix.shape[1]
+        if self.index_type == 'ivf':
+            # 聚类中心数约为 4*sqrt(N)，训练样本至少为中心数的39倍
+            nlist = max(1, min(int(4 * np.sqrt(len(matrix))), len(matrix) // 39))
+            quantizer = faiss.IndexFlatL2(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_L2)
+            train_size = min(len(matrix), nlist * 256)
+            if train_size < len(matrix):
+                sample = matrix[np.random.RandomState(0).choice(len(matrix), train_size, replace=False)]
+            else:
+                sample = matrix
+            index.train(sample)
+            index.add(matrix)
+        elif self.index_type == 'hnsw':
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m)
+            index.hnsw.efConstruction = self.ef_construction
+            index.add(matrix)
+        else:
+            index = faiss.IndexFlatL2(dim)
+            index.add(matrix)
+        self.index = index
+        self.set_search_params()
+        return self
+    
+    def copy(self):
+        """复制索引，供新快照修改而不影响仍在使用旧快照的识别请求
+
+        内存映射的索引不能修改，从来源文件重新读入内存。
+        """
+        clone = GalleryIndex(self.index_type, self.nprobe, self.ef_search, self.hnsw_m, self.ef_construction)
+        if self.mapped_from is not None:
+            if not clone.load(*self.mapped_from):
+                raise RuntimeError("索引文件已被替换，无法复制内存映射的索引")
+        elif self.index is not None:
+            clone.index = faiss.clone_index(self.index)
+            clone.set_search_params()
+        return clone
+    
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """调整检索参数 (nprobe / efSearch)"""
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        if self.index is None:
+            return
+        if self.index_type == 'ivf':
+            self.index.nprobe = self.nprobe
+        elif self.index_type == 'hnsw':
+            self.index.hnsw.efSearch = self.ef_search
+    
+    def search(self, queries, k):
+        """检索最近的k个特征，返回 (欧氏距离, 行号)"""
+        distances, indices = self.index.search(np.ascontiguousarray(queries, dtype=np.float32), k)
+        return np.sqrt(np.maximum(distances, 0.0)), indices
+    
+    def remove_and_add(self, removed_rows, matrix, added_count):
+        """删除指定行并追加矩阵末尾的added_count行，使索引行号与新矩阵保持一致
+
+        flat索引删除后保持行顺序，可以原地修改；ivf保留训练好的聚类中心，
+        只重新分配向量；hnsw不支持删除，有删除时重建图。
+        """
+        if self.index_type == 'flat':
+            if removed_rows:
+                self.index.remove_ids(np.array(removed_rows, dtype='int64'))
+            if added_count:
+                self.index.add(matrix[-added_count:])
+        elif self.index_type == 'ivf':
+            if removed_rows:
+                self.index.reset()
+                self.index.add(matrix)
+            elif added_count:
+                self.index.add(matrix[-added_count:])
+        else:
+            if removed_rows:
+                self.build(matrix)
+            elif added_count:
+                self.index.add(matrix[-added_count:])
+        if self.index.ntotal != len(matrix):
+            raise RuntimeError("索引与特征数量不一致")
+    
+    def save(self, path, fingerprint):
+        """保存索引文件及其元数据 (都先写临时文件再原子替换)
+
+        替换索引文件前先删除元数据文件，load() 在读取索引前后两次读到相同的元数据时，
+        读到的索引文件一定与元数据对应。
+        """
+        meta_path = path + '.json'
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        faiss.write_index(self.index, tmp_path)
+        try:
+            os.unlink(meta_path)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+        meta = {
+            'fingerprint': fingerprint,
+            'index_type': self.index_type,
+            'params': self.params_signature(),
+            'ntotal': int(self.index.ntotal),
+            'saved_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        tmp_meta_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_meta_path, meta_path)
+    
+    @staticmethod
+    def _read_meta(meta_path):
+        """读取索引元数据，不存在时返回None"""
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+    
+    def load(self, path, fingerprint, count, mmap=False):
+        """加载与当前人脸库指纹一致、包含 count 个特征的索引文件，成功返回True
+
+        mmap 为True时以只读内存映射方式加载 (IVF倒排表)，多个工作进程共享页缓存中的同一份数据；
+        替换索引文件不影响已映射旧文件的进程。
+        """
+        meta_path = path + '.json'
+        if not os.path.exists(path):
+            return False
+        try:
+            meta = self._read_meta(meta_path)
+            if meta is None or meta.get('fingerprint') != fingerprint or meta.get('params') != self.params_signature():
+                return False
+            index = faiss.read_index(path, getattr(faiss, 'IO_FLAG_MMAP', 0) if mmap else 0)
+            # 读取期间索引文件被其他进程替换 (元数据已删除或已变化) 时放弃
+            if self._read_meta(meta_path) != meta:
+                return False
+            if index.ntotal != count:
+                print(f"索引文件特征数量 ({index.ntotal}) 与人脸库 ({count}) 不一致，重新构建")
+                return False
+            self.index = index
+            self.mapped_from = (path, fingerprint, count) if mmap else None
+            self.set_search_params()
+            return True
+        except Exception as e:
+            print(f"读取索引文件失败: {e}")
+            self.index = None
+            self.mapped_from = None
+            return False
+
+# 人脸库快照
+class GallerySnapshot:
+    """不可变的人脸库快照
+
+    由基础部分和增量部分组成。基础部分是归一化特征矩阵、每行对应的身份编号、身份名称表和FAISS索引，
+    可以是人脸库文件的只读内存映射；增量部分记录之后的录入和删除: masked 为已删除或被替换的基础身份编号
+    (dead_rows 为对应的行号)，extra_matrix / extra_names 为之后录入的代表特征。录入和删除只复制增量部分，
+    耗时与人脸库规模无关；增量部分超过阈值时合并为新的基础部分。
+    快照创建后不再修改，修改时构建新快照后整体替换 self._snapshot，识别线程取一次引用即可无锁读取，
+    始终看到特征、姓名和索引相互一致的人脸库。
+    """
+    __slots__ = ('version', 'matrix', 'name_ids', 'name_table', 'index', 'created_at',
+                 'masked', 'dead_rows', 'extra_matrix', 'extra_names', 'identity_count', 'rows')
+    
+    def __init__(self, version, features, names, index=None):
+        """features 为代表特征列表或矩阵 (按行归一化后保存)，names 为每行对应的姓名"""
+        name_table = []
+        name_to_id = {}
+        name_ids = np.empty(len(names), dtype=np.int32)
+        for i, name in enumerate(names):
+            if name not in name_to_id:
+                name_to_id[name] = len(name_table)
+                name_table.append(name)
+            name_ids[i] = name_to_id[name]
+        self._init(version, self._normalize(features), name_ids, tuple(name_table), index)
+    
+    @classmethod
+    def from_arrays(cls, version, matrix, name_ids, name_table, index=None):
+        """由已归一化的特征矩阵、身份编号和名称表直接创建快照 (不复制数组)"""
+        snapshot = cls.__new__(cls)
+        snapshot._init(version, matrix, name_ids, tuple(name_table), index)
+        return snapshot
+    
+    @staticmethod
+    def _normalize(features):
+        """代表特征按行归一化为连续的float32矩阵"""
+        matrix = np.array(features, dtype=np.float32).reshape(-1, FEATURE_DIM)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        return np.ascontiguousarray(matrix)
+    
+    def _init(self, version, matrix, name_ids, name_table, index):
+        if matrix.flags.writeable:
+            matrix.setflags(write=False)
+        if name_ids.flags.writeable:
+            name_ids.setflags(write=False)
+        self.version = version
+        self.matrix = matrix
+        self.name_ids = name_ids
+        self.name_table = name_table
+        self.index = index
+        self.created_at = time.time()
+        self.masked = frozenset()
+        self.dead_rows = np.zeros(0, dtype=np.int64)
+        self.extra_matrix = np.zeros((0, FEATURE_DIM), dtype=np.float32)
+        self.extra_names = ()
+        self.identity_count = len(name_table)
+        self.rows = None
+    
+    @property
+    def features(self):
+        """代表特征 (归一化特征矩阵的各行)"""
+        return self.live_arrays()[0]
+    
+    @property
+    def names(self):
+        """每个代表特征对应的姓名"""
+        _, name_ids, name_table = self.live_arrays()
+        return tuple(name_table[i] for i in name_ids)
+    
+    @property
+    def use_faiss(self):
+        return self.index is not None
+    
+    @property
+    def delta_size(self):
+        """增量部分的规模: (已删除的基础行数, 增量代表特征数)"""
+        return len(self.dead_rows), len(self.extra_names)
+    
+    def __len__(self):
+        return self.matrix.shape[0] - len(self.dead_rows) + len(self.extra_names)
+    
+    def _base_rows(self):
+        """基础部分的 姓名->身份编号 表和按身份排列的行号 (首次使用时构建，由同一基础部分派生的快照共享)"""
+        if self.rows is None:
+            order = np.argsort(self.name_ids, kind='stable')
+            bounds = np.zeros(len(self.name_table) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.name_ids, minlength=len(self.name_table)), out=bounds[1:])
+            self.rows = ({name: i for i, name in enumerate(self.name_table)}, order, bounds)
+        return self.rows
+    
+    def contains(self, person):
+        """人脸库中是否有该身份的代表特征"""
+        name_id = self._base_rows()[0].get(person)
+        return (name_id is not None and name_id not in self.masked) or person in self.extra_names
+    
+    def updated(self, version, persons, features, names):
+        """删除指定身份并追加新的代表特征，返回 (新快照, 删除的代表特征数)
+
+        只复制增量部分，基础部分的特征矩阵、身份编号和索引由新快照共享。
+        """
+        persons = set(persons)
+        name_to_id, order, bounds = self._base_rows()
+        masked = set(self.masked)
+        dead = [self.dead_rows]
+        removed_persons = set()
+        for person in persons:
+            name_id = name_to_id.get(person)
+            if name_id is not None and name_id not in masked:
+                masked.add(name_id)
+                dead.append(order[bounds[name_id]:bounds[name_id + 1]])
+                removed_persons.add(person)
+        keep = [i for i, name in enumerate(self.extra_names) if name not in persons]
+        removed_persons.update(name for name in self.extra_names if name in persons)
+        
+        snapshot = GallerySnapshot.from_arrays(version, self.matrix, self.name_ids, self.name_table, self.index)
+        snapshot.rows = self.rows
+        snapshot.masked = frozenset(masked)
+        snapshot.dead_rows = np.sort(np.concatenate(dead))
+        snapshot.extra_matrix = np.vstack([self.extra_matrix[keep], self._normalize(features)])
+        snapshot.extra_matrix.setflags(write=False)
+        snapshot.extra_names = tuple(self.extra_names[i] for i in keep) + tuple(names)
+        snapshot.identity_count = self.identity_count - len(removed_persons) + len(set(names))
+        removed = len(snapshot.dead_rows) - len(self.dead_rows) + len(self.extra_names) - len(keep)
+        return snapshot, removed
+    
+    def live_arrays(self):
+        """合并增量部分后的 (特征矩阵, 身份编号, 名称表)：基础部分剩余的行在前，增量特征在后
+
+        没有增量时直接返回基础部分的数组 (不复制)。
+        """
+        if not len(self.dead_rows) and not self.extra_names:
+            return self.matrix, self.name_ids, self.name_table
+        keep = np.ones(self.matrix.shape[0], dtype=bool)
+        keep[self.dead_rows] = False
+        live_ids = self.name_ids[keep]
+        used = np.zeros(len(self.name_table), dtype=bool)
+        used[live_ids] = True
+        remap = np.cumsum(used) - 1
+        name_table = [name for name, in_use in zip(self.name_table, used) if in_use]
+        name_to_id = {name: i for i, name in enumerate(name_table)}
+        extra_ids = np.empty(len(self.extra_names), dtype=np.int32)
+        for i, name in enumerate(self.extra_names):
+            if name not in name_to_id:
+                name_to_id[name] = len(name_table)
+                name_table.append(name)
+            extra_ids[i] = name_to_id[name]
+        matrix = np.ascontiguousarray(np.vstack([self.matrix[keep], self.extra_matrix]))
+        name_ids = np.concatenate([remap[live_ids], extra_ids]).astype(np.int32)
+        return matrix, name_ids, tuple(name_table)
+    
+    def without(self, persons):
+        """去掉指定身份后剩余的人脸库，返回 (删除的行号, 剩余特征矩阵, 剩余姓名列表)"""
+        matrix, name_ids, name_table = self.live_arrays()
+        removed_ids = [i for i, name in enumerate(name_table) if name in persons]
+        removed = np.isin(name_ids, removed_ids)
+        return (np.flatnonzero(removed).tolist(), matrix[~removed],
+                [name_table[i] for i in name_ids[~removed]])
+    
+    def fingerprint(self):
+        """基础部分的内容指纹，用于判断索引文件是否可以直接复用"""
+        return hashlib.sha1(memoryview(np.ascontiguousarray(self.matrix))).hexdigest() + f":{self.matrix.shape[0]}"
+
+class GalleryFile:
+    """人脸库特征文件
+
+    64字节文件头 (魔数、行数、特征维度、名称表字节数、人脸库版本) 之后依次是 float32 归一化特征矩阵、
+    int32 身份编号列和 JSON 身份名称表。各进程用 np.memmap 只读映射，多个工作进程共享页缓存中的同一份数据。
+    先写临时文件、映射后再原子替换正式文件，已映射旧文件的进程和快照不受影响。
+    """
+    MAGIC = b'TSGALLRY'
+    HEADER = struct.Struct('<8sIIIQ')
+    DATA_OFFSET = 64
+    
+    @classmethod
+    def iter_bytes(cls, matrix, name_ids, name_table, chunk_rows=4096, version=0):
+        """按块产出文件内容，用于写入文件或流式传输 (每块最多 chunk_rows 行特征)"""
+        names_data = json.dumps(list(name_table), ensure_ascii=False).encode('utf-8')
+        yield cls.HEADER.pack(cls.MAGIC, len(matrix), FEATURE_DIM, len(names_data),
+                              version).ljust(cls.DATA_OFFSET, b'\0')
+        for start in range(0, len(matrix), chunk_rows):
+            yield np.ascontiguousarray(matrix[start:start + chunk_rows], dtype='<f4').tobytes()
+        yield np.ascontiguousarray(name_ids, dtype='<i4').tobytes()
+        yield names_data
+    
+    @classmethod
+    def write(cls, path, matrix, name_ids, name_table, version=0):
+        """写入临时文件并返回其路径"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            for chunk in cls.iter_bytes(matrix, name_ids, name_table, version=version):
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp_path
+    
+    @classmethod
+    def open(cls, path, copy=False):
+        """只读映射人脸库文件，返回 (特征矩阵, 身份编号, 名称表)；copy 为True时读入内存，不保留映射"""
+        with open(path, 'rb') as f:
+            magic, rows, dim, names_size, _ = cls.HEADER.unpack(f.read(cls.HEADER.size))
+            if magic != cls.MAGIC or dim != FEATURE_DIM:
+                raise ValueError(f"无效的人脸库文件: {path}")
+            ids_offset = cls.DATA_OFFSET + rows * dim * 4
+            if os.fstat(f.fileno()).st_size < ids_offset + rows * 4 + names_size:
+                raise ValueError(f"人脸库文件不完整: {path}")
+            f.seek(ids_offset + rows * 4)
+            name_table = tuple(json.loads(f.read(names_size).decode('utf-8')))
+        if rows == 0:
+            return np.zeros((0, dim), dtype=np.float32), np.zeros(0, dtype=np.int32), name_table
+        matrix = np.memmap(path, dtype='<f4', mode='r', offset=cls.DATA_OFFSET, shape=(rows, dim))
+        name_ids = np.memmap(path, dtype='<i4', mode='r', offset=ids_offset, shape=(rows,))
+        if name_ids.min() < 0 or name_ids.max() >= len(name_table):
+            raise ValueError(f"人脸库文件身份编号无效: {path}")
+        if copy:
+            return np.array(matrix), np.array(name_ids), name_table
+        return matrix, name_ids, name_table
+    
+    @classmethod
+    def read_version(cls, path):
+        """读取文件头中的人脸库版本 (旧版文件为0)，文件不存在或无效时返回None"""
+        try:
+            with open(path, 'rb') as f:
+                magic, _, _, _, version = cls.HEADER.unpack(f.read(cls.HEADER.size))
+        except (OSError, struct.error):
+            return None
+        return version if magic == cls.MAGIC else None
+    
+    @classmethod
+    def publish(cls, path, snapshot):
+        """把快照写入人脸库文件，返回映射该文件的同版本快照"""
+        tmp_path = cls.write(path, snapshot.matrix, snapshot.name_ids, snapshot.name_table, snapshot.version)
+        try:
+            matrix, name_ids, name_table = cls.open(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return GallerySnapshot.from_arrays(snapshot.version, matrix, name_ids, name_table, snapshot.index)
+
+def read_feature_csv(data):
+    """读取旧版特征CSV (每行: 姓名,128维特征，无表头，GBK或UTF-8编码)，返回 (特征列表, 姓名列表)
+
+    全零特征 (录入时未检测到人脸) 跳过。
+    """
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = data.decode('gb18030')
+    features = []
+    names = []
+    for line_no, row in enumerate(csv.reader(io.StringIO(text)), 1):
+        if not row:
+            continue
+        if len(row) != FEATURE_DIM + 1 or not row[0].strip():
+            raise ValueError(f"特征CSV第 {line_no} 行格式错误: 应为姓名和 {FEATURE_DIM} 维特征")
+        feature = np.array(row[1:], dtype=np.float64)
+        if not np.any(feature):
+            continue
+        features.append(feature)
+        names.append(row[0].strip())
+    return features, names
+
+def iter_feature_csv(snapshot, chunk_rows=4096):
+    """按块产出旧版特征CSV (GBK兼容的GB18030编码)，每个代表特征一行"""
+    matrix, name_ids, name_table = snapshot.live_arrays()
+    for start in range(0, len(matrix), chunk_rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        for feature, name_id in zip(matrix[start:start + chunk_rows], name_ids[start:start + chunk_rows]):
+            writer.writerow([name_table[name_id]] + [repr(float(v)) for v in feature])
+        yield buffer.getvalue().encode('gb18030')
+
+def read_feature_file(path):
+    """读取特征文件 (人脸库二进制格式或旧版CSV)，返回 (特征, 姓名列表)"""
+    with open(path, 'rb') as f:
+        magic = f.read(len(GalleryFile.MAGIC))
+    if magic == GalleryFile.MAGIC:
+        matrix, name_ids, name_table = GalleryFile.open(path, copy=os.name == 'nt')
+        return matrix, [name_table[i] for i in name_ids]
+    with open(path, 'rb') as f:
+        return read_feature_csv(f.read())
+
+# 人脸库变更日志
+class GalleryJournal:
+    """多进程部署时的人脸库变更日志
+
+    每个工作进程持有独立的人脸库快照。录入、删除或导入人脸的进程在持有日志文件排他锁期间，
+    先应用其他进程的记录，再修改自己的快照并在文件末尾追加一行JSON: 新的快照版本、删除或替换的身份、
+    新增的代表特征 (Base64编码的float32归一化矩阵) 和姓名。其他工作进程在处理请求前读取新增的记录，
+    一次应用到自己的快照，不需要重新提取特征。记录在文件中的顺序就是版本顺序，各进程的快照版本一致。
+    修改人脸库的进程合并增量部分后只由它写入一次人脸库文件，并追加一条 base 记录 (文件头中的版本)，
+    其他进程映射同一个文件，不再各自写入。
+    """
+    
+    def __init__(self, path, reset=False):
+        self.path = path
+        self.lock = threading.RLock()
+        if reset or not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8'):
+                pass
+        self.offset = os.path.getsize(path)
+        self._fd = None
+        self._fd_pid = None
+        self._exclusive = False
+    
+    def _lock_fd(self):
+        """本进程用于文件锁的文件描述符 (fork后继承的描述符与父进程共享锁，需要重新打开)"""
+        if self._fd_pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+            self._fd_pid = os.getpid()
+        return self._fd
+    
+    @contextmanager
+    def exclusive(self):
+        """持有日志文件的排他锁 (同一时间只有一个进程修改人脸库)"""
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+            fd = self._lock_fd()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self._exclusive = True
+            try:
+                yield
+            finally:
+                self._exclusive = False
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    
+    @contextmanager
+    def shared(self):
+        """持有日志文件的共享锁 (读取记录和人脸库文件期间没有进程修改人脸库)；本进程已持有排他锁时直接进入"""
+        with self.lock:
+            if fcntl is None or self._exclusive:
+                yield
+                return
+            fd = self._lock_fd()
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    
+    def changed(self):
+        """是否有尚未读取的记录 (只比较文件长度，不加锁)"""
+        try:
+            return os.path.getsize(self.path) > self.offset
+        except OSError:
+            return False
+    
+    def record(self, entry):
+        """追加一条变更记录 (调用方需持有 exclusive()，且已读取此前的全部记录)"""
+        entry['pid'] = os.getpid()
+        data = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+        with self.lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+            finally:
+                os.close(fd)
+            self.offset += len(data)
+    
+    def pending(self):
+        """返回尚未读取的完整记录 (按写入顺序，同一条记录只返回一次)"""
+        with self.lock:
+            try:
+                size = os.path.getsize(self.path)
+            except OSError:
+                return []
+            if size <= self.offset:
+                return []
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read(size - self.offset)
+            # 只处理完整的行
+            end = data.rfind(b'\n') + 1
+            self.offset += end
+        
+        entries = []
+        for line in data[:end].decode('utf-8').splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                print(f"忽略无效的人脸库变更记录: {line[:80]}")
+        return entries
+    
+    @staticmethod
+    def encode_features(matrix):
+        """代表特征矩阵编码为Base64字符串"""
+        return base64.b64encode(np.ascontiguousarray(matrix, dtype='<f4').tobytes()).decode('ascii')
+    
+    @staticmethod
+    def decode_features(data):
+        """Base64字符串解码为代表特征矩阵"""
+        return np.frombuffer(base64.b64decode(data), dtype='<f4').reshape(-1, FEATURE_DIM)
+
+# 人脸跟踪器
+class FaceTracker:
+    """单个摄像头会话的人脸跟踪器
+
+    通过检测框IoU把当前帧的人脸关联到已有轨迹，轨迹缓存已识别的身份。
+    只有新轨迹、距上次复核已满 reverify_interval 帧、或已知身份置信度
+    低于 min_confidence 的轨迹才需要重新计算特征。
+    丢失帧数按收到的帧计算，超过 max_idle 秒未出现的轨迹同样删除，帧之间间隔很长时不会沿用旧身份。
+    """
+    def __init__(self, iou_threshold=0.3, reverify_interval=10, min_confidence=0.6, max_missed=5, max_idle=2.0):
+        self.iou_threshold = iou_threshold
+        self.reverify_interval = reverify_interval
+        self.min_confidence = min_confidence
+        self.max_missed = max_missed
+        self.max_idle = max_idle
+        self.tracks = {}
+        self.next_id = 1
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+    
+    def __getstate__(self):
+        # 锁不能跨进程传递，发送到工作进程时去掉
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def iou(a, b):
+        """两个 [x1, y1, x2, y2] 框的交并比"""
+        ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+        iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+        inter = ix * iy
+        union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+        return inter / union if union > 0 else 0.0
+    
+    def associate(self, rects):
+        """把当前帧的人脸框关联到轨迹，返回与rects一一对应的轨迹列表
+
+        按IoU从大到小贪心匹配；未匹配的人脸新建轨迹，连续丢失超过max_missed帧或超过max_idle秒
+        未出现的轨迹被删除。
+        """
+        now = time.time()
+        self.last_used = now
+        for track_id in [k for k, t in self.tracks.items() if now - t['last_seen'] > self.max_idle]:
+            del self.tracks[track_id]
+        pairs = []
+        for track_id, track in self.tracks.items():
+            for i, rect in enumerate(rects):
+                overlap = self.iou(track['rect'], rect)
+                if overlap >= self.iou_threshold:
+                    pairs.append((overlap, track_id, i))
+        pairs.sort(reverse=True)
+        
+        assigned = [None] * len(rects)
+        used_tracks = set()
+        for _, track_id, i in pairs:
+            if track_id in used_tracks or assigned[i] is not None:
+                continue
+            track = self.tracks[track_id]
+            track['rect'] = rects[i]
+            track['missed'] = 0
+            track['last_seen'] = now
+            track['since_verify'] += 1
+            assigned[i] = track
+            used_tracks.add(track_id)
+        
+        # 未匹配的轨迹记为丢失
+        for track_id in list(self.tracks):
+            if track_id not in used_tracks:
+                self.tracks[track_id]['missed'] += 1
+                if self.tracks[track_id]['missed'] > self.max_missed:
+                    del self.tracks[track_id]
+        
+        # 未匹配的人脸新建轨迹
+        for i, rect in enumerate(rects):
+            if assigned[i] is None:
+                track = {'id': self.next_id, 'rect': rect, 'name': None, 'distance': 1.0,
+                         'confidence': 0.0, 'since_verify': 0, 'missed': 0, 'last_seen': now}
+                self.tracks[self.next_id] = track
+                self.next_id += 1
+                assigned[i] = track
+        return assigned
+    
+    def needs_verify(self, track):
+        """判断轨迹是否需要重新计算特征复核身份"""
+        if track['name'] is None or track['since_verify'] >= self.reverify_interval:
+            return True
+        return track['name'] != 'unknown' and track['confidence'] < self.min_confidence
+    
+    @staticmethod
+    def record(track, name, distance, confidence):
+        """记录复核后的身份"""
+        track['name'] = name
+        track['distance'] = distance
+        track['confidence'] = confidence
+        track['since_verify'] = 0
+
+class TrackerRegistry:
+    """按摄像头会话ID管理人脸跟踪器，长时间未使用的会话自动清理"""
+    def __init__(self):
+        self._trackers = {}
+        self._lock = threading.Lock()
+    
+    def get(self, session_id):
+        """获取 (必要时创建) 会话对应的跟踪器"""
+        now = time.time()
+        ttl = app.config['TRACKER_SESSION_TTL']
+        with self._lock:
+            for key in [k for k, t in self._trackers.items() if now - t.last_used > ttl]:
+                del self._trackers[key]
+            tracker = self._trackers.get(session_id)
+            if tracker is None:
+                tracker = FaceTracker(iou_threshold=app.config['TRACKER_IOU_THRESHOLD'],
+                                      reverify_interval=app.config['TRACKER_REVERIFY_INTERVAL'],
+                                      min_confidence=app.config['TRACKER_MIN_CONFIDENCE'],
+                                      max_missed=app.config['TRACKER_MAX_MISSED'],
+                                      max_idle=app.config['TRACKER_MAX_IDLE'])
+                self._trackers[session_id] = tracker
+            # 每次取用都刷新，跟踪器在工作进程中关联时也不会被当作过期会话清理
+            tracker.last_used = now
+            return tracker
+    
+    def __len__(self):
+        return len(self._trackers)
+
+def reconnect_delay(failures):
+    """视频源连续失败 failures 次后的重试间隔 (秒): 从 STREAM_RECONNECT_DELAY 开始加倍，不超过上限"""
+    delay = app.config['STREAM_RECONNECT_DELAY'] * 2 ** min(max(failures - 1, 0), 16)
+    return min(delay, app.config['STREAM_RECONNECT_MAX_DELAY'])
+
+# 服务器端摄像头采集
+class CameraStream:
+    """服务器端摄像头采集与识别
+
+    采集线程持续读取 cv2.VideoCapture 的帧，只保留最新一帧 (新帧覆盖旧帧)；
+    识别线程每次取最新帧识别，保存带标注的JPEG和最近的识别结果。
+    视频源可以是设备编号、视频文件路径或网络流地址，视频文件按原始帧率回放。
+    """
+    def __init__(self, stream_id, source, profile=None, loop=False):
+        self.stream_id = stream_id
+        self.source = int(source) if str(source).isdigit() else source
+        self.profile_name, _ = resolve_profile(profile, 'stream')
+        self.loop = loop
+        self.tracker = FaceTracker(iou_threshold=app.config['TRACKER_IOU_THRESHOLD'],
+                                   reverify_interval=app.config['TRACKER_REVERIFY_INTERVAL'],
+                                   min_confidence=app.config['TRACKER_MIN_CONFIDENCE'],
+                                   max_missed=app.config['TRACKER_MAX_MISSED'],
+                                   max_idle=app.config['TRACKER_MAX_IDLE'])
+        self.running = False
+        self.error = None
+        self.started_at = None
+        
+        # 最新帧 (采集线程写入，识别线程读取)
+        self._frame_cond = threading.Condition()
+        self._latest_frame = None
+        self._frame_seq = 0
+        
+        # 最新识别结果 (识别线程写入，接口读取)
+        self._result_cond = threading.Condition()
+        self._latest_jpeg = None
+        self._result_seq = 0
+        self.events = deque(maxlen=app.config['STREAM_EVENT_HISTORY'])
+        
+        self.stats = {'frames_captured': 0, 'frames_processed': 0, 'frames_dropped': 0,
+                      'last_process_ms': 0, 'capture_fps': 0.0}
+        self._threads = []
+    
+    def start(self):
+        """启动采集线程和识别线程"""
+        self.running = True
+        self.started_at = time.time()
+        self._threads = [threading.Thread(target=self._capture_loop, name=f"capture-{self.stream_id}", daemon=True),
+                         threading.Thread(target=self._recognize_loop, name=f"recognize-{self.stream_id}", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+    
+    def stop(self):
+        """停止采集和识别"""
+        self.running = False
+        with self._frame_cond:
+            self._frame_cond.notify_all()
+        with self._result_cond:
+            self._result_cond.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=5)
+    
+    def _open_capture(self):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        return cap
+    
+    def _capture_loop(self):
+        """采集线程: 读取帧并覆盖最新帧，识别跟不上时旧帧直接丢弃"""
+        is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+        cap = None
+        frame_interval = 0
+        failures = 0
+        frames_since_open = 0
+        window_start, window_frames = time.time(), 0
+        while self.running:
+            if cap is None:
+                cap = self._open_capture()
+                if cap is None:
+                    failures += 1
+                    self._wait_reconnect(f"无法打开视频源: {self.source}", failures)
+                    continue
+                self.error = None
+                frames_since_open = 0
+                fps = cap.get(cv2.CAP_PROP_FPS) if is_file else 0
+                frame_interval = 1.0 / fps if fps and fps > 0 else 0
+            
+            read_start = time.time()
+            ok, frame = cap.read()
+            if not ok:
+                cap.release()
+                cap = None
+                if is_file and not self.loop:
+                    print(f"[{self.stream_id}] 视频文件播放结束")
+                    break
+                # 循环播放的视频文件读到末尾后立即重新打开；断开的摄像头或网络流等待后重连，
+                # 避免失效的视频源陷入不停重连的空转
+                if not (is_file and frames_since_open):
+                    failures += 1
+                    self._wait_reconnect(f"读取视频源失败: {self.source}", failures)
+                continue
+            failures = 0
+            frames_since_open += 1
+            
+            with self._frame_cond:
+                if self._latest_frame is not None:
+                    self.stats['frames_dropped'] += 1
+                self._latest_frame = frame
+                self._frame_seq += 1
+                self.stats['frames_captured'] += 1
+                self._frame_cond.notify()
+            
+            window_frames += 1
+            if time.time() - window_start >= 1.0:
+                self.stats['capture_fps'] = round(window_frames / (time.time() - window_start), 1)
+                window_start, window_frames = time.time(), 0
+            
+            # 视频文件按原始帧率回放，模拟实时摄像头
+            if frame_interval:
+                delay = frame_interval - (time.time() - read_start)
+                if delay > 0:
+                    time.sleep(delay)
+        
+        if cap is not None:
+            cap.release()
+        self.running = False
+        with self._frame_cond:
+            self._frame_cond.notify_all()
+    
+    def _wait_reconnect(self, error, failures):
+        """记录错误并等待重连 (连续失败时间隔加倍)，停止时立即返回"""
+        self.error = error
+        delay = reconnect_delay(failures)
+        print(f"[{self.stream_id}] {error}，{delay:g} 秒后重试")
+        deadline = time.time() + delay
+        while self.running and time.time() < deadline:
+            time.sleep(max(0.0, min(0.5, deadline - time.time())))
+    
+    def _recognize_loop(self):
+        """识别线程: 取最新帧识别并生成标注图像"""
+        while True:
+            with self._frame_cond:
+                while self.running and self._latest_frame is None:
+                    self._frame_cond.wait(timeout=1.0)
+                if self._latest_frame is None:
+                    break
+                frame, seq = self._latest_frame, self._frame_seq
+                self._latest_frame = None
+            
+            if face_core is None:
+                time.sleep(0.1)
+                continue
+            
+            start_time = time.time()
+            performance = {}
+            try:
+                results = face_core.recognize_face(frame, self.profile_name, performance, self.tracker)
+            except Exception as e:
+                print(f"[{self.stream_id}] 识别错误: {e}")
+                continue
+            stages = performance['stage_seconds']
+            draw_start = time.time()
+            annotated = face_core.draw_face_rects(frame, results, in_place=True)
+            encode_start = time.time()
+            ok, buffer = cv2.imencode('.jpg', annotated)
+            stages['draw'] = encode_start - draw_start
+            stages['encode'] = time.time() - encode_start
+            elapsed = time.time() - start_time
+            latency_metrics.observe('camera', stages, elapsed)
+            
+            event = {
+                'seq': seq,
+                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+                'faces': results,
+                'process_ms': round(elapsed * 1000, 1),
+                'gallery_version': performance.get('gallery_version')
+            }
+            with self._result_cond:
+                if ok:
+                    self._latest_jpeg = buffer.tobytes()
+                self._result_seq = seq
+                self.events.append(event)
+                self.stats['frames_processed'] += 1
+                self.stats['last_process_ms'] = event['process_ms']
+                self._result_cond.notify_all()
+    
+    def mjpeg_frames(self):
+        """生成 multipart/x-mixed-replace 响应的各个部分，每有新的标注帧输出一次"""
+        last_seq = -1
+        while True:
+            with self._result_cond:
+                while self.running and self._result_seq == last_seq:
+                    self._result_cond.wait(timeout=1.0)
+                if self._result_seq == last_seq or self._latest_jpeg is None:
+                    if not self.running:
+                        return
+                    continue
+                jpeg, last_seq = self._latest_jpeg, self._result_seq
+            yield (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: ' +
+                   str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+    
+    def results_since(self, since_seq=0):
+        """返回帧序号大于 since_seq 的识别结果"""
+        with self._result_cond:
+            return [e for e in self.events if e['seq'] > since_seq]
+    
+    def status(self):
+        """视频源状态"""
+        return {
+            'stream_id': self.stream_id,
+            'source': str(self.source),
+            'profile': self.profile_name,
+            'running': self.running,
+            'error': self.error,
+            'uptime': round(time.time() - self.started_at, 1) if self.started_at else 0,
+            'last_seq': self._result_seq,
+            **self.stats
+        }
+
+class CameraManager:
+    """管理所有服务器端视频源"""
+    def __init__(self):
+        self._streams = {}
+        self._lock = threading.Lock()
+    
+    def add(self, source, stream_id=None, profile=None, loop=False):
+        """添加并启动视频源，返回 (成功, 消息或视频源)"""
+        with self._lock:
+            if stream_id is None:
+                stream_id = f"cam{len(self._streams) + 1}"
+                while stream_id in self._streams:
+                    stream_id += "_"
+            if stream_id in self._streams:
+                return False, f"视频源 {stream_id} 已存在"
+            stream = CameraStream(stream_id, source, profile, loop)
+            self._streams[stream_id] = stream
+        stream.start()
+        print(f"已启动视频源 {stream_id}: {source}")
+        return True, stream
+    
+    def remove(self, stream_id):
+        """停止并移除视频源"""
+        with self._lock:
+            stream = self._streams.pop(stream_id, None)
+        if stream is None:
+            return False
+        stream.stop()
+        print(f"已停止视频源 {stream_id}")
+        return True
+    
+    def get(self, stream_id):
+        return self._streams.get(stream_id)
+    
+    def list(self):
+        return [stream.status() for stream in list(self._streams.values())]
+    
+    def stop_all(self):
+        for stream_id in list(self._streams):
+            self.remove(stream_id)
+
+# 多摄像头接入网关
+class GatewaySource:
+    """接入网关中的单个视频源
+
+    只保存最新一帧 (新帧覆盖未处理的旧帧)。超过帧率上限的帧只grab不解码，直接跳过。
+    """
+    def __init__(self, source_id, source, profile=None, fps_cap=None, loop=False):
+        self.source_id = source_id
+        self.source = int(source) if str(source).isdigit() else source
+        self.profile_name, _ = resolve_profile(profile, 'stream')
+        self.fps_cap = fps_cap if fps_cap is not None else app.config['GATEWAY_DEFAULT_FPS']
+        self.loop = loop
+        self.is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+        self.tracker = FaceTracker(iou_threshold=app.config['TRACKER_IOU_THRESHOLD'],
+                                   reverify_interval=app.config['TRACKER_REVERIFY_INTERVAL'],
+                                   min_confidence=app.config['TRACKER_MIN_CONFIDENCE'],
+                                   max_missed=app.config['TRACKER_MAX_MISSED'],
+                                   max_idle=app.config['TRACKER_MAX_IDLE'])
+        self.cap = None
+        self.frame_interval = 0
+        self.next_due = 0.0
+        self.running = True
+        self.error = None
+        self.started_at = time.time()
+        
+        # 最新帧 (帧, 序号, 采集时间)，以及通知处理协程的事件 (在网关事件循环中创建)
+        self.latest = None
+        self.frame_ready = None
+        self.seq = 0
+        
+        self.latencies = deque(maxlen=200)
+        self.stats = {'frames_captured': 0, 'frames_processed': 0, 'frames_dropped': 0,
+                      'frames_skipped': 0, 'last_process_ms': 0, 'last_latency_ms': 0}
+    
+    def open(self):
+        """打开视频源 (在IO线程池中执行)"""
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            cap.release()
+            return False
+        fps = cap.get(cv2.CAP_PROP_FPS) if self.is_file else 0
+        self.frame_interval = 1.0 / fps if fps and fps > 0 else 0
+        self.cap = cap
+        return True
+    
+    def read_next(self):
+        """读取下一帧 (在IO线程池中执行)，返回 (是否成功, 帧)
+
+        未到帧率上限规定的时间时只grab不解码，返回的帧为None。
+        """
+        if not self.cap.grab():
+            return False, None
+        now = time.time()
+        if self.fps_cap and now < self.next_due:
+            return True, None
+        ok, frame = self.cap.retrieve()
+        if not ok:
+            return False, None
+        if self.fps_cap:
+            # 按固定节拍推进，短暂落后时不会累计补帧
+            self.next_due = max(self.next_due + 1.0 / self.fps_cap, now)
+        return True, frame
+    
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+    
+    def status(self):
+        latencies = sorted(self.latencies)
+        return {
+            'source_id': self.source_id,
+            'source': str(self.source),
+            'profile': self.profile_name,
+            'fps_cap': self.fps_cap,
+            'running': self.running,
+            'error': self.error,
+            'uptime': round(time.time() - self.started_at, 1),
+            'latency_p50_ms': latencies[len(latencies) // 2] if latencies else 0,
+            'latency_p95_ms': latencies[int(len(latencies) * 0.95)] if latencies else 0,
+            **self.stats
+        }
+
+class CameraGateway:
+    """基于asyncio的多摄像头接入网关
+
+    所有视频源在同一个事件循环线程中调度，每个视频源一个采集协程和一个处理协程：
+    - 采集协程在有界IO线程池中读取帧，按帧率上限跳过多余的帧，只保留最新一帧
+    - 处理协程在识别线程池有空位时才取最新帧，识别跟不上时旧帧被覆盖丢弃，延迟不会累积
+    - 识别结果作为事件发布到事件历史，供接口轮询或NDJSON订阅
+    线程数由两个线程池的大小决定，与摄像头数量无关。
+    """
+    def __init__(self, io_workers=None, cpu_workers=None, history=None):
+        self.io_workers = io_workers or app.config['GATEWAY_IO_WORKERS']
+        self.cpu_workers = cpu_workers or app.config['GATEWAY_CPU_WORKERS']
+        self.sources = {}
+        self.loop = None
+        self._thread = None
+        self._tasks = {}
+        self._cpu_slots = None
+        self.io_executor = None
+        self.cpu_executor = None
+        
+        self.events = deque(maxlen=history or app.config['GATEWAY_EVENT_HISTORY'])
+        self._event_seq = 0
+        self._event_cond = threading.Condition()
+        self._subscribers = []
+    
+    def start(self):
+        """启动事件循环线程"""
+        self.io_executor = ThreadPoolExecutor(self.io_workers, thread_name_prefix='gateway-io')
+        self.cpu_executor = ThreadPoolExecutor(self.cpu_workers, thread_name_prefix='gateway-cpu')
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        
+        def run_loop():
+            asyncio.set_event_loop(self.loop)
+            self._cpu_slots = asyncio.Semaphore(self.cpu_workers)
+            self.loop.call_soon(ready.set)
+            self.loop.run_forever()
+        
+        self._thread = threading.Thread(target=run_loop, name='camera-gateway', daemon=True)
+        self._thread.start()
+        ready.wait()
+        print(f"摄像头接入网关已启动: IO线程 {self.io_workers}, 识别线程 {self.cpu_workers}")
+    
+    def stop(self):
+        """停止所有视频源和事件循环"""
+        for source_id in list(self.sources):
+            self.remove(source_id)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+        self.io_executor.shutdown(wait=False)
+        self.cpu_executor.shutdown(wait=False)
+    
+    def _call(self, coro):
+        """在事件循环中执行协程并等待结果 (供其他线程调用)"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+    
+    def add(self, source, source_id=None, profile=None, fps_cap=None, loop=False):
+        """添加视频源，返回 (成功, 消息或视频源)"""
+        return self._call(self._add(source, source_id, profile, fps_cap, loop))
+    
+    async def _add(self, source, source_id, profile, fps_cap, loop):
+        if source_id is None:
+            source_id = f"gw{len(self.sources) + 1}"
+            while source_id in self.sources:
+                source_id += "_"
+        if source_id in self.sources:
+            return False, f"视频源 {source_id} 已存在"
+        src = GatewaySource(source_id, source, profile, fps_cap, loop)
+        src.frame_ready = asyncio.Event()
+        self.sources[source_id] = src
+        self._tasks[source_id] = [asyncio.ensure_future(self._ingest(src)),
+                                  asyncio.ensure_future(self._process(src))]
+        return True, src
+    
+    def remove(self, source_id):
+        """停止并移除视频源"""
+        return self._call(self._remove(source_id))
+    
+    async def _remove(self, source_id):
+        src = self.sources.pop(source_id, None)
+        if src is None:
+            return False
+        src.running = False
+        src.frame_ready.set()
+        tasks = self._tasks.pop(source_id, [])
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return True
+    
+    def get(self, source_id):
+        return self.sources.get(source_id)
+    
+    def list(self):
+        return [src.status() for src in list(self.sources.values())]
+    
+    async def _ingest(self, src):
+        """采集协程: 读取帧并覆盖最新帧，视频文件按原始帧率回放"""
+        loop = asyncio.get_running_loop()
+        failures = 0
+        frames_since_open = 0
+        try:
+            while src.running:
+                if src.cap is None:
+                    opened = await loop.run_in_executor(self.io_executor, src.open)
+                    if not opened:
+                        failures += 1
+                        src.error = f"无法打开视频源: {src.source}"
+                        await asyncio.sleep(reconnect_delay(failures))
+                        continue
+                    src.error = None
+                    frames_since_open = 0
+                
+                read_start = time.time()
+                ok, frame = await loop.run_in_executor(self.io_executor, src.read_next)
+                if not ok:
+                    await loop.run_in_executor(self.io_executor, src.release)
+                    if src.is_file and not src.loop:
+                        break
+                    # 断开的摄像头或网络流等待后重连 (连续失败时间隔加倍)，循环播放的视频文件立即重新打开
+                    if not (src.is_file and frames_since_open):
+                        failures += 1
+                        src.error = f"读取视频源失败: {src.source}"
+                        await asyncio.sleep(reconnect_delay(failures))
+                    continue
+                failures = 0
+                frames_since_open += 1
+                
+                if frame is None:
+                    src.stats['frames_skipped'] += 1
+                else:
+                    if src.latest is not None:
+                        src.stats['frames_dropped'] += 1
+                    src.seq += 1
+                    src.latest = (frame, src.seq, time.time())
+                    src.stats['frames_captured'] += 1
+                    src.frame_ready.set()
+                
+                if src.frame_interval:
+                    await asyncio.sleep(max(0.0, src.frame_interval - (time.time() - read_start)))
+        finally:
+            await loop.run_in_executor(self.io_executor, src.release)
+            src.running = False
+            src.frame_ready.set()
+    
+    async def _process(self, src):
+        """处理协程: 识别线程池有空位时取最新帧识别并发布事件"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await src.frame_ready.wait()
+            src.frame_ready.clear()
+            if src.latest is None:
+                if not src.running:
+                    break
+                continue
+            
+            async with self._cpu_slots:
+                # 等待空位期间可能到达了更新的帧，取此刻的最新帧
+                if src.latest is None:
+                    continue
+                frame, seq, captured_at = src.latest
+                src.latest = None
+                start_time = time.time()
+                try:
+                    results, performance = await loop.run_in_executor(self.cpu_executor, self._recognize, src, frame)
+                except Exception as e:
+                    print(f"[{src.source_id}] 识别错误: {e}")
+                    continue
+            
+            now = time.time()
+            src.stats['frames_processed'] += 1
+            src.stats['last_process_ms'] = round((now - start_time) * 1000, 1)
+            src.stats['last_latency_ms'] = round((now - captured_at) * 1000, 1)
+            src.latencies.append(src.stats['last_latency_ms'])
+            if 'stage_seconds' in performance:
+                # 总耗时从采集到帧开始计算，frame_wait 为帧等待识别线程空位的时间
+                stages = dict(performance['stage_seconds'], frame_wait=start_time - captured_at)
+                latency_metrics.observe('gateway', stages, now - captured_at)
+            if results:
+                self.publish({
+                    'source_id': src.source_id,
+                    'frame_seq': seq,
+                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+                    'faces': results,
+                    'latency_ms': src.stats['last_latency_ms'],
+                    'gallery_version': performance.get('gallery_version')
+                })
+    
+    @staticmethod
+    def _recognize(src, frame):
+        performance = {}
+        if face_core is None:
+            return [], performance
+        return face_core.recognize_face(frame, src.profile_name, performance, src.tracker), performance
+    
+    def subscribe(self, callback):
+        """注册事件回调 (在事件循环线程中调用，回调应尽快返回)"""
+        self._subscribers.append(callback)
+    
+    def publish(self, event):
+        """发布识别事件"""
+        with self._event_cond:
+            self._event_seq += 1
+            event['seq'] = self._event_seq
+            self.events.append(event)
+            self._event_cond.notify_all()
+        for callback in list(self._subscribers):
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"事件回调错误: {e}")
+    
+    def events_since(self, since_seq=0, timeout=0):
+        """返回序号大于 since_seq 的事件，timeout大于0时没有新事件则等待"""
+        with self._event_cond:
+            if timeout and self._event_seq <= since_seq:
+                self._event_cond.wait(timeout)
+            return [e for e in self.events if e['seq'] > since_seq]
+    
+    def iter_events(self, since_seq=0):
+        """持续产出新事件，供NDJSON订阅"""
+        while True:
+            events = self.events_since(since_seq, timeout=15)
+            if events:
+                since_seq = events[-1]['seq']
+                yield from events
+            else:
+                # 心跳，避免代理断开空闲连接
+                yield {'type': 'heartbeat', 'seq': since_seq}
+    
+    def stats(self):
+        """网关汇总统计"""
+        sources = self.list()
+        latencies = sorted(l for src in list(self.sources.values()) for l in src.latencies)
+        totals = {key: sum(s[key] for s in sources)
+                  for key in ('frames_captured', 'frames_processed', 'frames_dropped', 'frames_skipped')}
+        return {
+            'sources': len(sources),
+            'running': sum(1 for s in sources if s['running']),
+            'threads': threading.active_count(),
+            'io_workers': self.io_workers,
+            'cpu_workers': self.cpu_workers,
+            'events_published': self._event_seq,
+            'latency_p50_ms': latencies[len(latencies) // 2] if latencies else 0,
+            'latency_p95_ms': latencies[int(len(latencies) * 0.95)] if latencies else 0,
+            **totals
+        }
+
+def run_gateway_simulation(video_paths, cameras=40, seconds=30, fps_cap=None, profile='realtime'):
+    """网关模拟压测: 用视频文件循环回放模拟多路摄像头，运行指定时间后输出吞吐、延迟和丢帧统计"""
+    gateway = CameraGateway()
+    gateway.start()
+    for i in range(cameras):
+        gateway.add(video_paths[i % len(video_paths)], f"sim{i + 1}", profile, fps_cap, loop=True)
+    print(f"模拟 {cameras} 路摄像头 (帧率上限 {fps_cap or app.config['GATEWAY_DEFAULT_FPS']} fps)，运行 {seconds} 秒...")
+    
+    start_time = time.time()
+    while time.time() - start_time < seconds:
+        time.sleep(max(0.0, min(5, seconds - (time.time() - start_time))))
+        stats = gateway.stats()
+        print(f"  {time.time() - start_time:5.1f}s  处理 {stats['frames_processed']} 帧, "
+              f"丢弃 {stats['frames_dropped']} 帧, 跳过 {stats['frames_skipped']} 帧, "
+              f"延迟 p50={stats['latency_p50_ms']}ms p95={stats['latency_p95_ms']}ms, 线程 {stats['threads']}")
+    
+    elapsed = time.time() - start_time
+    stats = gateway.stats()
+    gateway.stop()
+    stats['elapsed'] = round(elapsed, 1)
+    stats['processed_fps'] = round(stats['frames_processed'] / elapsed, 1)
+    print(f"模拟结束: 处理 {stats['processed_fps']} 帧/秒, 发布 {stats['events_published']} 个事件, "
+          f"延迟 p50={stats['latency_p50_ms']}ms p95={stats['latency_p95_ms']}ms, 线程数 {stats['threads']}")
+    return stats
+
+# 视频文件识别任务
+class VideoJob:
+    """视频文件识别任务
+
+    解码线程按片段并行读取视频 (每个线程独立的 cv2.VideoCapture)，按固定步长
+    或画面变化抽帧，放入有界队列；识别线程池并行识别抽出的帧。
+    进度、识别结果和每个人的出现时间段以事件形式记录，供NDJSON流式输出。
+    """
+    def __init__(self, job_id, video_path, profile=None, stride=10, sample_mode='stride',
+                 motion_threshold=8.0, workers=2, decode_threads=1, original_name=''):
+        self.job_id = job_id
+        self.video_path = video_path
+        self.original_name = original_name
+        self.profile_name, _ = resolve_profile(profile, 'video')
+        self.stride = max(1, int(stride))
+        self.sample_mode = sample_mode
+        self.motion_threshold = float(motion_threshold)
+        self.workers = max(1, int(workers))
+        self.decode_threads = max(1, int(decode_threads))
+        
+        self.status = 'pending'
+        self.error = None
+        self.cancelled = False
+        self.created_at = time.time()
+        self.finished_at = None
+        self.fps = 0.0
+        self.total_frames = 0
+        self.decoded_frames = 0
+        self.sampled_frames = 0
+        self.processed_frames = 0
+        
+        # 每个身份的出现时间点 (秒)
+        self._sightings = {}
+        self._events = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._queue = queue.Queue(maxsize=self.workers * 2)
+    
+    def start(self):
+        threading.Thread(target=self._run, name=f"video-{self.job_id}", daemon=True).start()
+    
+    def cancel(self):
+        """取消任务"""
+        self.cancelled = True
+    
+    def _emit(self, event):
+        with self._cond:
+            self._events.append(event)
+            self._cond.notify_all()
+    
+    def _progress_event(self):
+        percent = round(self.decoded_frames * 100.0 / self.total_frames, 1) if self.total_frames else None
+        return {'type': 'progress', 'decoded_frames': self.decoded_frames, 'sampled_frames': self.sampled_frames,
+                'processed_frames': self.processed_frames, 'total_frames': self.total_frames, 'percent': percent}
+    
+    def _decode_segment(self, start_frame, end_frame):
+        """解码线程: 读取 [start_frame, end_frame) 范围内的帧并抽帧入队"""
+        cap = cv2.VideoCapture(self.video_path)
+        try:
+            if start_frame > 0:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            frame_idx = start_frame
+            last_thumb = None
+            while not self.cancelled and (end_frame is None or frame_idx < end_frame):
+                # 步长之间的帧只抓取不解码到图像
+                if (frame_idx - start_frame) % self.stride != 0:
+                    if not cap.grab():
+                        break
+                    frame_idx += 1
+                    with self._cond:
+                        self.decoded_frames += 1
+                    continue
+                
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                with self._cond:
+                    self.decoded_frames += 1
+                
+                # 画面变化抽帧: 与上一次抽取的帧比较缩略图的平均灰度差
+                sample = True
+                if self.sample_mode == 'motion':
+                    thumb = cv2.cvtColor(cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+                    if last_thumb is not None:
+                        sample = float(np.mean(cv2.absdiff(thumb, last_thumb))) >= self.motion_threshold
+                    if sample:
+                        last_thumb = thumb
+                
+                if sample:
+                    with self._cond:
+                        self.sampled_frames += 1
+                    while not self.cancelled:
+                        try:
+                            self._queue.put((frame_idx, frame), timeout=0.5)
+                            break
+                        except queue.Full:
+                            continue
+                frame_idx += 1
+        finally:
+            cap.release()
+    
+    def _recognize_worker(self):
+        """识别线程: 从队列取帧识别，直到收到结束标记"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self.cancelled:
+                continue
+            frame_idx, frame = item
+            performance = {}
+            start_time = time.time()
+            try:
+                faces = face_core.recognize_face(frame, self.profile_name, performance)
+                latency_metrics.observe('video', performance['stage_seconds'], time.time() - start_time)
+            except Exception as e:
+                print(f"[视频任务 {self.job_id}] 第 {frame_idx} 帧识别错误: {e}")
+                faces = []
+            
+            timestamp = frame_idx / self.fps if self.fps else float(frame_idx)
+            with self._cond:
+                self.processed_frames += 1
+                for face in faces:
+                    if face['name'] != 'unknown':
+                        self._sightings.setdefault(face['name'], []).append(timestamp)
+            if faces:
+                self._emit({'type': 'frame', 'frame': frame_idx, 'time': round(timestamp, 3), 'faces': faces,
+                            'gallery_version': performance.get('gallery_version')})
+    
+    def _run(self):
+        try:
+            cap = cv2.VideoCapture(self.video_path)
+            if not cap.isOpened():
+                raise RuntimeError("无法打开视频文件")
+            self.fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+            self.total_frames = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0))
+            cap.release()
+            
+            self.status = 'running'
+            self._emit({'type': 'start', 'job_id': self.job_id, 'fps': self.fps, 'total_frames': self.total_frames,
+                        'stride': self.stride, 'sample_mode': self.sample_mode, 'profile': self.profile_name})
+            
+            workers = [threading.Thread(target=self._recognize_worker, daemon=True) for _ in range(self.workers)]
+            for worker in workers:
+                worker.start()
+            
+            # 帧数已知时按片段并行解码，片段起点对齐到步长
+            if self.total_frames and self.decode_threads > 1:
+                segment = int(np.ceil(self.total_frames / self.decode_threads / self.stride)) * self.stride
+                bounds = [(start, min(start + segment, self.total_frames))
+                          for start in range(0, self.total_frames, segment)]
+            else:
+                bounds = [(0, None)]
+            decoders = [threading.Thread(target=self._decode_segment, args=b, daemon=True) for b in bounds]
+            for decoder in decoders:
+                decoder.start()
+            
+            # 解码期间定期输出进度
+            while any(d.is_alive() for d in decoders):
+                for decoder in decoders:
+                    decoder.join(timeout=app.config['VIDEO_PROGRESS_INTERVAL'])
+                    if decoder.is_alive():
+                        break
+                self._emit(self._progress_event())
+            
+            for _ in workers:
+                self._queue.put(None)
+            for worker in workers:
+                worker.join()
+            
+            self.status = 'cancelled' if self.cancelled else 'done'
+        except Exception as e:
+            self.status = 'error'
+            self.error = str(e)
+            print(f"[视频任务 {self.job_id}] 处理失败: {e}")
+        finally:
+            self.finished_at = time.time()
+            try:
+                os.remove(self.video_path)
+            except OSError:
+                pass
+            self._emit(self._progress_event())
+            with self._cond:
+                self._events.append({'type': self.status, 'job_id': self.job_id, 'error': self.error,
+                                     'elapsed': round(self.finished_at - self.created_at, 2),
+                                     'appearances': self.appearances()})
+                self._closed = True
+                self._cond.notify_all()
+    
+    def appearances(self):
+        """每个人的出现时间段: 相邻出现间隔不超过 VIDEO_APPEARANCE_GAP 秒 (且至少1.5个抽帧间隔) 的合并为一段"""
+        max_gap = app.config['VIDEO_APPEARANCE_GAP']
+        if self.fps:
+            max_gap = max(max_gap, 1.5 * self.stride / self.fps)
+        with self._cond:
+            sightings = {name: sorted(times) for name, times in self._sightings.items()}
+        result = {}
+        for name, times in sightings.items():
+            intervals = [[times[0], times[0]]]
+            for t in times[1:]:
+                if t - intervals[-1][1] <= max_gap:
+                    intervals[-1][1] = t
+                else:
+                    intervals.append([t, t])
+            result[name] = [[round(a, 3), round(b, 3)] for a, b in intervals]
+        return result
+    
+    @property
+    def finished(self):
+        return self.status in ('done', 'cancelled', 'error')
+    
+    def snapshot(self):
+        """任务状态"""
+        progress = self._progress_event()
+        progress.pop('type')
+        return {'job_id': self.job_id, 'status': self.status, 'error': self.error, 'video': self.original_name,
+                'fps': self.fps, 'profile': self.profile_name, **progress, 'appearances': self.appearances()}
+    
+    def iter_events(self):
+        """逐个输出任务事件，直到任务结束"""
+        cursor = 0
+        while True:
+            with self._cond:
+                while cursor >= len(self._events) and not self._closed:
+                    self._cond.wait(timeout=1.0)
+                events = self._events[cursor:]
+                cursor += len(events)
+                closed = self._closed and cursor >= len(self._events)
+            for event in events:
+                yield event
+            if closed:
+                return
 
-# 确保上传目录存在
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['UPLOAD_TEMP'], exist_ok=True)
+class VideoJobManager:
+    """管理视频识别任务，结束超过 VIDEO_JOB_TTL 秒的任务自动清理"""
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+    
+    def create(self, video_path, **kwargs):
+        job = VideoJob(uuid.uuid4().hex[:12], video_path, **kwargs)
+        now = time.time()
+        with self._lock:
+            for job_id in [k for k, j in self._jobs.items()
+                           if j.finished_at and now - j.finished_at > app.config['VIDEO_JOB_TTL']]:
+                del self._jobs[job_id]
+            self._jobs[job.job_id] = job
+        job.start()
+        return job
+    
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+    
+    def list(self):
+        return [job.snapshot() for job in list(self._jobs.values())]
+
+# 人脸库元数据目录
+class FaceCatalog:
+    """人脸库元数据目录 (SQLite)
+
+    每个身份一行: 图像数量、预览图、创建/更新时间，以及从特征描述文件汇总的录入质量
+    (最小人脸尺寸、平均眼睛开合度、最大人脸角度)。创建、录入和删除时只重新统计对应的身份，
+    管理接口分页查询时不再遍历人脸库目录。多个工作进程共用同一个数据库文件。
+    """
+    SORT_COLUMNS = {'name': 'name', 'count': 'image_count', 'time': 'created_at', 'updated': 'updated_at'}
+    COLUMNS = ('name', 'image_count', 'preview', 'created_at', 'updated_at', 'dir_mtime',
+               'min_face_size', 'eye_aspect_ratio', 'max_face_angle')
+    
+    def __init__(self, path, root_dir):
+        self.path = path
+        self.root_dir = root_dir
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS identities (
+                name TEXT PRIMARY KEY,
+                image_count INTEGER NOT NULL,
+                preview TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                dir_mtime INTEGER,
+                min_face_size INTEGER,
+                eye_aspect_ratio REAL,
+                max_face_angle REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_identities_count ON identities (image_count)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_identities_created ON identities (created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_identities_updated ON identities (updated_at)")
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def _scan(self, person):
+        """统计某个人的图像和特征描述文件，文件夹不存在时返回None"""
+        person_dir = os.path.join(self.root_dir, person)
+        try:
+            dir_stat = os.stat(person_dir)
+            images = sorted(f for f in os.listdir(person_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        
+        created_at = dir_stat.st_mtime
+        sizes, ratios, angles = [], [], []
+        for image in images:
+            created_at = min(created_at, os.path.getmtime(os.path.join(person_dir, image)))
+            try:
+                with open(os.path.join(person_dir, os.path.splitext(image)[0] + '.json'), 'r') as f:
+                    quality = json.load(f).get('quality', {})
+            except (OSError, ValueError):
+                continue
+            if quality.get('size'):
+                sizes.append(min(quality['size']))
+            if 'eye_aspect_ratio' in quality:
+                ratios.append(quality['eye_aspect_ratio'])
+            if 'face_angle' in quality:
+                angles.append(abs(quality['face_angle']))
+        
+        return (person, len(images), f"{person}/{images[0]}" if images else None, created_at, time.time(),
+                dir_stat.st_mtime_ns, min(sizes) if sizes else None,
+                float(np.mean(ratios)) if ratios else None, max(angles) if angles else None)
+    
+    def refresh(self, persons):
+        """重新统计指定身份 (文件夹已删除的身份从目录中移除)"""
+        if isinstance(persons, str):
+            persons = [persons]
+        rows = [(person, self._scan(person)) for person in persons]
+        with self._connect() as conn:
+            for person, row in rows:
+                if row is None:
+                    conn.execute("DELETE FROM identities WHERE name = ?", (person,))
+                else:
+                    # 已有记录保留创建时间
+                    conn.execute(f"""INSERT INTO identities ({', '.join(self.COLUMNS)})
+                        VALUES ({', '.join('?' * len(self.COLUMNS))})
+                        ON CONFLICT(name) DO UPDATE SET
+                        {', '.join(f'{c} = excluded.{c}' for c in self.COLUMNS if c not in ('name', 'created_at'))}""",
+                                 row)
+    
+    def sync(self):
+        """与人脸库目录对账: 新增、删除或修改过 (文件夹修改时间变化) 的身份重新统计"""
+        start_time = time.time()
+        folders = {}
+        if os.path.isdir(self.root_dir):
+            for entry in os.scandir(self.root_dir):
+                if entry.is_dir():
+                    folders[entry.name] = entry.stat().st_mtime_ns
+        with self._connect() as conn:
+            known = {row['name']: row['dir_mtime'] for row in conn.execute("SELECT name, dir_mtime FROM identities")}
+        changed = [name for name, mtime in folders.items() if known.get(name) != mtime]
+        removed = [name for name in known if name not in folders]
+        self.refresh(changed + removed)
+        print(f"人脸库目录: {len(folders)} 人, 更新 {len(changed)} 人, 移除 {len(removed)} 人, "
+              f"耗时 {time.time() - start_time:.2f} 秒")
+    
+    def query(self, offset=0, limit=50, prefix='', sort='count', descending=True):
+        """分页查询有图像的身份，可按姓名前缀过滤，返回 (符合条件的总数, 当前页记录)"""
+        where = "WHERE image_count > 0"
+        params = []
+        if prefix:
+            # 范围条件可以使用主键索引
+            where += " AND name >= ? AND name < ?"
+            params += [prefix, prefix + '\U0010ffff']
+        order = f"{self.SORT_COLUMNS.get(sort, 'image_count')} {'DESC' if descending else 'ASC'}, name ASC"
+        with self._connect() as conn:
+            matched = conn.execute(f"SELECT COUNT(*) FROM identities {where}", params).fetchone()[0]
+            rows = conn.execute(f"SELECT * FROM identities {where} ORDER BY {order} LIMIT ? OFFSET ?",
+                                params + [limit, offset]).fetchall()
+        return matched, [dict(row) for row in rows]
+    
+    def summary(self):
+        """返回 (身份数量, 图像总数, 最近更新时间)"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*), COALESCE(SUM(image_count), 0), MAX(updated_at) FROM identities").fetchone()
+        return row[0], row[1], row[2]
+
+class ThumbnailCache:
+    """录入图像缩略图缓存
+
+    管理页面只需要小尺寸的人脸预览，不再传输原始录入图像。缩略图按特征描述文件
+    (<stem>.json) 中保存的人脸框裁剪为正方形并缩放，首次请求时生成，保存为
+    <缓存目录>/<姓名>/<stem>_<边长>.jpg；原图比缩略图新时重新生成，删除身份时整个目录失效。
+    """
+    
+    def __init__(self, cache_dir, root_dir):
+        self.cache_dir = cache_dir
+        self.root_dir = root_dir
+        os.makedirs(cache_dir, exist_ok=True)
+    
+    def _crop_box(self, img, face_rect, margin):
+        """以人脸框中心取正方形区域并向外扩展，没有人脸框时取图像中心的正方形"""
+        height, width = img.shape[:2]
+        if face_rect:
+            x1, y1, x2, y2 = face_rect
+            side = max(x2 - x1, y2 - y1) * (1 + 2 * margin)
+            cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        else:
+            side = min(width, height)
+            cx, cy = width / 2, height / 2
+        side = int(min(side, width, height))
+        # 超出图像边界时平移而不是缩小，保持正方形
+        left = int(min(max(cx - side / 2, 0), width - side))
+        top = int(min(max(cy - side / 2, 0), height - side))
+        return left, top, side
+    
+    def _render(self, src_path, size):
+        """生成缩略图JPEG数据，图像无法解码时返回None"""
+        img = cv2.imdecode(np.fromfile(src_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        face_rect = None
+        try:
+            with open(os.path.splitext(src_path)[0] + '.json', 'r') as f:
+                face_rect = json.load(f).get('face_rect')
+        except (OSError, ValueError):
+            pass
+        left, top, side = self._crop_box(img, face_rect, app.config['THUMBNAIL_MARGIN'])
+        crop = img[top:top + side, left:left + side]
+        if side > size:
+            crop = cv2.resize(crop, (size, size), interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, app.config['THUMBNAIL_JPEG_QUALITY']])
+        return buffer.tobytes() if ok else None
+    
+    def get(self, filename, size):
+        """返回缩略图文件路径 (需要时生成)，原图不存在或无法解码时返回None"""
+        src_path = safe_join(self.root_dir, filename)
+        if src_path is None or not os.path.isfile(src_path):
+            return None
+        person, image = os.path.split(os.path.normpath(filename))
+        stem = os.path.splitext(image)[0]
+        thumb_path = os.path.join(self.cache_dir, person, f"{stem}_{size}.jpg")
+        try:
+            if os.path.getmtime(thumb_path) >= os.path.getmtime(src_path):
+                return thumb_path
+        except OSError:
+            pass
+        
+        data = self._render(src_path, size)
+        if data is None:
+            return None
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        # 临时文件名带进程号和线程号，并发请求同一张缩略图时互不覆盖
+        tmp_path = f"{thumb_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, thumb_path)
+        return thumb_path
+    
+    def invalidate(self, person):
+        """删除某个人的全部缩略图"""
+        shutil.rmtree(os.path.join(self.cache_dir, person), ignore_errors=True)
 
 # 人脸识别核心类
 class FaceRecognitionCore:
-    def __init__(self):
+    def __init__(self, load_database=True):
         self._model_dir = os.path.join(parent_dir, 'data', 'data_dlib')
         self._shape_path = os.path.join(self._model_dir, 'shape_predictor_68_face_landmarks.dat')
         self._reco_path = os.path.join(self._model_dir, 'dlib_face_recognition_resnet_model_v1.dat')
@@ -73,330 +2425,1439 @@ class FaceRecognitionCore:
         self.face_reco_model = dlib.face_recognition_model_v1(self._reco_path)
         print("模型加载完成!")
         
-        # 用于存储人脸数据
-        self.face_features = []
-        self.face_names = []
+        # 多进程识别工作池 (未启用时在当前进程中识别)
+        self.worker_pool = None
+        # 微批处理调度器 (未启用时每个请求单独计算)
+        self.batcher = None
+        
+        # 当前人脸库快照 (识别时无锁读取，修改时构建新快照后整体替换)
+        self._snapshot = GallerySnapshot(0, [], [])
+        self._index_dirty = False
+        self._index_save_pending = False
+        self._compact_pending = False
+        # 人脸库修改锁 (串行化加载、录入和删除，识别不需要获取)
+        self._gallery_lock = threading.RLock()
+        # 多进程部署时的人脸库变更日志 (单进程时为None)
+        self.journal = None
+        # 从其他节点导入的代表特征 (version为0的快照，只用于保存特征和姓名)
+        self.imported = GallerySnapshot(0, [], [])
+        
+        # 工作进程只需要模型，不加载人脸库
+        if not load_database:
+            return
+        
+        # 特征缓存，避免每次启动重新提取所有图像特征
+        self.descriptor_cache = DescriptorCache(app.config['DESCRIPTOR_CACHE'],
+                                                app.config['UPLOAD_FOLDER'],
+                                                self._model_identity())
         
         # 加载已有的人脸数据
         self.load_face_database()
+        
+        # 人脸库元数据目录，与人脸库目录对账
+        self.catalog = FaceCatalog(app.config['FACE_CATALOG'], app.config['UPLOAD_FOLDER'])
+        self.catalog.sync()
+        
+        # 管理页面预览用的缩略图缓存
+        self.thumbnails = ThumbnailCache(app.config['THUMBNAIL_FOLDER'], app.config['UPLOAD_FOLDER'])
+    
+    def start_worker_pool(self, num_workers):
+        """启动多进程识别工作池，之后的识别请求分发到工作进程"""
+        if num_workers <= 0:
+            return
+        pool = RecognitionWorkerPool(num_workers)
+        pool.start()
+        self.worker_pool = pool
+    
+    def stop_worker_pool(self):
+        """停止多进程识别工作池"""
+        pool, self.worker_pool = self.worker_pool, None
+        if pool is not None:
+            pool.shutdown()
+    
+    def start_batcher(self, max_batch, max_wait_ms, max_queue):
+        """启动微批处理调度器，并发的识别请求合并成批次处理"""
+        # 启用工作池时每个工作进程对应一个调度线程，否则单线程调度
+        dispatchers = self.worker_pool.num_workers if self.worker_pool is not None else 1
+        batcher = RecognitionBatcher(self, max_batch, max_wait_ms, max_queue, dispatchers)
+        batcher.start()
+        self.batcher = batcher
+    
+    def stop_batcher(self):
+        """停止微批处理调度器"""
+        batcher, self.batcher = self.batcher, None
+        if batcher is not None:
+            batcher.stop()
+    
+    @property
+    def gallery(self):
+        """当前人脸库快照，调用方应只取一次引用并在整个请求中使用"""
+        return self._snapshot
+    
+    @property
+    def gallery_version(self):
+        return self._snapshot.version
+    
+    @property
+    def face_features(self):
+        return self._snapshot.features
+    
+    @property
+    def face_names(self):
+        return self._snapshot.names
+    
+    @property
+    def index(self):
+        return self._snapshot.index
+    
+    @property
+    def use_faiss(self):
+        return self._snapshot.use_faiss
+    
+    def _model_identity(self):
+        """模型文件标识: 文件名、大小和内容哈希，加上特征提取参数"""
+        parts = []
+        for path in (self._shape_path, self._reco_path):
+            parts.append(f"{os.path.basename(path)}:{os.path.getsize(path)}:{file_sha1(path)}")
+        parts.append(profile_signature(resolve_profile(None, 'enroll')[1]))
+        return "|".join(parts)
+    
+    def get_image_features(self, img_paths, timings=None):
+        """批量获取图像特征，优先使用缓存，仅对新增或变化的图像重新提取
+
+        未命中缓存的图像按 DESCRIPTOR_BATCH_SIZE 分批一次性计算特征向量。
+        """
+        features = [None] * len(img_paths)
+        misses = []
+        for i, img_path in enumerate(img_paths):
+            try:
+                hit, feature, info = self.descriptor_cache.lookup(img_path)
+            except OSError as e:
+                print(f"处理图像 {img_path} 时出错: {e}")
+                continue
+            if hit:
+                features[i] = feature
+            else:
+                misses.append((i, img_path, info))
+        
+        batch_size = max(1, app.config['DESCRIPTOR_BATCH_SIZE'])
+        for start in range(0, len(misses), batch_size):
+            batch = misses[start:start + batch_size]
+            batch_features = self.extract_features_batch([img_path for _, img_path, _ in batch], timings)
+            for (i, img_path, info), feature in zip(batch, batch_features):
+                self.descriptor_cache.store(img_path, feature, info)
+                features[i] = feature
+        return features
+    
+    def get_image_feature(self, img_path):
+        """获取单张图像特征，优先使用缓存"""
+        return self.get_image_features([img_path])[0]
+    
+    @staticmethod
+    def _person_image_paths(person):
+        """某个人的所有录入图像路径"""
+        person_dir = os.path.join(app.config['UPLOAD_FOLDER'], person)
+        if not os.path.isdir(person_dir):
+            return []
+        return [os.path.join(person_dir, f) for f in os.listdir(person_dir)
+                if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    
+    def _collect_person_features(self, person, seen_images=None, timings=None):
+        """收集某个人所有图像的特征 (使用特征缓存)"""
+        img_paths = self._person_image_paths(person)
+        print(f"人脸 '{person}' 包含 {len(img_paths)} 张图像")
+        
+        if seen_images is not None:
+            seen_images.extend(img_paths)
+        
+        # 提取该人的人脸特征
+        person_features = []
+        for img_path, feature in zip(img_paths, self.get_image_features(img_paths, timings)):
+            if feature is not None:
+                person_features.append(feature)
+            else:
+                print(f"无法从图像提取特征: {img_path}")
+        
+        return person_features
+    
+    def _build_person_templates(self, person, person_features):
+        """根据某个人的全部特征生成代表特征 (异常值过滤 + 平均特征 + 聚类中心)
+
+        特征间距离由Gram矩阵一次计算；聚类中心最多 TEMPLATE_MAX_CLUSTERS 个，只与该人自己的
+        代表特征比较是否足够新颖，耗时只取决于该人的图像数量，与人脸库规模无关。
+        """
+        # 只有一个特征，直接添加
+        if len(person_features) == 1:
+            return [person_features[0]]
+        
+        features = np.asarray(person_features, dtype=np.float64)
+        
+        # 每个特征到其他特征的平均距离 (||a-b||² = |a|² + |b|² - 2a·b)，特征很多时只与固定数量的抽样特征比较
+        reference = features
+        if len(features) > app.config['TEMPLATE_OUTLIER_SAMPLE']:
+            rows = np.random.RandomState(0).choice(len(features), app.config['TEMPLATE_OUTLIER_SAMPLE'], replace=False)
+            reference = features[rows]
+        squared = np.einsum('ij,ij->i', features, features)
+        squared_ref = np.einsum('ij,ij->i', reference, reference)
+        distances = np.sqrt(np.maximum(squared[:, None] + squared_ref[None, :] - 2 * features @ reference.T, 0))
+        avg_distances = distances.mean(axis=1)
+        
+        # 找出异常值 (距离其他特征太远的特征)
+        threshold = np.mean(avg_distances) + 1.5 * np.std(avg_distances)
+        filtered_features = features[avg_distances <= threshold]
+        
+        if len(filtered_features) < len(features):
+            print(f"从'{person}'中过滤掉了 {len(features) - len(filtered_features)} 个异常特征")
+        
+        # 如果过滤后没有特征了，使用原始特征
+        if len(filtered_features) == 0:
+            print(f"警告: '{person}'的所有特征都被过滤掉了，使用原始特征")
+            filtered_features = features
+        
+        # 计算平均特征作为代表并归一化
+        mean_feature = filtered_features.mean(axis=0)
+        templates = [mean_feature / np.linalg.norm(mean_feature)]
+        
+        # 如果有足够多的特征，添加多个代表特征以提高识别率
+        num_clusters = min(app.config['TEMPLATE_MAX_CLUSTERS'], len(filtered_features) // 2)
+        if len(filtered_features) >= 5 and num_clusters > 0:
+            for center in self._cluster_centers(filtered_features, num_clusters):
+                center = center / np.linalg.norm(center)
+                # 如果与该人已有的代表特征差异足够大，添加为额外特征
+                if np.linalg.norm(np.asarray(templates) - center, axis=1).min() > app.config['TEMPLATE_NOVELTY_DISTANCE']:
+                    templates.append(center)
+        
+        return templates
     
-    def load_face_database(self):
-        """加载人脸数据库"""
-        self.face_features = []
-        self.face_names = []
+    @staticmethod
+    def _cluster_centers(features, num_clusters):
+        """找出不同角度的特征: 有scikit-learn时使用Mini-Batch K-means聚类中心，
+        否则使用最远点采样 (从离平均特征最远的特征开始，每次选择离已选特征最远的特征)
+        """
+        if SKLEARN_AVAILABLE:
+            kmeans = MiniBatchKMeans(n_clusters=num_clusters, batch_size=min(256, len(features)),
+                                     n_init=3, random_state=0).fit(features)
+            return kmeans.cluster_centers_
         
+        chosen = [int(np.argmax(np.linalg.norm(features - features.mean(axis=0), axis=1)))]
+        min_distances = np.linalg.norm(features - features[chosen[0]], axis=1)
+        for _ in range(1, num_clusters):
+            chosen.append(int(np.argmax(min_distances)))
+            min_distances = np.minimum(min_distances, np.linalg.norm(features - features[chosen[-1]], axis=1))
+        return features[chosen]
+    
+    def load_face_database(self, num_workers=None):
+        """加载人脸数据库
+
+        命中特征缓存的图像直接使用缓存特征。未命中的图像按人分块，数量较多时分发到临时的多进程工作池
+        并行解码和计算特征 (num_workers 默认为 GALLERY_LOAD_WORKERS)；每个人的所有图像完成后立即生成
+        代表特征，加载过程中定期输出处理速度和预计剩余时间。
+        """
         face_dir = app.config['UPLOAD_FOLDER']
         if not os.path.exists(face_dir):
             os.makedirs(face_dir)
+            self.imported = self._open_imported_features()
+            with self._gallery_lock:
+                self._publish_snapshot(self.imported.matrix, self.imported.names)
             return
         
-        # 遍历人脸文件夹
-        person_folders = [f for f in os.listdir(face_dir) if os.path.isdir(os.path.join(face_dir, f))]
-        print(f"发现人脸文件夹: {person_folders}")
+        start_time = time.time()
+        self.descriptor_cache.reset_stats()
+        seen_images = []
+        timings = {}
         
+        # 遍历人脸文件夹，按人查询特征缓存，未命中的图像按 DESCRIPTOR_BATCH_SIZE 分块
+        person_folders = [f for f in os.listdir(face_dir) if os.path.isdir(os.path.join(face_dir, f))]
+        batch_size = max(1, app.config['DESCRIPTOR_BATCH_SIZE'])
+        person_features = {}  # 姓名 -> 按图像顺序排列的特征 (None表示未提取或提取失败)
+        pending = {}          # 姓名 -> 尚未完成的特征块数
+        jobs = []             # (姓名, [(图像序号, 图像路径, 缓存信息), ...])
+        local_persons = set() # 有录入图像的人 (不使用导入的代表特征)
         for person in person_folders:
-            person_dir = os.path.join(face_dir, person)
-            image_files = [f for f in os.listdir(person_dir) 
-                          if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-            
-            print(f"人脸 '{person}' 包含 {len(image_files)} 张图像")
+            img_paths = self._person_image_paths(person)
+            seen_images.extend(img_paths)
+            if img_paths:
+                local_persons.add(person)
+            features = [None] * len(img_paths)
+            misses = []
+            for i, img_path in enumerate(img_paths):
+                try:
+                    hit, feature, info = self.descriptor_cache.lookup(img_path)
+                except OSError as e:
+                    print(f"处理图像 {img_path} 时出错: {e}")
+                    continue
+                if hit:
+                    features[i] = feature
+                else:
+                    misses.append((i, img_path, info))
+            person_features[person] = features
+            pending[person] = 0
+            for batch_start in range(0, len(misses), batch_size):
+                jobs.append((person, misses[batch_start:batch_start + batch_size]))
+                pending[person] += 1
+        
+        total_misses = sum(len(batch) for _, batch in jobs)
+        print(f"发现 {len(person_folders)} 个人脸文件夹, 共 {len(seen_images)} 张图像, "
+              f"缓存命中 {self.descriptor_cache.hits} 张, 需要提取特征 {total_misses} 张")
+        
+        # 需要提取的图像较多时启动临时加载工作池 (已启用识别工作池时直接使用)
+        num_workers = app.config['GALLERY_LOAD_WORKERS'] if num_workers is None else num_workers
+        pool = self.worker_pool
+        own_pool = None
+        if pool is None and num_workers > 1 and total_misses >= app.config['GALLERY_LOAD_MIN_IMAGES']:
+            own_pool = RecognitionWorkerPool(min(num_workers, len(jobs)))
+            try:
+                own_pool.start()
+                pool = own_pool
+            except Exception as e:
+                print(f"启动加载工作池失败，在当前进程中提取特征: {e}")
+                own_pool.shutdown()
+                own_pool = None
+        
+        templates_by_person = {}
+        failed_images = 0
+        progress = ProgressReporter("加载人脸库", total_misses)
+        
+        def finish_person(person):
+            features = [f for f in person_features.pop(person) if f is not None]
+            if not features:
+                print(f"警告: 未能从'{person}'提取任何有效特征")
+                return
+            # 特征质量评估和聚类
+            templates_by_person[person] = self._build_person_templates(person, features)
+        
+        def complete(person, batch, features):
+            nonlocal failed_images
+            for (i, img_path, info), feature in zip(batch, features):
+                self.descriptor_cache.store(img_path, feature, info)
+                person_features[person][i] = feature
+                if feature is None:
+                    failed_images += 1
+            progress.update(len(batch), f", 完成 {len(templates_by_person)}/{len(person_folders)} 人")
+            pending[person] -= 1
+            if pending[person] == 0:
+                finish_person(person)
+        
+        try:
+            futures = {}
+            if pool is not None:
+                print(f"使用 {pool.num_workers} 个进程并行提取特征")
+                for person, batch in jobs:
+                    future = pool.submit_async(_worker_extract_batch, [p for _, p, _ in batch], 'enroll')
+                    futures[future] = (person, batch, False)
             
-            if not image_files:
-                continue
-                
-            # 提取该人的人脸特征
-            person_features = []
+            # 全部命中缓存的人立即生成代表特征 (与工作进程的特征提取同时进行)
+            for person in person_folders:
+                if pending[person] == 0:
+                    finish_person(person)
             
-            for img_file in image_files:
-                img_path = os.path.join(person_dir, img_file)
+            if pool is None:
+                for person, batch in jobs:
+                    complete(person, batch, self.extract_features_batch([p for _, p, _ in batch], timings))
+            else:
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        person, batch, retried = futures.pop(future)
+                        try:
+                            features, worker_timings = future.result()
+                            for key, value in worker_timings.items():
+                                timings[key] = timings.get(key, 0) + value
+                        except BrokenProcessPool as e:
+                            if not retried:
+                                # 工作进程异常退出，已提交的块全部失败: 在重启后的工作池中重新提交一次
+                                future = pool.submit_async(_worker_extract_batch, [p for _, p, _ in batch], 'enroll')
+                                futures[future] = (person, batch, True)
+                                continue
+                            print(f"工作进程提取特征失败，在当前进程中重试: {e}")
+                            features = self.extract_features_batch([p for _, p, _ in batch], timings)
+                        except Exception as e:
+                            # 工作进程异常时该块在当前进程中重新提取
+                            print(f"工作进程提取特征失败，在当前进程中重试: {e}")
+                            features = self.extract_features_batch([p for _, p, _ in batch], timings)
+                        complete(person, batch, features)
+        finally:
+            if own_pool is not None:
+                own_pool.shutdown()
+        
+        # 按文件夹顺序组装人脸库，与特征提取的完成顺序无关
+        face_features = []
+        face_names = []
+        for person in person_folders:
+            templates = templates_by_person.get(person, [])
+            face_features.extend(templates)
+            face_names.extend([person] * len(templates))
+        
+        # 合并导入的代表特征 (有本地录入图像的身份以本地为准)
+        self.imported = self._open_imported_features()
+        _, imported_features, imported_names = self.imported.without(local_persons)
+        if imported_names:
+            face_features = np.vstack([np.asarray(face_features, dtype=np.float32).reshape(-1, FEATURE_DIM),
+                                       imported_features])
+            face_names.extend(imported_names)
+            print(f"已合并导入的代表特征: {len(set(imported_names))} 人, {len(imported_names)} 个")
+        
+        elapsed = time.time() - start_time
+        print(f"已加载 {len(templates_by_person)} 人, {len(face_names)} 个人脸特征, 耗时 {elapsed:.1f} 秒")
+        if total_misses:
+            print(f"特征提取: {total_misses} 张图像, {progress.rate:.1f} 张/秒, 无法提取特征 {failed_images} 张")
+        
+        # 清理失效缓存并写回磁盘
+        stale = self.descriptor_cache.prune(seen_images)
+        self.descriptor_cache.save()
+        print(f"特征缓存: 命中 {self.descriptor_cache.hits} 张, "
+              f"未命中 {self.descriptor_cache.misses} 张, 清理 {stale} 条失效记录")
+        if timings.get('descriptor_faces'):
+            print(f"特征计算: {timings['descriptor_faces']} 张人脸, {timings['descriptor_calls']} 次批量调用, "
+                  f"平均 {timings['descriptor_time'] * 1000 / timings['descriptor_faces']:.1f} ms/人脸")
+        
+        with self._gallery_lock:
+            self._publish_snapshot(face_features, face_names)
+    
+    def _publish_snapshot(self, features, names):
+        """构建新版本的人脸库快照及其FAISS索引，并原子替换当前快照 (调用方需持有 _gallery_lock)
+
+        新快照完全构建好之后才替换，识别请求要么看到旧快照，要么看到新快照。
+        """
+        return self._install_snapshot(GallerySnapshot(self._snapshot.version + 1, features, names))
+    
+    def _install_snapshot(self, snapshot, publish=True):
+        """写入人脸库文件、构建FAISS索引后替换当前快照 (调用方需持有 _gallery_lock)
+
+        publish 为False时快照已映射其他进程发布的人脸库文件，不再写入文件和索引文件。
+        """
+        if publish:
+            snapshot = self._map_snapshot(snapshot)
+        snapshot.index = self._build_index(snapshot, save=publish)
+        self._snapshot = snapshot
+        return snapshot
+    
+    @staticmethod
+    def _map_snapshot(snapshot):
+        """写入人脸库文件并改为使用内存映射的快照，未配置或写入失败时保留内存中的快照"""
+        path = app.config['GALLERY_FILE']
+        if not path:
+            return snapshot
+        try:
+            return GalleryFile.publish(path, snapshot)
+        except Exception as e:
+            print(f"写入人脸库文件失败，使用内存中的人脸库: {e}")
+            return snapshot
+    
+    def _new_gallery_index(self, count):
+        """按配置创建索引对象，人脸库太小、FAISS不可用或使用精确检索时返回None
+
+        flat 与精确矩阵运算结果相同，直接在 (内存映射的) 特征矩阵上检索，各工作进程不再各自保存一份特征副本。
+        """
+        if not FAISS_AVAILABLE or count <= app.config['FAISS_MIN_TEMPLATES']:
+            return None
+        index_type = GalleryIndex.resolve_type(app.config['FAISS_INDEX_TYPE'], count,
+                                               app.config['FAISS_ANN_THRESHOLD'])
+        if index_type == 'flat':
+            return None
+        return GalleryIndex(index_type,
+                            nprobe=app.config['FAISS_NPROBE'],
+                            ef_search=app.config['FAISS_EF_SEARCH'],
+                            hnsw_m=app.config['FAISS_HNSW_M'],
+                            ef_construction=app.config['FAISS_EF_CONSTRUCTION'])
+    
+    def _build_index(self, snapshot, save=True):
+        """为快照构建FAISS索引 (索引文件与快照内容一致时直接加载)，不启用时返回None"""
+        matrix = snapshot.matrix
+        index = self._new_gallery_index(len(matrix))
+        if index is None:
+            return None
+        
+        try:
+            index_path = app.config['FAISS_INDEX_PATH']
+            fingerprint = snapshot.fingerprint()
+            if index.load(index_path, fingerprint, len(matrix), mmap=True):
+                print(f"已加载FAISS索引文件 ({index.index_type}, {index.ntotal} 个特征)")
+            else:
+                start_time = time.time()
+                index.build(matrix)
+                print(f"已构建FAISS索引 ({index.index_type}, {index.ntotal} 个特征), "
+                      f"耗时 {time.time() - start_time:.2f} 秒")
+                if save:
+                    index.save(index_path, fingerprint)
+            self._index_dirty = False
+            return index
+        except Exception as e:
+            print(f"启用FAISS失败: {e}")
+            return None
+    
+    def _schedule_index_save(self):
+        """增量修改后在后台保存索引文件，多次修改合并为一次写入"""
+        self._index_dirty = True
+        if self._index_save_pending:
+            return
+        self._index_save_pending = True
+        
+        def save_later():
+            time.sleep(2)
+            with self._gallery_lock:
+                self._index_save_pending = False
+                snapshot = self._snapshot
+                if not self._index_dirty or snapshot.index is None:
+                    return
                 try:
-                    print(f"处理图像: {img_path}")
-                    feature = self.extract_features(img_path)
-                    if feature is not None:
-                        person_features.append(feature)
-                    else:
-                        print(f"无法从图像提取特征: {img_path}")
+                    snapshot.index.save(app.config['FAISS_INDEX_PATH'], snapshot.fingerprint())
+                    self._index_dirty = False
                 except Exception as e:
-                    print(f"处理图像 {img_path} 时出错: {e}")
+                    print(f"保存FAISS索引失败: {e}")
+        
+        threading.Thread(target=save_later, daemon=True).start()
+    
+    def set_index_search_params(self, nprobe=None, ef_search=None):
+        """运行时调整FAISS检索参数"""
+        if nprobe is not None:
+            app.config['FAISS_NPROBE'] = nprobe
+        if ef_search is not None:
+            app.config['FAISS_EF_SEARCH'] = ef_search
+        if self.index is not None:
+            self.index.set_search_params(nprobe, ef_search)
+    
+    def index_report(self, num_queries=500, k=3, noise=0.05):
+        """索引召回率与延迟报告
+
+        以库中特征加噪声作为查询，精确矩阵检索结果作为基准，
+        统计不同nprobe/efSearch下的recall@k和平均单次查询延迟。
+        """
+        snapshot = self._snapshot
+        matrix = snapshot.matrix
+        if len(matrix) == 0:
+            print("人脸库为空，无法生成索引报告")
+            return []
+        
+        rng = np.random.RandomState(0)
+        rows = rng.choice(len(matrix), min(num_queries, len(matrix)), replace=False)
+        queries = matrix[rows] + rng.normal(0, noise, (len(rows), matrix.shape[1])).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        k = min(k, len(matrix))
+        
+        # 精确检索基准
+        start_time = time.time()
+        similarities = queries @ matrix.T
+        exact = np.argsort(-similarities, axis=1)[:, :k]
+        exact_ms = (time.time() - start_time) * 1000 / len(queries)
+        report = [{'index': 'exact', 'param': '-', 'recall': 1.0, 'latency_ms': exact_ms}]
+        
+        index = snapshot.index
+        if index is not None and index.index_type != 'flat':
+            if index.index_type == 'ivf':
+                param_name, values, current = 'nprobe', [1, 2, 4, 8, 16, 32, 64, 128], index.nprobe
+            else:
+                param_name, values, current = 'efSearch', [16, 32, 64, 128, 256], index.ef_search
             
-            # 如果没有提取到有效特征，跳过该人
-            if not person_features:
-                print(f"警告: 未能从'{person}'提取任何有效特征")
+            for value in values:
+                if param_name == 'nprobe':
+                    index.set_search_params(nprobe=value)
+                else:
+                    index.set_search_params(ef_search=value)
+                start_time = time.time()
+                for q in queries:
+                    _, found = index.search(q[None, :], k)
+                latency_ms = (time.time() - start_time) * 1000 / len(queries)
+                _, found = index.search(queries, k)
+                recall = np.mean([len(set(found[i]) & set(exact[i])) / k for i in range(len(queries))])
+                report.append({'index': index.index_type, 'param': f"{param_name}={value}",
+                               'recall': float(recall), 'latency_ms': latency_ms})
+            
+            # 恢复当前配置的检索参数
+            if param_name == 'nprobe':
+                index.set_search_params(nprobe=current)
+            else:
+                index.set_search_params(ef_search=current)
+        elif index is not None:
+            start_time = time.time()
+            for q in queries:
+                index.search(q[None, :], k)
+            latency_ms = (time.time() - start_time) * 1000 / len(queries)
+            report.append({'index': 'flat', 'param': '-', 'recall': 1.0, 'latency_ms': latency_ms})
+        
+        print(f"索引报告: {len(matrix)} 个特征, {len(queries)} 个查询, recall@{k}")
+        for item in report:
+            print(f"  {item['index']:<6} {item['param']:<14} recall={item['recall']:.4f}  "
+                  f"延迟={item['latency_ms']:.3f} ms/查询")
+        return report
+    
+    def sync_gallery(self):
+        """应用其他工作进程记录在变更日志中的录入、删除和导入"""
+        if not self.journal.changed():
+            return
+        with self._gallery_lock:
+            self._replay_journal(self.journal.pending())
+    
+    def _replay_journal(self, entries):
+        """按顺序应用变更记录中的代表特征，所有记录只替换一次当前快照 (调用方需持有 _gallery_lock)
+
+        记录中已经是修改进程计算好的代表特征，不需要重新提取特征。base 记录表示修改进程已合并增量部分
+        并发布了人脸库文件和索引文件: 映射这两个文件作为新的基础部分。
+        """
+        if not entries:
+            return
+        path = app.config['GALLERY_FILE']
+        base_arrays = None
+        last_base = -1
+        if path and any(entry.get('base') for entry in entries):
+            # 在共享锁内读完新记录并映射文件，保证映射的文件就是最后一条 base 记录发布的版本
+            with self.journal.shared():
+                entries = entries + self.journal.pending()
+                last_base = max(i for i, entry in enumerate(entries) if entry.get('base'))
+                try:
+                    if GalleryFile.read_version(path) == entries[last_base]['version']:
+                        base_arrays = GalleryFile.open(path)
+                except Exception as e:
+                    print(f"映射人脸库文件失败，在内存中合并增量: {e}")
+        
+        snapshot = self._snapshot
+        start = 0
+        if base_arrays is not None and any(entry.get('base') and entry['version'] > snapshot.version
+                                           for entry in entries[:last_base]):
+            # 落后不止一次合并 (例如新启动的工作进程): 之前的记录已包含在最新的人脸库文件中，直接从该文件开始
+            start = last_base
+        reload_imported = any(entry.get('imported') for entry in entries)
+        for i, entry in enumerate(entries[start:], start):
+            if entry.get('base'):
+                if i == last_base and base_arrays is not None:
+                    self._snapshot = snapshot
+                    snapshot = self._adopt_base(entry['version'], base_arrays, entry.get('index'))
+                elif base_arrays is None and entry['version'] == snapshot.version:
+                    # 无法映射发布的文件 (例如已被更新的版本替换): 在内存中合并，不写入文件
+                    self._snapshot = snapshot
+                    snapshot = self.compact_gallery(publish=False)
+                continue
+            if entry['version'] <= snapshot.version:
+                continue
+            features = GalleryJournal.decode_features(entry['features']) if entry['names'] else []
+            snapshot, _ = snapshot.updated(entry['version'], entry['persons'], features, entry['names'])
+        if reload_imported:
+            self.imported = self._open_imported_features()
+        if snapshot is self._snapshot:
+            return
+        self._snapshot = snapshot
+        self._compact_if_needed(snapshot, replayed=True)
+        print(f"已同步其他工作进程的人脸库变更: {len(entries)} 条记录 (人脸库版本 {snapshot.version})")
+    
+    def _adopt_base(self, version, arrays, index_fingerprint=None):
+        """改用其他进程发布的人脸库文件作为基础部分 (调用方需持有 _gallery_lock)
+
+        index_fingerprint 为修改进程同时发布的索引文件的指纹，内存映射该索引文件，不保存私有副本。
+        索引文件已被更新的版本替换时，若当前快照与文件内容一致 (已应用到同一版本)，FAISS索引副本重放
+        修改进程的修补；否则加载与文件一致的索引文件或重新构建。
+        """
+        current = self._snapshot
+        merged = GallerySnapshot.from_arrays(version, *arrays)
+        if index_fingerprint:
+            index = self._new_gallery_index(len(merged))
+            if index is not None and index.load(app.config['FAISS_INDEX_PATH'], index_fingerprint, len(merged),
+                                                 mmap=True):
+                merged.index = index
+                self._snapshot = merged
+                return merged
+        if current.version == version and len(current) == len(merged):
+            return self._patch_snapshot(current, current.dead_rows.tolist(), merged, current.delta_size[1], publish=False)
+        return self._install_snapshot(merged, publish=False)
+    
+    @contextmanager
+    def _gallery_writer(self):
+        """修改人脸库期间持有 _gallery_lock；多进程部署时同时持有变更日志的排他锁，并先应用其他进程的变更"""
+        with self._gallery_lock:
+            if self.journal is None:
+                yield
+                return
+            with self.journal.exclusive():
+                self._replay_journal(self.journal.pending())
+                yield
+    
+    def update_identity(self, person, propagate=True):
+        """增量更新某个人的代表特征
+
+        仅重新计算该身份的特征和聚类中心，在当前快照的增量部分中替换该身份，
+        耗时与人脸库规模无关。propagate 为True时记录到变更日志，通知其他工作进程。
+        返回该身份当前的代表特征数量。
+        """
+        return self.update_identities([person], propagate)[person]
+    
+    @staticmethod
+    def _image_signature(img_paths):
+        """图像列表的签名 (路径、大小和修改时间)，用于判断提取特征之后图像是否又有变化"""
+        signature = set()
+        for img_path in img_paths:
+            try:
+                st = os.stat(img_path)
+            except OSError:
                 continue
+            signature.add((img_path, st.st_size, st.st_mtime_ns))
+        return signature
+    
+    def update_identities(self, persons, propagate=True):
+        """批量增量更新多个人的代表特征，只发布一次快照
+
+        返回 {姓名: 代表特征数量}。
+        """
+        # 合并其他工作进程保存的特征缓存，它们已经提取过的图像不再重复提取
+        self.descriptor_cache.refresh()
+        
+        # 耗时的特征提取在锁外完成，不影响其他请求识别
+        signatures = {}
+        features_by_person = {}
+        for person in persons:
+            signatures[person] = self._image_signature(self._person_image_paths(person))
+            features_by_person[person] = self._collect_person_features(person)
+        
+        counts = {}
+        with self._gallery_writer():
+            # 提取特征期间其他请求 (包括其他工作进程) 可能又录入或删除了同一个人的图像: 按最新的图像重新收集
+            # (已提取的图像命中特征缓存)，否则后完成的旧结果会覆盖先完成的新结果
+            for person in persons:
+                if self._image_signature(self._person_image_paths(person)) != signatures[person]:
+                    features_by_person[person] = self._collect_person_features(person)
             
-            # 特征质量评估和聚类
-            if len(person_features) > 1:
-                # 计算特征之间的距离矩阵
-                num_features = len(person_features)
-                distance_matrix = np.zeros((num_features, num_features))
-                
-                for i in range(num_features):
-                    for j in range(i+1, num_features):
-                        dist = np.linalg.norm(person_features[i] - person_features[j])
-                        distance_matrix[i, j] = dist
-                        distance_matrix[j, i] = dist
-                
-                # 计算每个特征的平均距离
-                avg_distances = np.mean(distance_matrix, axis=1)
-                
-                # 找出异常值 (距离其他特征太远的特征)
-                threshold = np.mean(avg_distances) + 1.5 * np.std(avg_distances)
-                valid_indices = np.where(avg_distances <= threshold)[0]
-                
-                # 过滤掉异常值
-                filtered_features = [person_features[i] for i in valid_indices]
-                
-                if len(filtered_features) < len(person_features):
-                    print(f"从'{person}'中过滤掉了 {len(person_features) - len(filtered_features)} 个异常特征")
-                
-                # 如果过滤后没有特征了，使用原始特征
-                if not filtered_features:
-                    print(f"警告: '{person}'的所有特征都被过滤掉了，使用原始特征")
-                    filtered_features = person_features
-                
-                # 计算平均特征作为代表
-                mean_feature = np.mean(filtered_features, axis=0)
-                
-                # 归一化
-                mean_feature = mean_feature / np.linalg.norm(mean_feature)
-                
-                # 添加到数据库
-                self.face_features.append(mean_feature)
-                self.face_names.append(person)
-                
-                # 如果有足够多的特征，添加多个代表特征以提高识别率
-                if len(filtered_features) >= 5:
-                    # 使用K-means聚类找出不同角度的特征
-                    if SKLEARN_AVAILABLE:
-                        kmeans = KMeans(n_clusters=min(3, len(filtered_features) // 2), random_state=0).fit(filtered_features)
-                        
-                        # 获取每个聚类的中心
-                        for center in kmeans.cluster_centers_:
-                            # 归一化
-                            center = center / np.linalg.norm(center)
-                            
-                            # 如果与已有特征差异足够大，添加为额外特征
-                            if min(np.linalg.norm(center - feat) for feat in self.face_features) > 0.1:
-                                self.face_features.append(center)
-                                self.face_names.append(person)
+            added = []
+            names = []
+            for person in persons:
+                templates = []
+                if features_by_person[person]:
+                    templates = self._build_person_templates(person, features_by_person[person])
+                added.extend(templates)
+                names.extend([person] * len(templates))
+                counts[person] = len(templates)
+            added_count = len(added)
+            
+            snapshot, _ = self._apply_changes(persons, added, names, propagate)
+        self.descriptor_cache.schedule_save(app.config['DESCRIPTOR_CACHE_SAVE_DELAY'])
+        
+        if len(persons) == 1:
+            print(f"已更新人脸 '{persons[0]}': {counts[persons[0]]} 个代表特征, 共 {len(snapshot)} 个人脸特征 "
+                  f"(人脸库版本 {snapshot.version})")
+        else:
+            print(f"已更新 {len(persons)} 个人脸: 新增 {added_count} 个代表特征, 共 {len(snapshot)} 个人脸特征 "
+                  f"(人脸库版本 {snapshot.version})")
+        return counts
+    
+    def remove_identity(self, person, propagate=True):
+        """从内存人脸库中移除某个人的全部代表特征"""
+        with self._gallery_writer():
+            if not self._snapshot.contains(person):
+                return 0
+            snapshot, removed = self._apply_changes({person}, [], [], propagate)
+        
+        print(f"已移除人脸 '{person}': {removed} 个代表特征 (人脸库版本 {snapshot.version})")
+        return removed
+    
+    def _apply_changes(self, persons, features, names, propagate=True, imported=False):
+        """在当前快照上删除指定身份并追加新的代表特征 (调用方需通过 _gallery_writer() 持有锁)
+
+        只复制快照的增量部分，基础部分和FAISS索引不变。增量部分超过上限时在后台合并。
+        propagate 为True时把删除的身份和新增的代表特征记录到变更日志，imported 表示导入的特征文件也已修改。
+        返回 (新快照, 删除的代表特征数)。
+        """
+        current = self._snapshot
+        snapshot, removed = current.updated(current.version + 1, persons, features, names)
+        self._snapshot = snapshot
+        if propagate and self.journal is not None:
+            self.journal.record({
+                'version': snapshot.version,
+                'persons': sorted(persons),
+                'names': list(names),
+                'features': GalleryJournal.encode_features(snapshot.extra_matrix[len(snapshot.extra_names) - len(names):]),
+                'imported': imported
+            })
+        self._compact_if_needed(snapshot)
+        return snapshot, removed
+    
+    def _compact_if_needed(self, snapshot, replayed=False):
+        """增量部分超过上限时在后台合并
+
+        多进程部署且配置了人脸库文件时，只由修改人脸库的进程合并并发布文件，
+        应用变更记录的进程 (replayed 为True) 等待 base 记录后映射该文件。
+        """
+        if replayed and self.journal is not None and app.config['GALLERY_FILE']:
+            return
+        dead_rows, extra_count = snapshot.delta_size
+        if dead_rows > app.config['GALLERY_DELTA_MAX_DEAD'] or extra_count > app.config['GALLERY_DELTA_MAX_EXTRA']:
+            self._schedule_compact()
+    
+    def _schedule_compact(self):
+        """在后台合并快照的增量部分，多次触发合并为一次"""
+        if self._compact_pending:
+            return
+        self._compact_pending = True
+        
+        def compact_later():
+            with self._gallery_writer():
+                self._compact_pending = False
+                try:
+                    self.compact_gallery()
+                except Exception as e:
+                    print(f"合并人脸库增量失败: {e}")
+        
+        threading.Thread(target=compact_later, daemon=True).start()
+    
+    def compact_gallery(self, publish=True):
+        """把当前快照的增量部分合并为新的基础部分 (调用方需通过 _gallery_writer() 持有锁)
+
+        人脸库内容不变，快照版本不变。FAISS索引在副本上删除被替换的行并追加增量特征。
+        publish 为True且配置了人脸库文件时写入新文件并映射，多进程部署时立即保存索引文件并改为内存映射，
+        再追加 base 记录 (附带索引指纹)，其他工作进程映射同样的两个文件。
+        """
+        current = self._snapshot
+        dead_rows, extra_count = current.delta_size
+        if not dead_rows and not extra_count:
+            return current
+        start_time = time.time()
+        merged = GallerySnapshot.from_arrays(current.version, *current.live_arrays())
+        snapshot = self._patch_snapshot(current, current.dead_rows.tolist(), merged, extra_count, publish)
+        if publish and self.journal is not None and app.config['GALLERY_FILE']:
+            self.journal.record({'version': snapshot.version, 'base': True,
+                                 'index': self._publish_index(snapshot)})
+        print(f"已合并人脸库增量: 删除 {dead_rows} 行, 追加 {extra_count} 个代表特征, 共 {len(snapshot)} 个人脸特征, "
+              f"耗时 {time.time() - start_time:.2f} 秒")
+        return snapshot
+    
+    def _publish_index(self, snapshot):
+        """保存快照的索引文件并改为内存映射 (调用方需持有 _gallery_lock)，返回索引指纹，没有索引或保存失败时返回None"""
+        index = snapshot.index
+        if index is None:
+            return None
+        try:
+            index_path = app.config['FAISS_INDEX_PATH']
+            fingerprint = snapshot.fingerprint()
+            index.save(index_path, fingerprint)
+            self._index_dirty = False
+            mapped = GalleryIndex(index.index_type, index.nprobe, index.ef_search, index.hnsw_m, index.ef_construction)
+            if mapped.load(index_path, fingerprint, len(snapshot.matrix), mmap=True):
+                # 两个索引内容相同，正在使用该快照的识别请求无论取到哪一个结果都一致
+                snapshot.index = mapped
+            return fingerprint
+        except Exception as e:
+            print(f"保存FAISS索引失败: {e}")
+            return None
+    
+    def _open_imported_features(self):
+        """读取导入的代表特征文件，不存在或无效时返回空快照"""
+        path = app.config['IMPORTED_FEATURES']
+        if path and os.path.exists(path):
+            try:
+                return GallerySnapshot.from_arrays(0, *GalleryFile.open(path, copy=os.name == 'nt'))
+            except Exception as e:
+                print(f"读取导入的特征文件失败: {e}")
+        return GallerySnapshot(0, [], [])
+    
+    @staticmethod
+    def _save_imported_features(store):
+        """保存导入的代表特征，返回保存后使用的快照 (Windows不能替换已映射的文件，保留在内存中)"""
+        path = app.config['IMPORTED_FEATURES']
+        if os.name == 'nt':
+            os.replace(GalleryFile.write(path, store.matrix, store.name_ids, store.name_table), path)
+            return store
+        return GalleryFile.publish(path, store)
+    
+    def _apply_imported(self, persons, stale, propagate=True):
+        """把导入的代表特征应用到人脸库，只发布一次快照 (调用方需通过 _gallery_writer() 持有锁)
+
+        persons 为需要(重新)应用的身份，stale 为不再导入、需要从人脸库移除的身份；有本地录入图像的身份跳过。
+        """
+        local = {person for person in persons | stale if self._person_image_paths(person)}
+        applied = persons - local
+        removed = stale - local
+        _, imported_features, imported_names = self.imported.without(set(self.imported.name_table) - applied)
+        snapshot, _ = self._apply_changes(applied | removed, imported_features, imported_names, propagate, imported=True)
+        return {'identities': len(applied), 'templates': len(imported_names), 'skipped': len(persons & local),
+                'removed': len(removed), 'gallery_version': snapshot.version}
+    
+    def import_features(self, features, names, replace=False, propagate=True):
+        """导入其他节点导出的代表特征，直接加入人脸库和索引，不需要录入图像
+
+        导入的特征保存在 IMPORTED_FEATURES 文件中，重启后仍然有效。replace 为False时与已导入的特征合并
+        (同名身份以本次导入为准)，为True时替换全部已导入的特征。有本地录入图像的身份以本地为准。
+        返回导入报告。
+        """
+        start_time = time.time()
+        incoming = GallerySnapshot(0, features, names)
+        incoming_names = set(incoming.name_table)
+        with self._gallery_writer():
+            previous = self.imported
+            if replace:
+                store = incoming
             else:
-                # 只有一个特征，直接添加
-                feature = person_features[0]
-                self.face_features.append(feature)
-                self.face_names.append(person)
+                _, kept_features, kept_names = previous.without(incoming_names)
+                store = GallerySnapshot(0, np.vstack([kept_features, incoming.matrix]), kept_names + list(incoming.names))
+            self.imported = self._save_imported_features(store)
+            report = self._apply_imported(set(store.name_table) if replace else incoming_names,
+                                          set(previous.name_table) - set(store.name_table), propagate)
+        
+        report['elapsed'] = round(time.time() - start_time, 2)
+        print(f"已导入代表特征: {report['identities']} 人, {report['templates']} 个特征, "
+              f"跳过有本地图像的 {report['skipped']} 人, 移除 {report['removed']} 人, "
+              f"耗时 {report['elapsed']:.2f} 秒 (人脸库版本 {report['gallery_version']})")
+        return report
+    
+    def remove_imported(self, person):
+        """删除导入的身份"""
+        with self._gallery_writer():
+            _, features, names = self.imported.without({person})
+            self.imported = self._save_imported_features(GallerySnapshot(0, features, names))
+            self._apply_changes({person}, [], [], imported=True)
+        return True, f"已删除导入的人脸: {person}"
+    
+    def export_features(self, chunk_rows=None):
+        """导出当前人脸库快照的代表特征，返回 (快照, 按块产出的人脸库文件格式数据)"""
+        snapshot = self._snapshot
+        matrix, name_ids, name_table = snapshot.live_arrays()
+        return snapshot, GalleryFile.iter_bytes(matrix, name_ids, name_table,
+                                                chunk_rows or app.config['FEATURE_EXPORT_CHUNK_ROWS'], snapshot.version)
+    
+    def _patch_snapshot(self, current, removed_rows, merged, added_count, publish=True):
+        """以合并后的快照替换当前快照，FAISS索引在副本上增量修补: 删除指定行并在末尾追加新特征
+
+        特征矩阵的修改方式(删除行并追加到末尾)与索引保持一致。旧快照的索引保持不变，
+        仍在使用旧快照的识别请求不受影响。跨越启用阈值或索引类型需要改变时重建索引。
+        publish 为False时不写入人脸库文件和索引文件。
+        """
+        expected = self._new_gallery_index(len(merged))
+        if current.index is None or expected is None or expected.index_type != current.index.index_type:
+            return self._install_snapshot(merged, publish)
+        
+        snapshot = self._map_snapshot(merged) if publish else merged
+        try:
+            index = current.index.copy()
+            index.remove_and_add(removed_rows, snapshot.matrix, added_count)
+        except Exception as e:
+            print(f"增量更新FAISS索引失败，重建索引: {e}")
+            return self._install_snapshot(merged, publish)
+        
+        snapshot.index = index
+        self._snapshot = snapshot
+        if publish:
+            self._schedule_index_save()
+        return snapshot
+    
+    @staticmethod
+    def preprocess_image(img_rgb, profile):
+        """按配置对RGB图像进行预处理"""
+        # 1. 直方图均衡化以增强对比度
+        if profile.get('equalize'):
+            img_yuv = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2YUV)
+            img_yuv[:,:,0] = cv2.equalizeHist(img_yuv[:,:,0])
+            img_rgb = cv2.cvtColor(img_yuv, cv2.COLOR_YUV2RGB)
+        
+        # 2. 轻度高斯模糊减少噪声
+        if profile.get('blur'):
+            img_rgb = cv2.GaussianBlur(img_rgb, (3, 3), 0)
+        return img_rgb
+    
+    def detect_faces(self, img_rgb, profile):
+        """按配置的检测尺度检测人脸
+
+        在缩小后的图像上运行HOG检测器，再把检测框映射回原图坐标。
+        返回 (原图坐标下的人脸框列表, 检测耗时秒数)。
+        """
+        start_time = time.time()
+        
+        height, width = img_rgb.shape[:2]
+        short_side = min(height, width)
+        target = profile.get('short_side', 0)
+        scale = target / short_side if target and short_side > target else 1.0
+        
+        if scale < 1.0:
+            small = cv2.resize(img_rgb, (int(round(width * scale)), int(round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+            faces = [dlib.rectangle(max(0, int(r.left() / scale)), max(0, int(r.top() / scale)),
+                                    min(width - 1, int(r.right() / scale)), min(height - 1, int(r.bottom() / scale)))
+                     for r in self.detector(small, profile.get('upsample', 1))]
+        else:
+            faces = list(self.detector(img_rgb, profile.get('upsample', 1)))
+        
+        return faces, time.time() - start_time
+    
+    def _prepare_enroll_face(self, img_path, profile):
+        """读取并预处理录入图像，检测最大的人脸并获取关键点
+
+        返回 (预处理后的RGB图像, 关键点)，无法读取或未检测到人脸时返回None。
+        """
+        # 读取图像
+        if isinstance(img_path, str):
+            # 使用OpenCV无法直接读取中文路径，改用numpy和python原生文件操作
+            with open(img_path, 'rb') as f:
+                img_data = f.read()
+            img_np = np.frombuffer(img_data, np.uint8)
+            img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
+            if img is None:
+                print(f"无法读取图像: {img_path}")
+                return None
+        else:
+            img = img_path  # 如果已经是图像数组
+        
+        # 转换为RGB (dlib需要)
+        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         
-        print(f"已加载 {len(self.face_names)} 个人脸特征")
+        # 图像预处理 (直方图均衡化、高斯模糊)
+        img_blurred = self.preprocess_image(img_rgb, profile)
         
-        # 如果特征数量很多，考虑使用近似最近邻搜索
-        if len(self.face_features) > 100:
+        # 检测人脸 - 使用录入配置的检测参数
+        faces, _ = self.detect_faces(img_blurred, profile)
+        if len(faces) == 0:
+            print(f"未检测到人脸")
+            return None
+        
+        # 找出最大的人脸（假设这是主要人脸）
+        main_face = self._largest_face(faces)
+        
+        # 获取关键点
+        shape = self.predictor(img_blurred, main_face)
+        return img_blurred, shape
+    
+    def compute_descriptors(self, images, shapes_per_image, num_jitters=10, timings=None):
+        """批量计算人脸特征向量
+
+        images 为RGB图像列表，shapes_per_image 为每张图像对应的关键点列表。
+        所有图像中的所有人脸通过一次 compute_face_descriptor 调用完成计算，
+        返回与输入结构一致的特征列表。timings 不为None时累计耗时和人脸数。
+        """
+        batch_images = []
+        batch_faces = []
+        for img, shapes in zip(images, shapes_per_image):
+            if not shapes:
+                continue
+            detections = dlib.full_object_detections()
+            for shape in shapes:
+                detections.append(shape)
+            batch_images.append(img)
+            batch_faces.append(detections)
+        
+        results = [[] for _ in images]
+        if not batch_images:
+            return results
+        
+        start_time = time.time()
+        batch_descriptors = self.face_reco_model.compute_face_descriptor(batch_images, batch_faces, num_jitters)
+        elapsed = time.time() - start_time
+        
+        descriptors_iter = iter(batch_descriptors)
+        for i, shapes in enumerate(shapes_per_image):
+            if shapes:
+                results[i] = [np.array(d) for d in next(descriptors_iter)]
+        
+        if timings is not None:
+            face_count = sum(len(shapes) for shapes in shapes_per_image)
+            timings['descriptor_time'] = timings.get('descriptor_time', 0.0) + elapsed
+            timings['descriptor_faces'] = timings.get('descriptor_faces', 0) + face_count
+            timings['descriptor_calls'] = timings.get('descriptor_calls', 0) + 1
+        return results
+    
+    def extract_features_batch(self, img_paths, timings=None, profile_name='enroll'):
+        """批量从图像中提取人脸特征，所有图像的特征向量一次计算完成"""
+        _, profile = resolve_profile(profile_name, 'enroll')
+        prepared = []
+        for img_path in img_paths:
             try:
-                if FAISS_AVAILABLE:
-                    print("启用FAISS加速特征匹配")
-                    
-                    # 将特征转换为适合FAISS的格式
-                    features_array = np.array(self.face_features).astype('float32')
-                    
-                    # 创建索引
-                    self.index = faiss.IndexFlatL2(features_array.shape[1])
-                    self.index.add(features_array)
-                    
-                    # 设置使用FAISS标志
-                    self.use_faiss = True
+                prepared.append(self._prepare_enroll_face(img_path, profile))
             except Exception as e:
-                print(f"启用FAISS失败: {e}")
-                self.use_faiss = False
-        else:
-            self.use_faiss = False
+                print(f"提取特征时出错: {e}")
+                prepared.append(None)
+        
+        valid = [p for p in prepared if p is not None]
+        if not valid:
+            return [None] * len(img_paths)
+        
+        try:
+            # 计算特征向量 (128D) - 录入配置增加采样次数提高精度
+            descriptors = self.compute_descriptors([p[0] for p in valid], [[p[1]] for p in valid],
+                                                   profile['num_jitters'], timings)
+        except Exception as e:
+            print(f"提取特征时出错: {e}")
+            return [None] * len(img_paths)
+        
+        descriptors_iter = iter(descriptors)
+        return [next(descriptors_iter)[0] if p is not None else None for p in prepared]
     
     def extract_features(self, img_path):
         """从图像中提取人脸特征"""
-        try:
-            # 读取图像
-            if isinstance(img_path, str):
-                # 使用OpenCV无法直接读取中文路径，改用numpy和python原生文件操作
-                with open(img_path, 'rb') as f:
-                    img_data = f.read()
-                img_np = np.frombuffer(img_data, np.uint8)
-                img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
-                if img is None:
-                    print(f"无法读取图像: {img_path}")
-                    return None
+        return self.extract_features_batch([img_path])[0]
+    
+    def match_features(self, query_features, top_k=3, snapshot=None):
+        """批量特征匹配
+
+        一次矩阵运算完成一帧中所有人脸与人脸库的比较，再用argpartition取前top_k。
+        基础部分使用FAISS索引或精确矩阵运算 (跳过已删除的行)，增量部分精确检索，两者的结果合并排序。
+        snapshot 为使用的人脸库快照 (默认当前快照)。
+        返回每个查询特征的 [(距离, 姓名), ...] 列表，按距离升序排列。
+        """
+        if snapshot is None:
+            snapshot = self._snapshot
+        matrix, name_ids, names = snapshot.matrix, snapshot.name_ids, snapshot.name_table
+        dead_rows, extra_names = snapshot.dead_rows, snapshot.extra_names
+        queries = np.asarray(query_features, dtype=np.float32).reshape(-1, FEATURE_DIM)
+        if len(queries) == 0:
+            return []
+        if len(snapshot) == 0:
+            return [[] for _ in range(len(queries))]
+        
+        # 查询特征与库中特征一样归一化到单位长度
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        base_count = matrix.shape[0]
+        live_count = base_count - len(dead_rows)
+        candidates = []
+        
+        if live_count > 0:
+            index = snapshot.index
+            if index is not None:
+                # 使用FAISS加速特征匹配 (距离已换算为欧氏距离)，多取已删除的行数再过滤
+                distances, indices = index.search(queries, min(top_k + len(dead_rows), base_count))
+                if len(dead_rows):
+                    indices = np.where(np.isin(indices, dead_rows), -1, indices)
             else:
-                img = img_path  # 如果已经是图像数组
+                similarities = queries @ matrix.T
+                if len(dead_rows):
+                    similarities[:, dead_rows] = -np.inf
+                distances, indices = self._top_k(similarities, min(top_k, live_count))
+            candidates.append((distances, indices))
+        
+        if extra_names:
+            distances, indices = self._top_k(queries @ snapshot.extra_matrix.T, min(top_k, len(extra_names)))
+            candidates.append((distances, indices + base_count))
+        
+        if len(candidates) > 1 or len(dead_rows):
+            distances = np.hstack([d for d, _ in candidates])
+            indices = np.hstack([i for _, i in candidates])
+            distances = np.where(indices >= 0, distances, np.inf)
+            order = np.argsort(distances, axis=1, kind='stable')[:, :top_k]
+            distances = np.take_along_axis(distances, order, axis=1)
+            indices = np.take_along_axis(indices, order, axis=1)
+        
+        matches = []
+        for row_dist, row_idx in zip(distances, indices):
+            matches.append([(float(d), names[name_ids[i]] if i < base_count else extra_names[i - base_count])
+                            for d, i in zip(row_dist, row_idx) if i >= 0])
+        return matches
+    
+    @staticmethod
+    def _top_k(similarities, k):
+        """每行取相似度最高的k列，返回按距离升序排列的 (欧氏距离, 列号)"""
+        if k < similarities.shape[1]:
+            indices = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        else:
+            indices = np.tile(np.arange(similarities.shape[1]), (len(similarities), 1))
+        top_sims = np.take_along_axis(similarities, indices, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        indices = np.take_along_axis(indices, order, axis=1)
+        top_sims = np.take_along_axis(top_sims, order, axis=1)
+        # 单位向量的欧氏距离: d^2 = 2 - 2 * cos
+        return np.sqrt(np.maximum(2.0 - 2.0 * top_sims, 0.0)), indices
+    
+    @staticmethod
+    def _decide_identity(top_matches):
+        """根据前几个最接近的匹配确定身份，返回 (姓名, 距离, 置信度)"""
+        if not top_matches:
+            return 'unknown', 1.0, 0.0
+        
+        # 如果最佳匹配的距离足够小，直接采用
+        if top_matches[0][0] < 0.4:  # 更严格的阈值
+            min_distance, person_name = top_matches[0]
+            return person_name, min_distance, 1 - min_distance
+        
+        # 如果最佳匹配不够明确，但有多个相近的匹配，使用加权投票
+        if len(top_matches) >= 2 and top_matches[0][0] < 0.55:
+            # 计算权重（距离的倒数）
+            weights = [1/(d+0.01) for d, _ in top_matches]
+            total_weight = sum(weights)
             
-            # 转换为RGB (dlib需要)
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            # 统计加权票数
+            vote_dict = {}
+            for i, (dist, name) in enumerate(top_matches):
+                vote_dict[name] = vote_dict.get(name, 0) + weights[i]/total_weight
             
-            # 图像预处理
-            # 1. 直方图均衡化以增强对比度
-            img_yuv = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2YUV)
-            img_yuv[:,:,0] = cv2.equalizeHist(img_yuv[:,:,0])
-            img_enhanced = cv2.cvtColor(img_yuv, cv2.COLOR_YUV2RGB)
+            # 获取得票最多的人
+            winner = max(vote_dict.items(), key=lambda x: x[1])
             
-            # 2. 轻度高斯模糊减少噪声
-            img_blurred = cv2.GaussianBlur(img_enhanced, (3, 3), 0)
+            # 如果得票率超过阈值，认为识别成功
+            if winner[1] > 0.6:
+                # 找到这个人的最小距离
+                min_distance = min(dist for dist, name in top_matches if name == winner[0])
+                return winner[0], min_distance, 1 - min_distance
             
-            # 检测人脸 - 使用更高精度的检测参数
-            faces = self.detector(img_blurred, 2)
-            if len(faces) == 0:
-                print(f"未检测到人脸")
-                return None
+            # 无法确定身份 (默认距离和可信度)
+            return 'unknown', 0.6, 0.4
+        
+        # 距离太大，识别为未知人脸
+        return 'unknown', top_matches[0][0], 1 - top_matches[0][0]
+    
+    def analyze_faces(self, img, profile_name, tracker=None):
+        """检测人脸并计算需要识别的人脸特征 (不做特征匹配)
+
+        提供 tracker 时先把检测框关联到轨迹，只为需要复核的轨迹计算特征。
+        返回字典: rects (所有人脸框)、track_ids (与rects对应，无跟踪时为None)、
+        verify_indices (计算了特征的人脸下标)、features (与verify_indices对应) 和 timings。
+        """
+        return self.analyze_faces_batch([(img, profile_name, tracker)])[0]
+    
+    def analyze_faces_batch(self, items):
+        """批量检测人脸并计算特征
+
+        items 为 (图像, 配置名, 跟踪器) 列表。检测和关键点逐帧完成，
+        相同抖动次数的所有帧的特征向量通过一次 compute_descriptors 调用完成计算。
+        返回与 items 对应的分析结果列表，格式同 analyze_faces。
+        """
+        analyses = []
+        prepared = []
+        for img, profile_name, tracker in items:
+            _, profile = resolve_profile(profile_name, 'recognize')
+            timings = {}
             
-            # 找出最大的人脸（假设这是主要人脸）
-            main_face = max(faces, key=lambda rect: (rect.right() - rect.left()) * (rect.bottom() - rect.top()))
+            # 转换为RGB并按配置预处理
+            preprocess_start = time.time()
+            img_rgb = self.preprocess_image(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), profile)
+            timings['preprocess_time'] = time.time() - preprocess_start
             
-            # 获取关键点
-            shape = self.predictor(img_blurred, main_face)
+            # 检测人脸 - 在按配置缩小的图像上检测
+            faces, detection_time = self.detect_faces(img_rgb, profile)
+            timings['detection_time'] = detection_time
+            rects = [[int(face.left()), int(face.top()), int(face.right()), int(face.bottom())] for face in faces]
             
-            # 计算特征向量 (128D) - 增加采样次数提高精度
-            face_descriptor = self.face_reco_model.compute_face_descriptor(img_blurred, shape, 10)
+            # 关联轨迹，确定需要计算特征的人脸
+            if tracker is not None:
+                tracks = tracker.associate(rects)
+                track_ids = [track['id'] for track in tracks]
+                verify_indices = [i for i, track in enumerate(tracks) if tracker.needs_verify(track)]
+            else:
+                track_ids = None
+                verify_indices = list(range(len(rects)))
             
-            # 转换为numpy数组
-            return np.array(face_descriptor)
-        except Exception as e:
-            print(f"提取特征时出错: {e}")
-            return None
+            # 获取关键点
+            landmark_start = time.time()
+            shapes = [self.predictor(img_rgb, faces[i]) for i in verify_indices]
+            timings['landmark_time'] = time.time() - landmark_start
+            
+            analyses.append({'rects': rects, 'track_ids': track_ids, 'verify_indices': verify_indices,
+                             'features': [], 'timings': timings})
+            prepared.append((img_rgb, shapes, profile['num_jitters']))
+        
+        # 按抖动次数分组，每组一次计算所有帧中所有人脸的特征向量
+        for num_jitters in sorted({jitters for _, _, jitters in prepared}):
+            group = [i for i, (_, _, jitters) in enumerate(prepared) if jitters == num_jitters]
+            group_timings = {}
+            descriptors = self.compute_descriptors([prepared[i][0] for i in group],
+                                                   [prepared[i][1] for i in group],
+                                                   num_jitters, group_timings)
+            for i, features in zip(group, descriptors):
+                analyses[i]['features'] = features
+                # 同一批次的帧共享特征计算耗时
+                analyses[i]['timings']['descriptor_time'] = group_timings.get('descriptor_time', 0.0)
+                analyses[i]['timings']['descriptor_faces'] = group_timings.get('descriptor_faces', 0)
+        
+        return analyses
     
-    def recognize_face(self, img):
-        """识别图像中的人脸"""
+    def recognize_face(self, img, profile=None, performance=None, tracker=None):
+        """识别图像中的人脸
+
+        profile 为识别配置名 (默认balanced)；performance 不为None时写入本次调用的分阶段耗时
+        (毫秒，stage_seconds 为 {阶段: 秒}，供延迟直方图使用)；
+        tracker 为摄像头会话的跟踪器，提供时只对需要复核的轨迹计算特征，其余沿用缓存身份。
+        启用多进程工作池时，检测和特征计算在工作进程中完成，特征匹配在本进程完成；
+        启用微批处理时，请求先进入调度队列，与并发请求合并成批次后一起计算和匹配。
+        """
         if img is None:
             return []
         
-        # 转换为RGB
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # 检测人脸 - 增加第二个参数以提高检测精度
-        faces = self.detector(img_rgb, 2)
-        results = []
-        
-        # 记录性能数据
-        performance_data = {
-            "detection_time": 0,
-            "recognition_time": 0,
-            "total_time": 0
-        }
-        
+        profile_name, profile = resolve_profile(profile, 'recognize')
         start_time = time.time()
+        results = []
         
-        for face in faces:
-            # 获取人脸坐标
-            x1, y1, x2, y2 = face.left(), face.top(), face.right(), face.bottom()
-            
-            # 获取关键点
-            shape = self.predictor(img_rgb, face)
+        if tracker is not None:
+            tracker.lock.acquire()
+        try:
+            pool = self.worker_pool
+            batcher = self.batcher
+            analyze_start = time.time()
+            if batcher is not None:
+                analysis = batcher.submit(img, profile_name, tracker)
+            elif pool is not None:
+                analysis = pool.analyze(img, profile_name, tracker)
+            else:
+                analysis = self.analyze_faces(img, profile_name, tracker)
+            analyze_time = time.time() - analyze_start
+            rects = analysis['rects']
+            verify_indices = analysis['verify_indices']
+            timings = analysis['timings']
             
-            # 计算特征向量
-            face_descriptor = self.face_reco_model.compute_face_descriptor(img_rgb, shape, 10)  # 增加采样次数提高精度
-            face_feature = np.array(face_descriptor)
+            stages = analysis_stages(timings)
+            if 'matches' in analysis:
+                stages['queue_wait'] = timings.get('queue_wait', 0.0)
+                stages['matching'] = timings.get('match_time', 0.0)
+            if batcher is not None or pool is not None:
+                # 交给调度器或工作进程的额外开销 (序列化、进程间通信、线程唤醒)
+                stages['dispatch'] = max(0.0, analyze_time - sum(stages.values()))
             
-            # 比较与数据库中所有人脸的距离
-            recognition_start = time.time()
+            # 记录性能数据
+            descriptor_faces = timings.get('descriptor_faces', 0)
+            performance_data = {
+                "profile": profile_name,
+                "detection_time": round(timings['detection_time'] * 1000),
+                "landmark_time": round(timings['landmark_time'] * 1000),
+                "descriptor_time": round(timings.get('descriptor_time', 0) * 1000),
+                "descriptor_per_face": round(timings.get('descriptor_time', 0) * 1000 / descriptor_faces, 2)
+                                       if descriptor_faces else 0,
+                "recognition_time": 0,
+                "total_time": 0,
+                "stage_seconds": stages
+            }
+            if pool is not None:
+                performance_data["worker_pool"] = True
             
-            if hasattr(self, 'use_faiss') and self.use_faiss and len(self.face_features) > 0:
-                # 使用FAISS加速特征匹配
-                query_feature = np.array([face_feature]).astype('float32')
-                distances, indices = self.index.search(query_feature, min(5, len(self.face_features)))
-                
-                # 转换为与非FAISS版本相同的格式
-                distances = [(float(distances[0][i]), self.face_names[int(indices[0][i])]) 
-                            for i in range(len(indices[0]))]
+            if 'matches' in analysis:
+                # 调度器已对整个批次一次完成特征匹配
+                all_matches = analysis['matches']
+                performance_data["gallery_version"] = analysis['gallery_version']
+                performance_data["recognition_time"] = round(timings.get('match_time', 0) * 1000)
+                performance_data["batch_size"] = analysis['batch_size']
+                performance_data["queue_wait_time"] = round(timings.get('queue_wait', 0) * 1000, 2)
             else:
-                # 常规特征匹配
-                distances = []
-                for i, stored_feature in enumerate(self.face_features):
-                    # 计算欧氏距离
-                    distance = np.linalg.norm(face_feature - stored_feature)
-                    distances.append((distance, self.face_names[i]))
-            
-            recognition_time = time.time() - recognition_start
-            performance_data["recognition_time"] = round(recognition_time * 1000)
-            
-            # 获取最小距离的人脸
-            if distances:
-                # 使用加权投票策略提高识别准确性
-                # 获取前3个最接近的匹配（如果有的话）
-                top_matches = sorted(distances, key=lambda x: x[0])[:3]
-                
-                # 如果最佳匹配的距离足够小，直接采用
-                if top_matches[0][0] < 0.4:  # 更严格的阈值
-                    min_distance, person_name = top_matches[0]
-                    confidence = 1 - min_distance
-                    
-                    results.append({
-                        'name': person_name,
-                        'distance': float(min_distance),
-                        'confidence': float(confidence),
-                        'rect': [int(x1), int(y1), int(x2), int(y2)]
-                    })
-                # 如果最佳匹配不够明确，但有多个相近的匹配，使用加权投票
-                elif len(top_matches) >= 2 and top_matches[0][0] < 0.55:
-                    # 计算权重（距离的倒数）
-                    weights = [1/(d+0.01) for d, _ in top_matches]
-                    total_weight = sum(weights)
-                    
-                    # 统计加权票数
-                    vote_dict = {}
-                    for i, (dist, name) in enumerate(top_matches):
-                        vote_dict[name] = vote_dict.get(name, 0) + weights[i]/total_weight
-                    
-                    # 获取得票最多的人
-                    winner = max(vote_dict.items(), key=lambda x: x[1])
-                    
-                    # 如果得票率超过阈值，认为识别成功
-                    if winner[1] > 0.6:
-                        # 找到这个人的最小距离
-                        for dist, name in top_matches:
-                            if name == winner[0]:
-                                min_distance = dist
-                                break
-                        
-                        confidence = 1 - min_distance
-                        
-                        results.append({
-                            'name': winner[0],
-                            'distance': float(min_distance),
-                            'confidence': float(confidence),
-                            'rect': [int(x1), int(y1), int(x2), int(y2)]
-                        })
-                    else:
-                        # 无法确定身份
-                        results.append({
-                            'name': 'unknown',
-                            'distance': float(0.6),  # 默认距离
-                            'confidence': float(0.4),  # 默认可信度
-                        'rect': [int(x1), int(y1), int(x2), int(y2)]
-                    })
+                # 一次性比较所有人脸与数据库中所有人脸的距离 (整个请求使用同一个人脸库快照)
+                snapshot = self.gallery
+                performance_data["gallery_version"] = snapshot.version
+                recognition_start = time.time()
+                all_matches = self.match_features(analysis['features'], snapshot=snapshot)
+                recognition_time = time.time() - recognition_start
+                performance_data["recognition_time"] = round(recognition_time * 1000)
+                stages['matching'] = recognition_time
+            
+            # 使用加权投票策略提高识别准确性
+            decisions = {i: self._decide_identity(top_matches) for i, top_matches in zip(verify_indices, all_matches)}
+            
+            for i, rect in enumerate(rects):
+                track = tracker.tracks.get(analysis['track_ids'][i]) if tracker is not None else None
+                if i in decisions:
+                    name, distance, confidence = decisions[i]
+                    if track is not None:
+                        tracker.record(track, name, distance, confidence)
                 else:
-                    # 距离太大，识别为未知人脸
-                    results.append({
-                        'name': 'unknown',
-                        'distance': float(top_matches[0][0]),
-                        'confidence': float(1 - top_matches[0][0]),
-                        'rect': [int(x1), int(y1), int(x2), int(y2)]
-                    })
-            else:
-                results.append({
-                    'name': 'unknown',
-                    'distance': float(1.0),
-                    'confidence': float(0.0),
-                    'rect': [int(x1), int(y1), int(x2), int(y2)]
-                })
+                    # 沿用轨迹缓存的身份
+                    name, distance, confidence = track['name'], track['distance'], track['confidence']
+                
+                result = {
+                    'name': name,
+                    'distance': float(distance),
+                    'confidence': float(confidence),
+                    'rect': rect
+                }
+                if tracker is not None:
+                    result['track_id'] = analysis['track_ids'][i]
+                    result['tracked'] = i not in decisions
+                results.append(result)
+        finally:
+            if tracker is not None:
+                tracker.lock.release()
+        
+        if tracker is not None:
+            performance_data["verified_faces"] = len(verify_indices)
+            performance_data["tracked_faces"] = len(rects) - len(verify_indices)
         
         # 计算总耗时
         total_time = time.time() - start_time
         performance_data["total_time"] = round(total_time * 1000)
-        performance_data["detection_time"] = round((total_time - performance_data["recognition_time"]) * 1000)
         
-        # 将性能数据附加到结果中
-        for result in results:
-            result["performance"] = performance_data
+        if performance is not None:
+            performance.update(performance_data)
         
         return results
     
+    def recognize_batch(self, images, profile=None, stages=None):
+        """批量识别多张图像 (不使用跟踪)
+
+        所有图像通过 analyze_faces_batch 一次完成特征计算，所有人脸特征一次矩阵匹配，
+        整批使用同一个人脸库快照。stages 不为None时写入整批的分析和匹配耗时 (秒)。
+        返回 (每张图像的识别结果列表, 人脸库版本)。
+        """
+        profile_name, _ = resolve_profile(profile, 'recognize')
+        items = [(img, profile_name, None) for img in images]
+        pool = self.worker_pool
+        analyze_start = time.time()
+        analyses = pool.analyze_batch(items) if pool is not None else self.analyze_faces_batch(items)
+        
+        match_start = time.time()
+        snapshot = self.gallery
+        all_matches = self.match_features([f for analysis in analyses for f in analysis['features']],
+                                          snapshot=snapshot)
+        if stages is not None:
+            stages['analysis'] = match_start - analyze_start
+            stages['matching'] = time.time() - match_start
+        batch_results = []
+        offset = 0
+        for analysis in analyses:
+            results = []
+            for rect in analysis['rects']:
+                name, distance, confidence = self._decide_identity(all_matches[offset])
+                offset += 1
+                results.append({'name': name, 'distance': float(distance), 'confidence': float(confidence),
+                                'rect': rect})
+            batch_results.append(results)
+        return batch_results, snapshot.version
+    
+    def benchmark_profiles(self, max_images=200):
+        """识别配置基准测试
+
+        使用本地人脸库中的图像，统计每个配置的平均识别延迟，
+        以及top-1结果与enroll配置的一致率和与所属身份的一致率。
+        """
+        face_dir = app.config['UPLOAD_FOLDER']
+        samples = []
+        for person in sorted(os.listdir(face_dir)):
+            person_dir = os.path.join(face_dir, person)
+            if not os.path.isdir(person_dir):
+                continue
+            for img_file in sorted(os.listdir(person_dir)):
+                if img_file.lower().endswith(('.jpg', '.jpeg', '.png')):
+                    samples.append((os.path.join(person_dir, img_file), person))
+        if len(samples) > max_images:
+            step = len(samples) / max_images
+            samples = [samples[int(i * step)] for i in range(max_images)]
+        
+        images = []
+        for img_path, person in samples:
+            with open(img_path, 'rb') as f:
+                img = cv2.imdecode(np.frombuffer(f.read(), np.uint8), cv2.IMREAD_COLOR)
+            if img is not None:
+                images.append((img, person))
+        if not images:
+            print("人脸库中没有可用于基准测试的图像")
+            return []
+        
+        # enroll配置最先运行，作为一致率的参考
+        profile_names = sorted(app.config['RECOGNITION_PROFILES'], key=lambda n: n != 'enroll')
+        reference = None
+        report = []
+        for profile_name in profile_names:
+            top1 = []
+            start_time = time.time()
+            for img, _ in images:
+                results = self.recognize_face(img, profile_name)
+                if results:
+                    main = max(results, key=lambda r: (r['rect'][2] - r['rect'][0]) * (r['rect'][3] - r['rect'][1]))
+                    top1.append(main['name'])
+                else:
+                    top1.append(None)
+            latency_ms = (time.time() - start_time) * 1000 / len(images)
+            if reference is None:
+                reference = top1
+            report.append({
+                'profile': profile_name,
+                'latency_ms': latency_ms,
+                'agreement': float(np.mean([a == b for a, b in zip(top1, reference)])),
+                'accuracy': float(np.mean([name == person for name, (_, person) in zip(top1, images)]))
+            })
+        
+        print(f"识别配置基准测试: {len(images)} 张图像")
+        for item in report:
+            print(f"  {item['profile']:<10} 延迟={item['latency_ms']:.1f} ms/张  "
+                  f"与enroll一致率={item['agreement']:.3f}  身份一致率={item['accuracy']:.3f}")
+        return report
+    
     @staticmethod
-    def draw_face_rects(img, results):
-        """在图像上绘制人脸框和标签"""
-        img_with_rect = img.copy()
+    def draw_face_rects(img, results, in_place=False):
+        """在图像上绘制人脸框和标签 (in_place为True时直接在原图上绘制，不复制图像)"""
+        img_with_rect = img if in_place else img.copy()
         
         for res in results:
             name = res['name']
@@ -443,12 +3904,104 @@ class FaceRecognitionCore:
         
         try:
             os.makedirs(face_dir)
+            self.catalog.refresh(face_name)
             print(f"成功创建文件夹: {face_dir}")
             return True, f"已创建人脸文件夹: {face_name}"
         except Exception as e:
             print(f"创建文件夹失败: {str(e)}")
             return False, f"创建文件夹失败: {str(e)}"
     
+    @staticmethod
+    def _largest_face(faces):
+        """返回面积最大的人脸框"""
+        return max(faces, key=lambda rect: (rect.right() - rect.left()) * (rect.bottom() - rect.top()))
+    
+    def assess_face_quality(self, img_rgb):
+        """录入图像的人脸质量检查
+
+        检测最大的人脸，检查人脸大小和两眼连线角度，并记录眼睛开合度。
+        通过时返回 (True, {'face_rect': [...], 'quality': {...}})，否则返回 (False, 原因)。
+        """
+        # 检测人脸
+        faces, _ = self.detect_faces(img_rgb, resolve_profile(None, 'enroll')[1])
+        if len(faces) == 0:
+            return False, "未检测到人脸"
+        
+        # 找出最大的人脸
+        main_face = self._largest_face(faces)
+        
+        # 获取人脸区域
+        x1, y1, x2, y2 = main_face.left(), main_face.top(), main_face.right(), main_face.bottom()
+        face_width = x2 - x1
+        face_height = y2 - y1
+        
+        # 人脸质量评估
+        # 1. 检查人脸大小
+        if face_width < 80 or face_height < 80:
+            return False, "人脸太小，请提供更清晰的图像"
+        
+        # 2. 获取关键点
+        shape = self.predictor(img_rgb, main_face)
+        
+        # 3. 检查关键点质量
+        landmarks = [(shape.part(i).x, shape.part(i).y) for i in range(shape.num_parts)]
+        
+        # 4. 计算眼睛开合度（仅用于记录，不进行判断）
+        # 左眼：36-41, 右眼：42-47
+        left_eye_height = np.mean([landmarks[37][1], landmarks[38][1]]) - np.mean([landmarks[40][1], landmarks[41][1]])
+        left_eye_width = landmarks[39][0] - landmarks[36][0]
+        left_eye_ratio = left_eye_height / left_eye_width if left_eye_width > 0 else 0
+        
+        right_eye_height = np.mean([landmarks[43][1], landmarks[44][1]]) - np.mean([landmarks[46][1], landmarks[47][1]])
+        right_eye_width = landmarks[45][0] - landmarks[42][0]
+        right_eye_ratio = right_eye_height / right_eye_width if right_eye_width > 0 else 0
+        
+        eye_aspect_ratio = (left_eye_ratio + right_eye_ratio) / 2
+        
+        # 5. 检查人脸角度
+        # 计算两眼中心点
+        left_eye_center = ((landmarks[36][0] + landmarks[39][0]) // 2, (landmarks[36][1] + landmarks[39][1]) // 2)
+        right_eye_center = ((landmarks[42][0] + landmarks[45][0]) // 2, (landmarks[42][1] + landmarks[45][1]) // 2)
+        
+        # 计算眼睛角度
+        dy = right_eye_center[1] - left_eye_center[1]
+        dx = right_eye_center[0] - left_eye_center[0]
+        angle = np.degrees(np.arctan2(dy, dx))
+        
+        if abs(angle) > 15:
+            return False, "人脸角度过大，请正视摄像头"
+        
+        return True, {
+            "face_rect": [int(x1), int(y1), int(x2), int(y2)],
+            "quality": {
+                "size": [int(face_width), int(face_height)],
+                "eye_aspect_ratio": float(eye_aspect_ratio),
+                "face_angle": float(angle)
+            }
+        }
+    
+    @staticmethod
+    def save_enrollment_image(face_dir, stem, img_data, assessment, timestamp, extra=None):
+        """保存录入图像及其特征描述文件 (<stem>.jpg 和 <stem>.json)，返回图像路径"""
+        img_path = os.path.join(face_dir, f"{stem}.jpg")
+        with open(img_path, 'wb') as f:
+            f.write(img_data)
+        
+        # 创建特征描述文件
+        feature_data = {
+            "timestamp": timestamp,
+            "face_rect": assessment["face_rect"],
+            "quality": assessment["quality"]
+        }
+        if extra:
+            feature_data.update(extra)
+        
+        # 保存特征数据
+        feature_path = os.path.join(face_dir, f"{stem}.json")
+        with open(feature_path, 'w') as f:
+            json.dump(feature_data, f, indent=2)
+        return img_path
+    
     def add_face_image(self, face_name, img_data):
         """添加人脸图像到数据库"""
         face_dir = os.path.join(app.config['UPLOAD_FOLDER'], face_name)
@@ -460,8 +4013,6 @@ class FaceRecognitionCore:
         
         # 生成时间戳文件名
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        img_path = os.path.join(face_dir, f"{timestamp}.jpg")
-        print(f"保存图像到: {img_path}")
         
         try:
             # 解码图像数据
@@ -471,177 +4022,946 @@ class FaceRecognitionCore:
             if img is None:
                 return False, "无法解码图像数据"
             
-            # 转换为RGB
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            
-            # 检测人脸
-            faces = self.detector(img_rgb, 2)
-            if len(faces) == 0:
-                return False, "未检测到人脸"
-            
-            # 找出最大的人脸
-            main_face = max(faces, key=lambda rect: (rect.right() - rect.left()) * (rect.bottom() - rect.top()))
-            
-            # 获取人脸区域
-            x1, y1, x2, y2 = main_face.left(), main_face.top(), main_face.right(), main_face.bottom()
-            face_width = x2 - x1
-            face_height = y2 - y1
+            # 人脸检测和质量检查
+            passed, assessment = self.assess_face_quality(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+            if not passed:
+                return False, assessment
             
-            # 人脸质量评估
-            # 1. 检查人脸大小
-            if face_width < 80 or face_height < 80:
-                return False, "人脸太小，请提供更清晰的图像"
-            
-            # 2. 获取关键点
-            shape = self.predictor(img_rgb, main_face)
-            
-            # 3. 检查关键点质量
-            landmarks = [(shape.part(i).x, shape.part(i).y) for i in range(shape.num_parts)]
-            
-            # 4. 计算眼睛开合度（仅用于记录，不进行判断）
-            # 左眼：36-41, 右眼：42-47
-            left_eye_height = np.mean([landmarks[37][1], landmarks[38][1]]) - np.mean([landmarks[40][1], landmarks[41][1]])
-            left_eye_width = landmarks[39][0] - landmarks[36][0]
-            left_eye_ratio = left_eye_height / left_eye_width if left_eye_width > 0 else 0
-            
-            right_eye_height = np.mean([landmarks[43][1], landmarks[44][1]]) - np.mean([landmarks[46][1], landmarks[47][1]])
-            right_eye_width = landmarks[45][0] - landmarks[42][0]
-            right_eye_ratio = right_eye_height / right_eye_width if right_eye_width > 0 else 0
+            # 保存图像和特征描述文件
+            img_path = self.save_enrollment_image(face_dir, timestamp, img_data, assessment, timestamp)
+            self.catalog.refresh(face_name)
+            print(f"图像保存成功: {img_path}")
+            return True, f"已保存人脸图像: {os.path.basename(img_path)}"
+        except Exception as e:
+            print(f"保存图像失败: {e}")
+            return False, f"保存图像失败: {str(e)}"
+    
+    def check_enroll_images(self, images_data):
+        """批量录入图像的质量检查和特征提取 (可在识别工作进程中执行)
+
+        对每张图像做与 add_face_image 相同的质量检查，通过的图像一次批量计算特征。
+        返回与输入对应的结果列表: 通过时为 {'ok': True, 'face_rect', 'quality', 'feature'}，
+        否则为 {'ok': False, 'message': 原因}。
+        """
+        results = []
+        passed_indices = []
+        passed_images = []
+        for img_data in images_data:
+            img = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                results.append({'ok': False, 'message': "无法解码图像数据"})
+                continue
+            try:
+                passed, assessment = self.assess_face_quality(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+            except Exception as e:
+                passed, assessment = False, f"质量检查失败: {str(e)}"
+            if not passed:
+                results.append({'ok': False, 'message': assessment})
+                continue
+            passed_indices.append(len(results))
+            passed_images.append(img)
+            results.append({'ok': True, **assessment})
+        
+        if passed_images:
+            features = self.extract_features_batch(passed_images)
+            for i, feature in zip(passed_indices, features):
+                if feature is None:
+                    results[i] = {'ok': False, 'message': "无法提取人脸特征"}
+                else:
+                    results[i]['feature'] = np.asarray(feature, dtype=np.float64)
+        return results
+    
+    def bulk_import(self, entries, num_workers=0, total=None):
+        """批量导入录入图像
+
+        entries 为 (姓名, 文件名, 图像字节, 错误信息) 序列。质量检查和特征提取按块分发到识别工作进程
+        (未启用工作池时临时启动 num_workers 个进程，为0时在当前进程中执行)；通过检查的图像写入
+        人脸库目录并生成特征描述文件，特征直接写入特征缓存，全部完成后只更新一次代表特征和索引。
+        与人脸库中已有图像或本次导入中其他图像内容相同的图像作为重复图像跳过。
+        返回导入报告，rejections 列出每张被拒绝图像的原因。
+        """
+        start_time = time.time()
+        chunk_size = max(1, app.config['BULK_IMPORT_CHUNK'])
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # 同一秒内的多次导入 (包括不同工作进程) 文件名不能重复，否则会覆盖之前导入的图像
+        batch_id = uuid.uuid4().hex[:8]
+        face_root = app.config['UPLOAD_FOLDER']
+        
+        # 已有图像的内容哈希 (来自特征缓存)，用于跳过重复图像
+        known_hashes = {}
+        for key, entry in list(self.descriptor_cache.entries.items()):
+            if '/' in key and entry.get('sha1'):
+                known_hashes.setdefault(key.split('/', 1)[0], set()).add(entry['sha1'])
+        
+        pool = self.worker_pool
+        own_pool = None
+        if pool is None and num_workers > 0:
+            own_pool = pool = RecognitionWorkerPool(num_workers)
+            pool.start()
+        
+        report = {'imported': 0, 'rejected': 0, 'duplicates': 0, 'rejections': []}
+        persons = {}
+        progress = ProgressReporter("批量导入", total)
+        
+        def reject(person, filename, reason):
+            report['rejected'] += 1
+            report['rejections'].append({'person': person, 'file': filename, 'reason': reason})
+        
+        def accept(chunk, results):
+            for (person, filename, img_data, digest), result in zip(chunk, results):
+                if not result['ok']:
+                    reject(person, filename, result['message'])
+                    continue
+                face_dir = os.path.join(face_root, person)
+                os.makedirs(face_dir, exist_ok=True)
+                persons[person] = persons.get(person, 0) + 1
+                stem = f"{timestamp}_{batch_id}_{report['imported']:05d}"
+                img_path = self.save_enrollment_image(face_dir, stem, img_data, result, timestamp,
+                                                      {"source": filename})
+                st = os.stat(img_path)
+                self.descriptor_cache.store(img_path, result['feature'],
+                                            {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha1': digest})
+                report['imported'] += 1
+        
+        def finish(chunk, future):
+            try:
+                try:
+                    results = future.result()
+                except BrokenProcessPool:
+                    # 工作进程异常退出，在重启后的工作池中重新检查该块
+                    results = pool.submit(_worker_check_enroll_images, [c[2] for c in chunk])
+                accept(chunk, results)
+            except Exception as e:
+                for person, filename, _, _ in chunk:
+                    reject(person, filename, f"处理失败: {str(e)}")
+            progress.update(len(chunk), f", 导入 {report['imported']} 张, 拒绝 {report['rejected']} 张")
+        
+        def chunks():
+            chunk = []
+            for person, filename, img_data, error in entries:
+                if error is None and (not person or person.startswith('.') or person != os.path.basename(person)):
+                    error = "无效的人名目录"
+                if error is not None:
+                    reject(person, filename, error)
+                    continue
+                digest = hashlib.sha1(img_data).hexdigest()
+                seen = known_hashes.setdefault(person, set())
+                if digest in seen:
+                    report['duplicates'] += 1
+                    reject(person, filename, "重复图像")
+                    continue
+                seen.add(digest)
+                chunk.append((person, filename, img_data, digest))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        
+        try:
+            # 最多同时有 2 * 进程数 个块在处理，内存占用与导入规模无关
+            in_flight = deque()
+            max_in_flight = 2 * (pool.num_workers if pool is not None else 1)
+            for chunk in chunks():
+                if pool is None:
+                    accept(chunk, self.check_enroll_images([c[2] for c in chunk]))
+                    progress.update(len(chunk), f", 导入 {report['imported']} 张, 拒绝 {report['rejected']} 张")
+                else:
+                    in_flight.append((chunk, pool.submit_async(_worker_check_enroll_images, [c[2] for c in chunk])))
+                while in_flight and (len(in_flight) >= max_in_flight or in_flight[0][1].done()):
+                    finish(*in_flight.popleft())
             
-            eye_aspect_ratio = (left_eye_ratio + right_eye_ratio) / 2
+            while in_flight:
+                finish(*in_flight.popleft())
+        finally:
+            if own_pool is not None:
+                own_pool.shutdown()
+        
+        # 全部写入后只更新一次代表特征和索引
+        self.descriptor_cache.save()
+        templates = self.update_identities(sorted(persons)) if persons else {}
+        self.catalog.refresh(sorted(persons))
+        
+        elapsed = time.time() - start_time
+        report.update({
+            'persons': len(persons),
+            'templates': sum(templates.values()),
+            'gallery_version': self.gallery_version,
+            'elapsed': round(elapsed, 1),
+            'images_per_second': round((report['imported'] + report['rejected']) / elapsed, 1) if elapsed else 0
+        })
+        print(f"批量导入完成: {len(persons)} 人, 导入 {report['imported']} 张, 拒绝 {report['rejected']} 张 "
+              f"(其中重复 {report['duplicates']} 张), 耗时 {elapsed:.1f} 秒")
+        return report
+    
+    def get_face_database_info(self, offset=0, limit=None, prefix='', sort='count', descending=True):
+        """获取人脸数据库信息 (从元数据目录分页查询)
+
+        prefix 为姓名前缀，sort 为排序字段 (name/count/time/updated)。
+        """
+        limit = limit or app.config['FACE_CATALOG_PAGE_SIZE']
+        total_faces, total_images, last_update = self.catalog.summary()
+        matched, rows = self.catalog.query(offset, limit, prefix, sort, descending)
+        
+        def format_time(value):
+            return datetime.fromtimestamp(value).strftime("%Y-%m-%d %H:%M:%S") if value else None
+        
+        face_info = [{
+            'name': row['name'],
+            'image_count': row['image_count'],
+            'preview_image': row['preview'],
+            'preview': row['preview'],
+            'time': format_time(row['created_at']),
+            'updated': format_time(row['updated_at']),
+            'quality': {
+                'min_face_size': row['min_face_size'],
+                'eye_aspect_ratio': row['eye_aspect_ratio'],
+                'max_face_angle': row['max_face_angle']
+            }
+        } for row in rows]
+        
+        return {
+            'total_faces': total_faces,
+            'total_images': total_images,
+            'last_update': format_time(last_update),
+            'matched': matched,
+            'offset': offset,
+            'limit': limit,
+            'faces': face_info
+        }
+    
+    def delete_face(self, face_name):
+        """删除人脸文件夹"""
+        face_dir = os.path.join(app.config['UPLOAD_FOLDER'], face_name)
+        print(f"尝试删除人脸文件夹: {face_dir}")
+        
+        if not os.path.exists(face_dir):
+            if face_name in self.imported.name_table:
+                return self.remove_imported(face_name)
+            print(f"人脸文件夹不存在: {face_dir}")
+            return False, f"人脸文件夹 {face_name} 不存在"
+        
+        try:
+            # 删除文件夹中的所有文件
+            for file in os.listdir(face_dir):
+                file_path = os.path.join(face_dir, file)
+                print(f"删除文件: {file_path}")
+                if os.path.isfile(file_path):
+                    os.unlink(file_path)
             
-            # 5. 检查人脸角度
-            # 计算两眼中心点
-            left_eye_center = ((landmarks[36][0] + landmarks[39][0]) // 2, (landmarks[36][1] + landmarks[39][1]) // 2)
-            right_eye_center = ((landmarks[42][0] + landmarks[45][0]) // 2, (landmarks[42][1] + landmarks[45][1]) // 2)
+            # 删除文件夹
+            print(f"删除文件夹: {face_dir}")
+            os.rmdir(face_dir)
             
-            # 计算眼睛角度
-            dy = right_eye_center[1] - left_eye_center[1]
-            dx = right_eye_center[0] - left_eye_center[0]
-            angle = np.degrees(np.arctan2(dy, dx))
+            # 从内存人脸库中移除该身份
+            self.remove_identity(face_name)
+            self.thumbnails.invalidate(face_name)
             
-            if abs(angle) > 15:
-                return False, "人脸角度过大，请正视摄像头"
+            return True, f"已删除人脸: {face_name}"
+        except Exception as e:
+            print(f"删除人脸时出错: {str(e)}")
+            return False, f"删除人脸时出错: {str(e)}"
+        finally:
+            self.catalog.refresh(face_name)
+
+# 多进程识别工作池
+# 每个工作进程只加载一次dlib模型，负责检测、关键点和特征计算；
+# 人脸库只保存在主进程中，特征匹配在主进程完成，工作进程无需持有人脸库副本
+_worker_core = None
+
+def _init_recognition_worker(config):
+    """工作进程初始化: 同步主进程配置并加载模型 (不加载人脸库)"""
+    global _worker_core
+    app.config.update(config)
+    _worker_core = FaceRecognitionCore(load_database=False)
+
+def _worker_analyze_batch(items):
+    """工作进程任务: 批量检测并计算人脸特征，返回分析结果和更新后的跟踪器"""
+    analyses = _worker_core.analyze_faces_batch(items)
+    return analyses, [tracker for _, _, tracker in items]
+
+def _worker_check_enroll_images(images_data):
+    """工作进程任务: 批量导入的质量检查和特征提取"""
+    return _worker_core.check_enroll_images(images_data)
+
+def _worker_extract_batch(img_paths, profile_name):
+    """工作进程任务: 批量提取录入图像特征"""
+    timings = {}
+    features = _worker_core.extract_features_batch(img_paths, timings, profile_name)
+    return features, timings
+
+class RecognitionWorkerPool:
+    """多进程识别工作池
+
+    使用 ProcessPoolExecutor 启动 N 个工作进程，每个进程在初始化时加载一次dlib模型。
+    识别请求把图像发送给空闲的工作进程计算特征，主进程只做特征匹配。
+    """
+    # 工作进程需要与主进程保持一致的配置项
+    SHARED_CONFIG_KEYS = ('RECOGNITION_PROFILES', 'ENDPOINT_PROFILES', 'UPLOAD_FOLDER', 'DESCRIPTOR_BATCH_SIZE')
+    
+    def __init__(self, num_workers):
+        self.num_workers = num_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.failures = 0
+    
+    def start(self):
+        """启动工作进程"""
+        config = {key: app.config[key] for key in self.SHARED_CONFIG_KEYS}
+        context = multiprocessing.get_context(app.config['WORKER_START_METHOD'])
+        self._executor = ProcessPoolExecutor(max_workers=self.num_workers, mp_context=context,
+                                             initializer=_init_recognition_worker, initargs=(config,))
+        # 预热: 确保所有工作进程完成模型加载后再接收请求
+        list(self._executor.map(_worker_noop, range(self.num_workers)))
+        print(f"识别工作池已启动: {self.num_workers} 个工作进程")
+    
+    def _restart(self, broken):
+        """重启损坏的工作池 broken；多个线程同时发现同一个工作池损坏时只重启一次"""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            print("识别工作进程异常退出，重启工作池")
+            self.failures += 1
+            try:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            except Exception:
+                pass
+            self.start()
+    
+    def submit(self, fn, *args):
+        """提交任务并等待结果，工作池损坏时重启后重试一次"""
+        self.submitted += 1
+        executor = self._executor
+        try:
+            return executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            self._restart(executor)
+            return self._executor.submit(fn, *args).result()
+    
+    def submit_async(self, fn, *args):
+        """提交任务，不等待结果，返回Future；工作池已损坏时重启后提交
+
+        Future 的结果可能是 BrokenProcessPool (任务执行期间工作进程异常退出)，调用方可以重新提交，
+        此时会在重启后的工作池中执行。
+        """
+        self.submitted += 1
+        executor = self._executor
+        try:
+            return executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._restart(executor)
+            return self._executor.submit(fn, *args)
+    
+    def analyze(self, img, profile_name, tracker):
+        """在工作进程中检测并计算特征"""
+        return self.analyze_batch([(img, profile_name, tracker)])[0]
+    
+    def analyze_batch(self, items):
+        """在一个工作进程中批量检测并计算特征；跟踪器以副本传入，返回后同步回主进程的跟踪器"""
+        analyses, tracker_copies = self.submit(_worker_analyze_batch, items)
+        for (_, _, tracker), tracker_copy in zip(items, tracker_copies):
+            if tracker is not None:
+                tracker.tracks = tracker_copy.tracks
+                tracker.next_id = tracker_copy.next_id
+                tracker.last_used = tracker_copy.last_used
+        return analyses
+    
+    def extract_features_batch(self, img_paths, timings=None, profile_name='enroll'):
+        """在工作进程中批量提取录入图像特征"""
+        features, worker_timings = self.submit(_worker_extract_batch, img_paths, profile_name)
+        if timings is not None:
+            for key, value in worker_timings.items():
+                timings[key] = timings.get(key, 0) + value
+        return features
+    
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+def _worker_noop(_):
+    return os.getpid()
+
+class RecognitionBatcher:
+    """识别请求微批处理调度器
+
+    识别请求把解码后的图像放入队列，调度线程等待最多 max_wait_ms 毫秒或凑满 max_batch 帧后，
+    一次完成整批的关键点、特征向量计算和矩阵匹配，再把结果分发回各个等待的请求。
+    队列超过 max_queue 时直接拒绝新请求，避免延迟无限增长。
+    """
+    
+    class _Request:
+        __slots__ = ('img', 'profile_name', 'tracker', 'enqueued', 'done', 'result', 'error')
+        
+        def __init__(self, img, profile_name, tracker):
+            self.img = img
+            self.profile_name = profile_name
+            self.tracker = tracker
+            self.enqueued = time.time()
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+    
+    def __init__(self, core, max_batch=8, max_wait_ms=5, max_queue=64, dispatchers=1):
+        self.core = core
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0, max_wait_ms) / 1000.0
+        self.max_queue = max_queue
+        self.dispatchers = max(1, dispatchers)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._running = False
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+    
+    def reset_stats(self):
+        with self._stats_lock:
+            self.requests = 0
+            self.batches = 0
+            self.rejected = 0
+            self.max_batch_seen = 0
+            self.max_queue_seen = 0
+            self.total_wait = 0.0
+            self.max_wait_seen = 0.0
+            self.total_batch_time = 0.0
+            self.batch_sizes = {}
+    
+    def start(self):
+        self._running = True
+        for i in range(self.dispatchers):
+            thread = threading.Thread(target=self._dispatch_loop, name=f'recognition-batcher-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"识别微批处理已启用: 批大小 {self.max_batch}, 等待 {self.max_wait * 1000:.1f}ms, "
+              f"队列深度 {self.max_queue}, 调度线程 {self.dispatchers}")
+    
+    def stop(self):
+        self._running = False
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+    
+    def submit(self, img, profile_name, tracker=None):
+        """提交一帧图像并等待所在批次完成，返回分析结果 (含批量匹配结果 matches)"""
+        item = self._Request(img, profile_name, tracker)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            raise RuntimeError('识别请求队列已满，请稍后重试')
+        
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self.max_queue_seen = max(self.max_queue_seen, depth)
+        
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+    
+    def _collect(self):
+        """取出一个批次: 第一帧到达后最多再等待 max_wait 秒"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = first.enqueued + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # 停止信号放回队列，处理完当前批次后退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+    
+    def _dispatch_loop(self):
+        while self._running:
+            batch = self._collect()
+            if batch is None:
+                break
+            self._run_batch(batch)
+    
+    def _run_batch(self, batch):
+        start_time = time.time()
+        items = [(item.img, item.profile_name, item.tracker) for item in batch]
+        try:
+            pool = self.core.worker_pool
+            if pool is not None:
+                analyses = pool.analyze_batch(items)
+            else:
+                analyses = self.core.analyze_faces_batch(items)
             
-            # 保存图像
-            with open(img_path, 'wb') as f:
-                f.write(img_data)
-                print(f"图像保存成功: {img_path}")
-                
-                # 创建特征描述文件
-                feature_data = {
-                    "timestamp": timestamp,
-                    "face_rect": [int(x1), int(y1), int(x2), int(y2)],
-                    "quality": {
-                        "size": [face_width, face_height],
-                        "eye_aspect_ratio": float(eye_aspect_ratio),
-                        "face_angle": float(angle)
-                    }
-                }
-                
-                # 保存特征数据
-                feature_path = os.path.join(face_dir, f"{timestamp}.json")
-                with open(feature_path, 'w') as f:
-                    json.dump(feature_data, f, indent=2)
+            # 整个批次的人脸特征一次矩阵匹配
+            match_start = time.time()
+            snapshot = self.core.gallery
+            all_features = [feature for analysis in analyses for feature in analysis['features']]
+            all_matches = self.core.match_features(all_features, snapshot=snapshot)
+            match_time = time.time() - match_start
             
-            return True, f"已保存人脸图像: {os.path.basename(img_path)}"
+            offset = 0
+            for item, analysis in zip(batch, analyses):
+                count = len(analysis['features'])
+                analysis['matches'] = all_matches[offset:offset + count]
+                offset += count
+                analysis['batch_size'] = len(batch)
+                analysis['gallery_version'] = snapshot.version
+                analysis['timings']['match_time'] = match_time
+                analysis['timings']['queue_wait'] = start_time - item.enqueued
+                item.result = analysis
         except Exception as e:
-            print(f"保存图像失败: {e}")
-            return False, f"保存图像失败: {str(e)}"
+            for item in batch:
+                item.error = e
+        
+        batch_time = time.time() - start_time
+        with self._stats_lock:
+            self.batches += 1
+            self.requests += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+            self.total_batch_time += batch_time
+            for item in batch:
+                wait = start_time - item.enqueued
+                self.total_wait += wait
+                self.max_wait_seen = max(self.max_wait_seen, wait)
+        
+        for item in batch:
+            item.done.set()
+    
+    def stats(self):
+        """调度器统计: 批大小、排队等待时间和队列深度"""
+        with self._stats_lock:
+            return {
+                'max_batch': self.max_batch,
+                'max_wait_ms': round(self.max_wait * 1000, 2),
+                'max_queue': self.max_queue,
+                'dispatchers': self.dispatchers,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self.max_queue_seen,
+                'requests': self.requests,
+                'batches': self.batches,
+                'rejected': self.rejected,
+                'avg_batch_size': round(self.requests / self.batches, 2) if self.batches else 0,
+                'max_batch_size': self.max_batch_seen,
+                'batch_size_counts': {str(size): count for size, count in sorted(self.batch_sizes.items())},
+                'avg_queue_wait_ms': round(self.total_wait * 1000 / self.requests, 2) if self.requests else 0,
+                'max_queue_wait_ms': round(self.max_wait_seen * 1000, 2),
+                'avg_batch_time_ms': round(self.total_batch_time * 1000 / self.batches, 2) if self.batches else 0
+            }
+
+def process_memory(pid='self'):
+    """读取进程内存占用 (MB)
+
+    rss 为常驻内存；pss 按共享进程数分摊共享页，所有工作进程的pss之和即实际占用；
+    shared 为与其他进程共享的页 (写时复制的模型和人脸库)，private 为进程独占的页。
+    非Linux系统返回None。
+    """
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                parts = value.split()
+                if len(parts) == 2 and parts[1] == 'kB':
+                    fields[key] = int(parts[0])
+    except OSError:
+        try:
+            with open(f'/proc/{pid}/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        fields['Rss'] = int(line.split()[1])
+        except OSError:
+            return None
+    
+    if 'Rss' not in fields:
+        return None
+    to_mb = lambda kb: round(kb / 1024.0, 1)
+    memory = {'rss_mb': to_mb(fields['Rss'])}
+    if 'Pss' in fields:
+        memory['pss_mb'] = to_mb(fields['Pss'])
+        memory['shared_mb'] = to_mb(fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0))
+        memory['private_mb'] = to_mb(fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0))
+    return memory
+
+def worker_group_pids():
+    """预派生部署时同一主进程下的所有工作进程号 (无法获取时只返回当前进程)"""
+    ppid = os.getppid()
+    try:
+        with open(f'/proc/{ppid}/task/{ppid}/children', 'r') as f:
+            pids = [int(pid) for pid in f.read().split()]
+        if os.getpid() in pids:
+            return pids
+    except OSError:
+        pass
+    return [os.getpid()]
+
+class PreforkServer:
+    """预派生多进程HTTP服务器
+
+    主进程加载模型和人脸库后绑定监听端口，再fork出 num_workers 个工作进程共享同一个监听套接字。
+    fork前调用 gc.freeze()，避免垃圾回收改写对象头导致共享页被复制，
+    dlib模型、人脸库矩阵和FAISS索引在各工作进程之间以写时复制方式共享。
+
+    - 工作进程处理 max_requests (加随机抖动) 个请求，或独占内存超过 memory_limit_mb 后自动回收重启
+    - 收到SIGTERM/SIGINT时停止接收新连接，等待进行中的请求完成 (最多 graceful_timeout 秒)
+    - 收到SIGHUP时逐个重启所有工作进程
+    - 每隔 report_interval 秒输出各工作进程的内存占用
+    """
+    
+    def __init__(self, wsgi_app, host, port, num_workers, max_requests=0, max_requests_jitter=0,
+                 graceful_timeout=30, memory_limit_mb=0, report_interval=60, post_fork=None, worker_exit=None,
+                 reaped=None):
+        self.wsgi_app = wsgi_app
+        self.host = host
+        self.port = port
+        self.num_workers = max(1, num_workers)
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.report_interval = report_interval
+        self.post_fork = post_fork
+        self.worker_exit = worker_exit
+        self.reaped = reaped
+        self.listener = None
+        self.workers = {}
+        self._stopping = False
+        self._reload = False
     
-    def get_face_database_info(self):
-        """获取人脸数据库信息"""
-        face_dir = app.config['UPLOAD_FOLDER']
-        print(f"获取人脸数据库信息: {face_dir}")
+    def run(self):
+        """主进程: 派生工作进程并监控，工作进程退出后按原编号重新派生"""
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self.listener = socket.socket(family, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.listener.listen(socket.SOMAXCONN)
+        self.listener.set_inheritable(True)
         
-        if not os.path.exists(face_dir):
-            print(f"人脸数据库目录不存在: {face_dir}")
-            return {
-                'total_faces': 0,
-                'total_images': 0,
-                'faces': []
-            }
+        # 冻结已有对象，工作进程中的垃圾回收不再触碰这些对象所在的内存页
+        gc.collect()
+        gc.freeze()
         
-        face_info = []
-        total_images = 0
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
         
-        # 遍历人脸文件夹
-        person_folders = [f for f in os.listdir(face_dir) if os.path.isdir(os.path.join(face_dir, f))]
-        print(f"获取到 {len(person_folders)} 个人脸文件夹")
+        print(f"主进程 {os.getpid()} 监听 {self.host}:{self.port}，启动 {self.num_workers} 个工作进程")
+        for slot in range(self.num_workers):
+            self._spawn(slot)
         
-        for person in person_folders:
-            person_dir = os.path.join(face_dir, person)
+        last_report = time.time()
+        while not self._stopping:
+            self._reap()
+            if self._reload:
+                self._reload = False
+                self._recycle_all()
+            if time.time() - last_report >= self.report_interval:
+                last_report = time.time()
+                self._report_memory()
+            time.sleep(0.5)
+        
+        self._shutdown()
+    
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+    
+    def _handle_reload(self, signum, frame):
+        self._reload = True
+    
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
             try:
-                image_files = [f for f in os.listdir(person_dir) 
-                              if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-                
-                image_count = len(image_files)
-                total_images += image_count
-                print(f"人脸 '{person}' 包含 {image_count} 张图像")
-                
-                if image_files:
-                    # 获取第一张图片作为预览
-                    preview_image = os.path.join(person, image_files[0])
-                    
-                    face_info.append({
-                        'name': person,
-                        'image_count': image_count,
-                        'preview_image': preview_image
-                    })
+                self._worker_main(slot)
             except Exception as e:
-                print(f"处理人脸文件夹 '{person}' 时出错: {str(e)}")
-        
-        result = {
-            'total_faces': len(person_folders),
-            'total_images': total_images,
-            'faces': face_info
-        }
-        print(f"返回人脸数据库信息: {len(face_info)} 条记录")
-        return result
+                print(f"工作进程 {os.getpid()} 异常退出: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = {'slot': slot, 'started': time.time(), 'stopping': False}
     
-    def delete_face(self, face_name):
-        """删除人脸文件夹"""
-        face_dir = os.path.join(app.config['UPLOAD_FOLDER'], face_name)
-        print(f"尝试删除人脸文件夹: {face_dir}")
+    def _reap(self):
+        """回收已退出的工作进程，未在停止服务时按原编号重新派生"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            info = self.workers.pop(pid, None)
+            if info is None:
+                continue
+            if self.reaped is not None:
+                self.reaped(pid)
+            if not self._stopping:
+                if not info['stopping']:
+                    print(f"工作进程 {pid} 退出 (状态 {status})，重新启动")
+                self._spawn(info['slot'])
+    
+    def _stop_worker(self, pid):
+        self.workers[pid]['stopping'] = True
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    
+    def _recycle_all(self):
+        """逐个重启工作进程，始终保持其余工作进程在线"""
+        for pid in list(self.workers):
+            slot = self.workers[pid]['slot']
+            self._stop_worker(pid)
+            deadline = time.time() + self.graceful_timeout
+            while pid in self.workers and time.time() < deadline and not self._stopping:
+                self._reap()
+                time.sleep(0.1)
+            print(f"工作进程 {slot} 已重启")
+    
+    def _report_memory(self):
+        """输出各工作进程内存占用，并回收独占内存超限的工作进程"""
+        total_pss = 0.0
+        parent = process_memory()
+        lines = []
+        if parent:
+            total_pss += parent.get('pss_mb', parent['rss_mb'])
+            lines.append(f"  主进程 {os.getpid()}: {parent}")
+        for pid, info in sorted(self.workers.items(), key=lambda item: item[1]['slot']):
+            memory = process_memory(pid)
+            if memory is None:
+                continue
+            total_pss += memory.get('pss_mb', memory['rss_mb'])
+            lines.append(f"  工作进程 {info['slot']} ({pid}): {memory}")
+            private = memory.get('private_mb', memory['rss_mb'])
+            if self.memory_limit_mb and private > self.memory_limit_mb and not info['stopping']:
+                print(f"工作进程 {pid} 独占内存 {private}MB 超过限制 {self.memory_limit_mb}MB，回收重启")
+                self._stop_worker(pid)
+        print(f"内存占用 (合计PSS {total_pss:.1f}MB):")
+        for line in lines:
+            print(line)
+    
+    def _shutdown(self):
+        """优雅停止: 通知所有工作进程停止接收新连接，超时后强制结束"""
+        print("正在停止服务，等待进行中的请求完成...")
+        for pid in list(self.workers):
+            self._stop_worker(pid)
+        deadline = time.time() + self.graceful_timeout
+        while self.workers and time.time() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            print(f"工作进程 {pid} 未在 {self.graceful_timeout} 秒内退出，强制结束")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.workers.clear()
+        self.listener.close()
+        print("服务已停止")
+    
+    def _worker_main(self, slot):
+        """工作进程: 在共享的监听套接字上运行多线程WSGI服务器"""
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        np.random.seed(os.getpid() % (2 ** 32))
         
-        if not os.path.exists(face_dir):
-            print(f"人脸文件夹不存在: {face_dir}")
-            return False, f"人脸文件夹 {face_name} 不存在"
+        if self.post_fork is not None:
+            self.post_fork(slot)
         
-        try:
-            # 删除文件夹中的所有文件
-            for file in os.listdir(face_dir):
-                file_path = os.path.join(face_dir, file)
-                print(f"删除文件: {file_path}")
-                if os.path.isfile(file_path):
-                    os.unlink(file_path)
-            
-            # 删除文件夹
-            print(f"删除文件夹: {face_dir}")
-            os.rmdir(face_dir)
-            
-            # 重新加载人脸数据库
-            print("重新加载人脸数据库")
-            self.load_face_database()
-            
-            return True, f"已删除人脸: {face_name}"
-        except Exception as e:
-            print(f"删除人脸时出错: {str(e)}")
-            return False, f"删除人脸时出错: {str(e)}"
+        server = make_server(self.host, self.port, self.wsgi_app, threaded=True, fd=self.listener.fileno())
+        # 请求线程不设为守护线程，server_close 时等待进行中的请求完成
+        server.daemon_threads = False
+        self.listener.close()
+        
+        stop_once = threading.Lock()
+        
+        def stop_server():
+            if stop_once.acquire(blocking=False):
+                threading.Thread(target=server.shutdown, daemon=True).start()
+        
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_server())
+        
+        limit = 0
+        if self.max_requests:
+            limit = self.max_requests + random.randint(0, max(0, self.max_requests_jitter))
+        served = [0]
+        served_lock = threading.Lock()
+        wsgi_app = server.app
+        
+        def counting_app(environ, start_response):
+            with served_lock:
+                served[0] += 1
+                count = served[0]
+            if limit and count == limit:
+                print(f"工作进程 {os.getpid()} 已处理 {count} 个请求，回收重启")
+                stop_server()
+            return wsgi_app(environ, start_response)
+        
+        server.app = counting_app
+        print(f"工作进程 {slot} ({os.getpid()}) 已就绪")
+        server.serve_forever()
+        server.server_close()
+        if self.worker_exit is not None:
+            self.worker_exit()
 
 # 初始化人脸识别核心
 face_core = None
 
-def init_face_core():
-    """初始化人脸识别核心"""
+# 各接口分阶段延迟直方图 (/metrics)
+latency_metrics = LatencyMetrics(app.config['METRICS_BUCKETS'])
+
+# 实时识别的摄像头会话跟踪器
+tracker_registry = TrackerRegistry()
+
+# 服务器端视频源
+camera_manager = CameraManager()
+
+# 视频文件识别任务
+video_jobs = VideoJobManager()
+
+# 多摄像头接入网关 (首次使用时启动)
+camera_gateway = None
+_gateway_lock = threading.Lock()
+
+def get_camera_gateway():
+    """返回接入网关，首次调用时启动事件循环线程"""
+    global camera_gateway
+    with _gateway_lock:
+        if camera_gateway is None:
+            gateway = CameraGateway()
+            gateway.start()
+            camera_gateway = gateway
+    return camera_gateway
+
+def start_cameras(sources, loop=False):
+    """按 CAMERA_BACKEND 配置启动服务器端视频源 (thread: 每路独立线程，gateway: 接入网关)"""
+    for source in sources:
+        if app.config['CAMERA_BACKEND'] == 'gateway':
+            get_camera_gateway().add(source, loop=loop)
+        else:
+            camera_manager.add(source, loop=loop)
+
+def init_face_core(num_workers=0, batching=False):
+    """初始化人脸识别核心 (num_workers大于0时启动多进程识别工作池，batching为True时启用微批处理)"""
     global face_core
     try:
         face_core = FaceRecognitionCore()
+        face_core.start_worker_pool(num_workers)
+        if batching:
+            face_core.start_batcher(app.config['BATCH_MAX_SIZE'], app.config['BATCH_MAX_WAIT_MS'],
+                                    app.config['BATCH_QUEUE_DEPTH'])
         return True
     except Exception as e:
         print(f"初始化人脸识别核心错误: {e}")
         return False
 
+def create_app(config=None):
+    """应用工厂: 应用配置覆盖，加载模型和人脸库，返回WSGI应用
+
+    可交给任意WSGI服务器，例如在加载后再fork的gunicorn:
+        gunicorn --preload -w 4 --threads 8 -b 0.0.0.0:8888 'app:create_app()'
+    """
+    if config:
+        app.config.update(config)
+    if face_core is None:
+        if not init_face_core(app.config['RECOGNITION_WORKERS'], app.config['RECOGNITION_BATCHING']):
+            raise RuntimeError("人脸识别服务初始化失败")
+    return app
+
+def _post_fork_init(slot, cameras=(), camera_loop=False):
+    """预派生工作进程启动后的初始化: 启动各进程自己的后台线程和子进程"""
+    app.config['SERVER_WORKER_SLOT'] = slot
+    app.config['SERVER_STARTED_AT'] = time.time()
+    face_core.start_worker_pool(app.config['RECOGNITION_WORKERS'])
+    if app.config['RECOGNITION_BATCHING']:
+        face_core.start_batcher(app.config['BATCH_MAX_SIZE'], app.config['BATCH_MAX_WAIT_MS'],
+                                app.config['BATCH_QUEUE_DEPTH'])
+    # 服务器端视频源只在单进程部署时启动 (预派生部署时拒绝 --camera)
+    if slot == 0:
+        start_cameras(cameras, camera_loop)
+
+def _worker_exit():
+    """工作进程退出前写出尚未保存的状态"""
+    face_core.descriptor_cache.save()
+    latency_metrics.flush()
+
+def serve(host='0.0.0.0', port=8888, num_workers=None, cameras=(), camera_loop=False):
+    """生产部署入口
+
+    主进程先加载dlib模型和人脸库，再fork出多个工作进程以写时复制方式共享。
+    后台线程 (微批处理调度器、识别工作池、视频源) 在fork之后由各工作进程自行启动。
+    不支持fork的平台 (Windows) 退化为单进程多线程服务器。
+    """
+    global face_core
+    num_workers = num_workers or app.config['SERVE_WORKERS']
+    app.config['SERVER_MODE'] = 'prefork' if hasattr(os, 'fork') and num_workers > 1 else 'threaded'
+    app.config['SERVER_STARTED_AT'] = time.time()
+    if app.config['SERVER_MODE'] == 'prefork' and cameras:
+        # 视频源的状态和识别结果只保存在运行它的工作进程中，其他工作进程无法查询
+        raise RuntimeError("多进程部署不支持服务器端视频源 (--camera)，请使用 --http-workers 1")
+    
+    # fork前只加载模型和人脸库，不启动任何线程或子进程
+    if face_core is None:
+        if not init_face_core():
+            raise RuntimeError("人脸识别服务初始化失败")
+    
+    if app.config['SERVER_MODE'] == 'threaded':
+        _post_fork_init(0, cameras, camera_loop)
+        print(f"人脸识别服务器 (多线程) 启动于 http://{host}:{port}")
+        server = make_server(host, port, app, threaded=True)
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        _worker_exit()
+        return
+    
+    # 多个工作进程通过变更日志同步录入和删除
+    face_core.journal = GalleryJournal(app.config['GALLERY_JOURNAL'], reset=True)
+    # 各工作进程的延迟统计通过共享目录合并
+    latency_metrics.share(app.config['METRICS_FOLDER'], app.config['METRICS_FLUSH_INTERVAL'])
+    server = PreforkServer(app, host, port, num_workers,
+                           max_requests=app.config['SERVE_MAX_REQUESTS'],
+                           max_requests_jitter=app.config['SERVE_MAX_REQUESTS_JITTER'],
+                           graceful_timeout=app.config['SERVE_GRACEFUL_TIMEOUT'],
+                           memory_limit_mb=app.config['SERVE_WORKER_MEMORY_LIMIT_MB'],
+                           report_interval=app.config['SERVE_MEMORY_REPORT_INTERVAL'],
+                           post_fork=lambda slot: _post_fork_init(slot, cameras, camera_loop),
+                           worker_exit=_worker_exit,
+                           reaped=latency_metrics.retire)
+    server.run()
+
+@app.before_request
+def sync_gallery_before_request():
+    """多进程部署时，处理请求前应用其他工作进程的人脸库变更"""
+    if face_core is not None and face_core.journal is not None:
+        face_core.sync_gallery()
+
+def single_process_only(view):
+    """只在单进程部署时可用的接口
+
+    视频任务、服务器端视频源、接入网关和微批处理统计保存在各工作进程的内存中，预派生部署时
+    后续请求可能被分配到其他工作进程，查询不到或操作到错误的对象，因此直接拒绝。
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if app.config['SERVER_MODE'] == 'prefork':
+            return jsonify({'success': False,
+                            'message': '多进程部署 (--serve) 时不支持该接口，请使用 --http-workers 1 或单进程模式'}), 409
+        return view(*args, **kwargs)
+    return wrapper
+
 # 检查文件后缀名是否允许
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
@@ -673,6 +4993,17 @@ def more_features():
     """更多功能页面"""
     return render_template('more_features.html')
 
+def request_performance(endpoint, stages, total_time, **extra):
+    """记录接口的延迟直方图，返回响应中的性能信息 (毫秒)"""
+    latency_metrics.observe(endpoint, stages, total_time)
+    performance_info = {
+        'total_time': round(total_time * 1000, 2),  # 整个请求的处理耗时 (含解码、绘制和编码)
+        'detection_time': round(stages.get('detection', 0.0) * 1000, 2),  # 仅人脸检测耗时
+        'stages': {stage: round(seconds * 1000, 2) for stage, seconds in stages.items()}
+    }
+    performance_info.update(extra)
+    return performance_info
+
 # API - 识别上传的图片
 @app.route('/api/recognize', methods=['POST'])
 def api_recognize():
@@ -681,6 +5012,8 @@ def api_recognize():
         return jsonify({'success': False, 'message': '人脸识别服务未初始化'})
     
     try:
+        request_start = time.time()
+        
         # 获取图像数据
         if 'image' in request.files:
             # 从表单获取图像文件
@@ -692,11 +5025,13 @@ def api_recognize():
             img_data = file.read()
             img_np = np.frombuffer(img_data, np.uint8)
             img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
+            profile = request.form.get('profile')
         elif request.is_json:
             # 从JSON获取Base64图像数据
             data = request.get_json()
             if 'image' not in data:
                 return jsonify({'success': False, 'message': '缺少图像数据'})
+            profile = data.get('profile')
             
             # 解析Base64图像
             base64_data = data['image'].split(',')[1] if ',' in data['image'] else data['image']
@@ -705,79 +5040,450 @@ def api_recognize():
             img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
         else:
             return jsonify({'success': False, 'message': '未提供图像数据'})
+        decode_time = time.time() - request_start
+        
+        # 解析识别配置 (查询参数优先)
+        try:
+            profile_name, _ = resolve_profile(request.args.get('profile') or profile, 'recognize')
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
         
         # 识别人脸
-        start_time = time.time()
-        results = face_core.recognize_face(img)
-        recognition_time = time.time() - start_time
+        stage_performance = {}
+        results = face_core.recognize_face(img, profile_name, stage_performance)
         
         # 增加性能信息
-        performance_info = {
-            'detection_time': round(recognition_time * 1000, 2),  # 毫秒
-            'face_count': len(results)
-        }
+        stages = dict(stage_performance['stage_seconds'], decode=decode_time)
+        performance_info = request_performance('recognize', stages, time.time() - request_start,
+                                               profile=profile_name, face_count=len(results))
         
         return jsonify({
             'success': True, 
             'faces': results,
+            'gallery_version': stage_performance.get('gallery_version', face_core.gallery_version),
             'performance': performance_info
         })
     except Exception as e:
         return jsonify({'success': False, 'message': f'识别错误: {str(e)}'})
 
+def iter_batch_uploads(uploads):
+    """依次产出批量识别上传中的 (文件名, 图像字节, 错误信息)
+
+    uploads 为 (文件名, 文件对象) 列表。zip压缩包逐个条目读取，不会整体解压到内存；
+    超过大小限制或类型不支持的文件只返回错误信息。
+    """
+    max_bytes = app.config['BATCH_RECOGNIZE_MAX_IMAGE_BYTES']
+    for filename, stream in uploads:
+        if filename.lower().endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(stream)
+            except zipfile.BadZipFile:
+                yield filename, None, '无效的zip文件'
+                continue
+            with archive:
+                for info in archive.infolist():
+                    if info.is_dir() or os.path.basename(info.filename).startswith('.'):
+                        continue
+                    if not allowed_file(info.filename):
+                        yield info.filename, None, '不支持的文件类型'
+                    elif info.file_size > max_bytes:
+                        yield info.filename, None, '图像文件过大'
+                    else:
+                        yield info.filename, archive.read(info), None
+        elif not allowed_file(filename):
+            yield filename, None, '不支持的文件类型'
+        else:
+            data = stream.read(max_bytes + 1)
+            if len(data) > max_bytes:
+                yield filename, None, '图像文件过大'
+            else:
+                yield filename, data, None
+
+def zip_entry_name(info):
+    """zip条目名称: 未设置UTF-8标志的条目按GBK解码 (Windows压缩工具生成的中文文件名)"""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode('cp437').decode('gbk')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+def iter_enrollment_directory(root):
+    """遍历 <root>/<姓名>/*.jpg 目录，产出 (姓名, 文件名, 图像字节, 错误信息)"""
+    max_bytes = app.config['BATCH_RECOGNIZE_MAX_IMAGE_BYTES']
+    for person in sorted(os.listdir(root)):
+        person_dir = os.path.join(root, person)
+        if not os.path.isdir(person_dir) or person.startswith('.'):
+            continue
+        for filename in sorted(os.listdir(person_dir)):
+            img_path = os.path.join(person_dir, filename)
+            display_name = f"{person}/{filename}"
+            if not os.path.isfile(img_path) or filename.startswith('.') or filename.lower().endswith('.json'):
+                continue
+            if not allowed_file(filename):
+                yield person, display_name, None, '不支持的文件类型'
+            elif os.path.getsize(img_path) > max_bytes:
+                yield person, display_name, None, '图像文件过大'
+            else:
+                with open(img_path, 'rb') as f:
+                    yield person, display_name, f.read(), None
+
+def iter_enrollment_archive(archive):
+    """遍历zip中 [任意上级目录/]<姓名>/*.jpg 结构的条目，产出 (姓名, 文件名, 图像字节, 错误信息)"""
+    max_bytes = app.config['BATCH_RECOGNIZE_MAX_IMAGE_BYTES']
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        name = zip_entry_name(info)
+        parts = [part for part in name.split('/') if part]
+        if not parts or any(part.startswith('.') or part == '__MACOSX' for part in parts):
+            continue
+        if name.lower().endswith('.json'):
+            continue
+        person = parts[-2] if len(parts) >= 2 else None
+        if person is None:
+            yield None, name, None, '缺少人名目录'
+        elif not allowed_file(name):
+            yield person, name, None, '不支持的文件类型'
+        elif info.file_size > max_bytes:
+            yield person, name, None, '图像文件过大'
+        else:
+            yield person, name, archive.read(info), None
+
+def import_features_from_source(source, replace=False):
+    """从本地特征文件或其他节点的导出接口 (http(s)://<节点>/api/export_features) 导入代表特征"""
+    if not source.startswith(('http://', 'https://')):
+        features, names = read_feature_file(source)
+        return face_core.import_features(features, names, replace)
+    
+    tmp_dir = os.path.dirname(app.config['IMPORTED_FEATURES']) or None
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            try:
+                with urllib.request.urlopen(source, timeout=app.config['FEATURE_IMPORT_TIMEOUT']) as response:
+                    if response.status != 200:
+                        raise ValueError(f"下载特征文件失败: HTTP {response.status}")
+                    shutil.copyfileobj(response, tmp, 1 << 20)
+            except (urllib.error.URLError, OSError) as e:
+                raise ValueError(f"下载特征文件失败: {e}") from e
+        features, names = read_feature_file(tmp_path)
+        return face_core.import_features(features, names, replace)
+    finally:
+        os.remove(tmp_path)
+
+def export_features_to_path(path):
+    """导出当前人脸库的代表特征到文件 (.csv为旧版CSV格式，其他为二进制格式)"""
+    snapshot, chunks = face_core.export_features()
+    if path.lower().endswith('.csv'):
+        chunks = iter_feature_csv(snapshot)
+    with open(path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    print(f"已导出 {snapshot.identity_count} 人, {len(snapshot)} 个代表特征到 {path} (人脸库版本 {snapshot.version})")
+
+def import_faces_from_path(path, num_workers=None):
+    """从目录或zip文件批量导入人脸，返回导入报告"""
+    num_workers = app.config['BULK_IMPORT_WORKERS'] if num_workers is None else num_workers
+    if os.path.isdir(path):
+        return face_core.bulk_import(iter_enrollment_directory(path), num_workers)
+    with zipfile.ZipFile(path) as archive:
+        total = sum(1 for info in archive.infolist() if not info.is_dir())
+        return face_core.bulk_import(iter_enrollment_archive(archive), num_workers, total)
+
+def decode_image_bytes(data):
+    """解码图像字节 (OpenCV解码时释放GIL，可在线程池中并行)"""
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+def batch_recognition_events(uploads, profile_name):
+    """批量识别流水线: 按块并行解码，下一块解码与当前块识别重叠进行，每张图像产出一条结果
+
+    内存中最多同时存在两块图像，与提交的图像总数无关。
+    """
+    chunk_size = app.config['BATCH_RECOGNIZE_CHUNK']
+    start_time = time.time()
+    total = failed = faces = 0
+    
+    def next_chunk():
+        chunk = []
+        for name, data, error in uploads:
+            future = decoder.submit(decode_image_bytes, data) if data is not None else None
+            chunk.append((name, future, error))
+            if len(chunk) >= chunk_size:
+                break
+        return chunk
+    
+    with ThreadPoolExecutor(app.config['BATCH_RECOGNIZE_DECODE_THREADS']) as decoder:
+        chunk = next_chunk()
+        while chunk:
+            # 预取下一块，解码与当前块识别并行
+            following = next_chunk()
+            
+            chunk_start = time.time()
+            entries = []
+            for name, future, error in chunk:
+                img = future.result() if future is not None else None
+                if error is None and img is None:
+                    error = '无法解码图像数据'
+                entries.append((name, img, error))
+            
+            # 每块记录一次延迟: 等待解码完成的时间、整块的分析和匹配耗时
+            stages = {'decode': time.time() - chunk_start}
+            images = [img for _, img, error in entries if error is None]
+            try:
+                batch_results, gallery_version = face_core.recognize_batch(images, profile_name, stages)
+                batch_error = None
+                latency_metrics.observe('recognize_batch', stages, time.time() - chunk_start)
+            except Exception as e:
+                batch_results, gallery_version, batch_error = [], None, f'识别错误: {str(e)}'
+            results_iter = iter(batch_results)
+            
+            for name, img, error in entries:
+                event = {'type': 'result', 'index': total, 'filename': name}
+                total += 1
+                error = error or (batch_error if img is not None else None)
+                if error:
+                    failed += 1
+                    event.update({'success': False, 'message': error})
+                else:
+                    results = next(results_iter)
+                    faces += len(results)
+                    event.update({'success': True, 'face_count': len(results), 'faces': results,
+                                  'gallery_version': gallery_version})
+                yield event
+            
+            chunk = following
+    
+    elapsed = time.time() - start_time
+    yield {'type': 'summary', 'total': total, 'failed': failed, 'faces': faces, 'profile': profile_name,
+           'elapsed_ms': round(elapsed * 1000), 'images_per_second': round(total / elapsed, 1) if elapsed else 0}
+
+# API - 批量识别图片
+@app.route('/api/recognize_batch', methods=['POST'])
+def api_recognize_batch():
+    """批量识别图片
+
+    multipart上传多张图片 (images字段) 或zip压缩包 (archive字段，也可以直接放在images中)，
+    以NDJSON流式返回结果: 每张图像一行 (type=result)，最后一行为汇总 (type=summary)。
+    """
+    if not face_core:
+        return jsonify({'success': False, 'message': '人脸识别服务未初始化'})
+    
+    files = [f for f in request.files.getlist('images') + request.files.getlist('archive') if f and f.filename]
+    if not files:
+        return jsonify({'success': False, 'message': '未提供图像文件'})
+    
+    try:
+        profile_name, _ = resolve_profile(request.args.get('profile') or request.form.get('profile'), 'recognize')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    
+    # 请求结束时上传文件会被关闭，先转存到临时文件 (在磁盘上，不占用内存) 供流式响应读取
+    uploads = []
+    for file in files:
+        stream = tempfile.TemporaryFile()
+        file.save(stream)
+        stream.seek(0)
+        uploads.append((file.filename, stream))
+    
+    def generate():
+        try:
+            yield from ndjson_lines(batch_recognition_events(iter_batch_uploads(uploads), profile_name))
+        finally:
+            for _, stream in uploads:
+                stream.close()
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+# 视频帧接口支持的二进制图像类型
+FRAME_CONTENT_TYPES = {'image/jpeg', 'image/jpg', 'image/webp', 'image/png', 'application/octet-stream'}
+
+def read_frame_request():
+    """读取视频帧请求，返回 (图像, 参数字典)
+
+    支持三种请求格式:
+      1. 二进制请求体 (Content-Type: image/jpeg / image/webp / image/png)，参数放在查询字符串中
+      2. multipart表单，图像放在 image 字段，参数放在其他表单字段中
+      3. JSON，image 字段为Base64图像数据 (兼容旧客户端)
+    查询字符串中的参数优先。图像数据缺失时抛出ValueError，无法解码时返回的图像为None。
+    """
+    content_type = (request.mimetype or '').lower()
+    if content_type in FRAME_CONTENT_TYPES:
+        params = {}
+        img_data = request.get_data(cache=False)
+    elif 'image' in request.files:
+        params = request.form.to_dict()
+        img_data = request.files['image'].read()
+    elif request.is_json:
+        params = request.get_json() or {}
+        if 'image' not in params:
+            raise ValueError('缺少图像数据')
+        # 解析Base64图像
+        base64_data = params['image'].split(',')[1] if ',' in params['image'] else params['image']
+        img_data = base64.b64decode(base64_data)
+    else:
+        raise ValueError('数据格式错误')
+    
+    if not img_data:
+        raise ValueError('缺少图像数据')
+    
+    for key in ('profile', 'camera_id', 'mode'):
+        if request.args.get(key):
+            params[key] = request.args.get(key)
+    
+    img_np = np.frombuffer(img_data, np.uint8)
+    return cv2.imdecode(img_np, cv2.IMREAD_COLOR), params
+
 # API - 识别视频帧
 @app.route('/api/recognize_frame', methods=['POST'])
 def api_recognize_frame():
-    """识别视频帧"""
+    """识别视频帧
+
+    mode=boxes 时只返回人脸框、姓名和分数的JSON，由客户端绘制叠加层；
+    默认 (mode=image) 额外返回绘制了人脸框的Base64图像。
+    """
     if not face_core:
         return jsonify({'success': False, 'message': '人脸识别服务未初始化'})
     
     try:
-        # 获取图像数据
-        if not request.is_json:
-            return jsonify({'success': False, 'message': '数据格式错误'})
-        
-        data = request.get_json()
-        if 'image' not in data:
-            return jsonify({'success': False, 'message': '缺少图像数据'})
+        request_start = time.time()
         
-        # 解析Base64图像
-        base64_data = data['image'].split(',')[1] if ',' in data['image'] else data['image']
-        img_data = base64.b64decode(base64_data)
-        img_np = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
+        # 获取图像数据
+        try:
+            img, params = read_frame_request()
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
+        decode_time = time.time() - request_start
         
         if img is None:
             return jsonify({'success': False, 'message': '无法解码图像数据'})
         
-        # 识别人脸
-        start_time = time.time()
-        results = face_core.recognize_face(img)
-        recognition_time = time.time() - start_time
-        
-        # 在图像上绘制结果
-        img_with_rect = face_core.draw_face_rects(img, results)
+        # 解析识别配置
+        try:
+            profile_name, _ = resolve_profile(params.get('profile'), 'recognize_frame')
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
         
-        # 将结果图像编码为Base64
-        _, buffer = cv2.imencode('.jpg', img_with_rect)
-        img_b64 = base64.b64encode(buffer).decode('utf-8')
+        # 摄像头会话ID，用于跨帧跟踪人脸。只有客户端明确提供时才启用跟踪:
+        # 反向代理或NAT之后多个客户端的地址相同，按地址共用跟踪器会把一个客户端画面中的身份
+        # 沿用到另一个客户端相近位置的人脸上。预派生部署时各工作进程共用监听端口，同一摄像头的相邻帧
+        # 会由不同工作进程处理，各自的跟踪器只看到部分帧，因此不启用跟踪
+        camera_id = params.get('camera_id')
+        tracking = camera_id and app.config['SERVER_MODE'] != 'prefork'
+        tracker = tracker_registry.get(str(camera_id)) if tracking else None
         
-        # 增加性能信息
-        performance_info = {
-            'detection_time': round(recognition_time * 1000, 2),  # 毫秒
-            'face_count': len(results)
-        }
+        # 识别人脸
+        stage_performance = {}
+        results = face_core.recognize_face(img, profile_name, stage_performance, tracker)
+        stages = dict(stage_performance['stage_seconds'], decode=decode_time)
         
-        return jsonify({
+        response = {
             'success': True, 
-            'image_b64': img_b64, 
             'count': len(results),
             'faces': results,
-            'performance': performance_info
-        })
+            'frame_size': [int(img.shape[1]), int(img.shape[0])],
+            'gallery_version': stage_performance.get('gallery_version', face_core.gallery_version)
+        }
+        
+        if params.get('mode', 'image') != 'boxes':
+            # 在图像上绘制结果 (解码出的图像不再使用，直接在原图上绘制)
+            draw_start = time.time()
+            img_with_rect = face_core.draw_face_rects(img, results, in_place=True)
+            stages['draw'] = time.time() - draw_start
+            
+            # 将结果图像编码为Base64
+            encode_start = time.time()
+            _, buffer = cv2.imencode('.jpg', img_with_rect)
+            response['image_b64'] = base64.b64encode(buffer).decode('utf-8')
+            stages['encode'] = time.time() - encode_start
+        
+        # 增加性能信息
+        response['performance'] = request_performance(
+            'recognize_frame', stages, time.time() - request_start, profile=profile_name, face_count=len(results),
+            tracked_faces=stage_performance.get('tracked_faces', 0))  # 沿用跟踪身份、未重新计算特征的人脸数
+        
+        return jsonify(response)
     except Exception as e:
         return jsonify({'success': False, 'message': f'识别错误: {str(e)}'})
 
+# API - 识别调度统计
+@app.route('/api/batch_stats', methods=['GET', 'DELETE'])
+@single_process_only
+def api_batch_stats():
+    """GET返回微批处理调度器的批大小、排队等待时间和队列深度统计；DELETE清零统计"""
+    if not face_core:
+        return jsonify({'success': False, 'message': '人脸识别服务未初始化'})
+    
+    batcher = face_core.batcher
+    if batcher is None:
+        return jsonify({'success': True, 'enabled': False})
+    if request.method == 'DELETE':
+        batcher.reset_stats()
+    return jsonify({'success': True, 'enabled': True, 'stats': batcher.stats()})
+
+# 监控指标
+@app.route('/metrics')
+def metrics():
+    """Prometheus文本格式的监控指标: 各接口分阶段延迟直方图，人脸库规模、索引类型和快照版本"""
+    lines = latency_metrics.render()
+    if face_core is not None:
+        snapshot = face_core.gallery
+        index_type = snapshot.index.index_type if snapshot.index is not None else 'exact'
+        lines += [
+            "# HELP tianshu_gallery_identities 人脸库身份数量",
+            "# TYPE tianshu_gallery_identities gauge",
+            f"tianshu_gallery_identities {snapshot.identity_count}",
+            "# HELP tianshu_gallery_templates 人脸库代表特征数量",
+            "# TYPE tianshu_gallery_templates gauge",
+            f"tianshu_gallery_templates {len(snapshot)}",
+            "# HELP tianshu_gallery_version 当前人脸库快照版本",
+            "# TYPE tianshu_gallery_version gauge",
+            f"tianshu_gallery_version {snapshot.version}",
+            "# HELP tianshu_gallery_index_info 特征匹配使用的索引类型 (exact为精确矩阵运算)",
+            "# TYPE tianshu_gallery_index_info gauge",
+            f'tianshu_gallery_index_info{{type="{index_type}"}} 1',
+        ]
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+# 健康检查 - 存活
+@app.route('/healthz')
+def healthz():
+    """存活检查: 进程能够处理请求即返回200"""
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+# 健康检查 - 就绪
+@app.route('/readyz')
+def readyz():
+    """就绪检查: 模型和人脸库加载完成后返回200，否则返回503"""
+    checks = {
+        'models_loaded': face_core is not None,
+        'gallery_loaded': face_core is not None and face_core.gallery_version > 0,
+        'batcher_running': face_core is not None and (not app.config['RECOGNITION_BATCHING'] or
+                                                      face_core.batcher is not None)
+    }
+    ready = all(checks.values())
+    return jsonify({'ready': ready, 'pid': os.getpid(), 'checks': checks}), 200 if ready else 503
+
+# API - 服务进程状态
+@app.route('/api/server_status', methods=['GET'])
+def api_server_status():
+    """返回当前工作进程的状态，以及同组各工作进程的内存占用 (用于评估主机规格)"""
+    started_at = app.config.get('SERVER_STARTED_AT')
+    status = {
+        'mode': app.config['SERVER_MODE'],
+        'pid': os.getpid(),
+        'worker_slot': app.config.get('SERVER_WORKER_SLOT'),
+        'uptime': round(time.time() - started_at, 1) if started_at else None,
+        'gallery_version': face_core.gallery_version if face_core else None,
+        'gallery_size': len(face_core.gallery) if face_core else 0,
+        'gallery_mapped': face_core is not None and isinstance(face_core.gallery.matrix, np.memmap),
+        'memory': process_memory()
+    }
+    if app.config['SERVER_MODE'] == 'prefork':
+        status['master'] = {'pid': os.getppid(), 'memory': process_memory(os.getppid())}
+        status['workers'] = [{'pid': pid, 'memory': process_memory(pid)} for pid in worker_group_pids()]
+    return jsonify({'success': True, 'status': status})
+
 # API - 创建人脸文件夹
 @app.route('/api/create_face', methods=['POST'])
 def api_create_face():
@@ -823,22 +5529,18 @@ def api_add_face_image():
         # 读取图像数据
         img_data = file.read()
         
-        # 检查是否包含人脸
+        # 检查是否为有效图像
         img_np = np.frombuffer(img_data, np.uint8)
         img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
         if img is None:
             return jsonify({'success': False, 'message': '无法解码图像数据'})
         
-        faces = face_core.detector(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-        if len(faces) == 0:
-            return jsonify({'success': False, 'message': '未检测到人脸'})
-        
-        # 添加到数据库
+        # 添加到数据库 (人脸检测和质量检查在add_face_image中完成)
         success, message = face_core.add_face_image(face_name, img_data)
         
-        # 重新加载人脸数据库
+        # 增量更新该身份的代表特征
         if success:
-            face_core.load_face_database()
+            face_core.update_identity(face_name)
         
         return jsonify({'success': success, 'message': message})
     except Exception as e:
@@ -866,37 +5568,119 @@ def api_add_face_from_camera():
         base64_data = data['image_data'].split(',')[1] if ',' in data['image_data'] else data['image_data']
         img_data = base64.b64decode(base64_data)
         
-        # 检查是否包含人脸
+        # 检查是否为有效图像
         img_np = np.frombuffer(img_data, np.uint8)
         img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
         if img is None:
             return jsonify({'success': False, 'message': '无法解码图像数据'})
         
-        faces = face_core.detector(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-        if len(faces) == 0:
-            return jsonify({'success': False, 'message': '未检测到人脸'})
-        
-        # 添加到数据库
+        # 添加到数据库 (人脸检测和质量检查在add_face_image中完成)
         success, message = face_core.add_face_image(face_name, img_data)
         
-        # 重新加载人脸数据库
+        # 增量更新该身份的代表特征
         if success:
-            face_core.load_face_database()
+            face_core.update_identity(face_name)
         
         return jsonify({'success': success, 'message': message})
     except Exception as e:
         return jsonify({'success': False, 'message': f'添加人脸图像错误: {str(e)}'})
 
+# API - 批量导入人脸
+@app.route('/api/import_faces', methods=['POST'])
+def api_import_faces():
+    """批量导入人脸
+
+    上传zip压缩包 (archive字段)，目录结构与人脸库相同: <姓名>/*.jpg。
+    质量检查和特征提取并行执行，全部完成后只更新一次人脸库，返回导入报告 (含每张被拒绝图像的原因)。
+    """
+    if not face_core:
+        return jsonify({'success': False, 'message': '人脸识别服务未初始化'})
+    
+    file = request.files.get('archive')
+    if not file or not file.filename.lower().endswith('.zip'):
+        return jsonify({'success': False, 'message': '缺少zip压缩包'})
+    
+    try:
+        with tempfile.TemporaryFile() as stream:
+            file.save(stream)
+            stream.seek(0)
+            try:
+                archive = zipfile.ZipFile(stream)
+            except zipfile.BadZipFile:
+                return jsonify({'success': False, 'message': '无效的zip文件'})
+            with archive:
+                total = sum(1 for info in archive.infolist() if not info.is_dir())
+                report = face_core.bulk_import(iter_enrollment_archive(archive),
+                                               app.config['BULK_IMPORT_WORKERS'], total)
+        return jsonify({'success': True,
+                        'message': f"已导入 {report['imported']} 张图像，拒绝 {report['rejected']} 张",
+                        'report': report})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'批量导入错误: {str(e)}'})
+
+# API - 导出代表特征
+@app.route('/api/export_features', methods=['GET'])
+def api_export_features():
+    """导出人脸库的代表特征，分块传输
+
+    默认为二进制格式 (与人脸库文件相同，可直接导入其他节点)，format=csv 时为旧版CSV格式。
+    """
+    if not face_core:
+        return jsonify({'success': False, 'message': '人脸识别服务未初始化'})
+    
+    snapshot, chunks = face_core.export_features()
+    headers = {'X-Gallery-Version': str(snapshot.version), 'X-Gallery-Size': str(len(snapshot))}
+    if request.args.get('format') == 'csv':
+        headers['Content-Disposition'] = f'attachment; filename=features_v{snapshot.version}.csv'
+        return Response(iter_feature_csv(snapshot), mimetype='text/csv', headers=headers)
+    headers['Content-Disposition'] = f'attachment; filename=features_v{snapshot.version}.bin'
+    return Response(chunks, mimetype='application/octet-stream', headers=headers)
+
+# API - 导入代表特征
+@app.route('/api/import_features', methods=['POST'])
+def api_import_features():
+    """导入其他节点导出的代表特征 (二进制格式或旧版CSV)，直接加入人脸库和索引，不需要录入图像
+
+    上传文件 (file字段) 或直接以请求体发送。replace=1 时替换全部已导入的特征，否则与已导入的特征合并。
+    """
+    if not face_core:
+        return jsonify({'success': False, 'message': '人脸识别服务未初始化'})
+    
+    replace = request.args.get('replace', '').lower() in ('1', 'true', 'yes')
+    tmp_dir = os.path.dirname(app.config['IMPORTED_FEATURES']) or None
+    try:
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, suffix='.tmp', delete=False) as tmp:
+            file = request.files.get('file')
+            if file:
+                file.save(tmp)
+            else:
+                shutil.copyfileobj(request.stream, tmp, 1 << 20)
+        try:
+            features, names = read_feature_file(tmp.name)
+            report = face_core.import_features(features, names, replace)
+        finally:
+            os.remove(tmp.name)
+        return jsonify({'success': True,
+                        'message': f"已导入 {report['identities']} 人, {report['templates']} 个代表特征",
+                        'report': report})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'导入特征错误: {str(e)}'})
+
 # API - 获取人脸数据库信息
 @app.route('/api/get_face_database', methods=['GET'])
 def api_get_face_database():
-    """获取人脸数据库信息"""
+    """分页获取人脸数据库信息 (支持姓名前缀搜索和排序)"""
     if not face_core:
         return jsonify({'success': False, 'message': '人脸识别服务未初始化'})
     
     try:
-        # 获取数据库信息
-        db_info = face_core.get_face_database_info()
+        # 分页参数: offset/limit、姓名前缀 q、排序字段 sort (name/count/time/updated) 和顺序 order (asc/desc)
+        offset = max(0, request.args.get('offset', 0, type=int))
+        limit = min(max(1, request.args.get('limit', app.config['FACE_CATALOG_PAGE_SIZE'], type=int)),
+                    app.config['FACE_CATALOG_MAX_PAGE_SIZE'])
+        db_info = face_core.get_face_database_info(offset, limit, request.args.get('q', '').strip(),
+                                                   request.args.get('sort', 'count'),
+                                                   request.args.get('order', 'desc') != 'asc')
         
         # 添加系统信息
         system_info = {
@@ -929,11 +5713,235 @@ def api_delete_face():
     except Exception as e:
         return jsonify({'success': False, 'message': f'删除人脸错误: {str(e)}'})
 
+# API - 服务器端视频源
+@app.route('/api/streams', methods=['GET', 'POST'])
+@single_process_only
+def api_streams():
+    """GET列出视频源；POST添加视频源 (source为设备编号、视频文件路径或流地址)"""
+    if request.method == 'GET':
+        return jsonify({'success': True, 'streams': camera_manager.list()})
+    
+    if not face_core:
+        return jsonify({'success': False, 'message': '人脸识别服务未初始化'})
+    
+    try:
+        data = request.get_json() or {}
+        source = data.get('source')
+        if source is None or str(source).strip() == '':
+            return jsonify({'success': False, 'message': '缺少视频源'})
+        
+        try:
+            success, result = camera_manager.add(str(source).strip(), data.get('stream_id'),
+                                                 data.get('profile'), bool(data.get('loop', False)))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
+        
+        if not success:
+            return jsonify({'success': False, 'message': result})
+        return jsonify({'success': True, 'stream': result.status()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'添加视频源错误: {str(e)}'})
+
+@app.route('/api/streams/<stream_id>', methods=['GET', 'DELETE'])
+@single_process_only
+def api_stream(stream_id):
+    """GET查询视频源状态；DELETE停止视频源"""
+    if request.method == 'DELETE':
+        if camera_manager.remove(stream_id):
+            return jsonify({'success': True, 'message': f'已停止视频源: {stream_id}'})
+        return jsonify({'success': False, 'message': f'视频源 {stream_id} 不存在'})
+    
+    stream = camera_manager.get(stream_id)
+    if stream is None:
+        return jsonify({'success': False, 'message': f'视频源 {stream_id} 不存在'})
+    return jsonify({'success': True, 'stream': stream.status()})
+
+@app.route('/api/streams/<stream_id>/mjpeg')
+@single_process_only
+def api_stream_mjpeg(stream_id):
+    """带识别标注的MJPEG视频流"""
+    stream = camera_manager.get(stream_id)
+    if stream is None:
+        return jsonify({'success': False, 'message': f'视频源 {stream_id} 不存在'}), 404
+    return Response(stream.mjpeg_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/api/streams/<stream_id>/results')
+@single_process_only
+def api_stream_results(stream_id):
+    """视频源的识别结果 (since为上次收到的帧序号，只返回之后的结果)"""
+    stream = camera_manager.get(stream_id)
+    if stream is None:
+        return jsonify({'success': False, 'message': f'视频源 {stream_id} 不存在'})
+    since = request.args.get('since', 0, type=int)
+    return jsonify({'success': True, 'stream': stream.status(), 'results': stream.results_since(since)})
+
+# API - 接入网关视频源
+@app.route('/api/gateway/sources', methods=['GET', 'POST'])
+@single_process_only
+def api_gateway_sources():
+    """GET列出网关视频源和汇总统计；POST添加视频源 (source、source_id、profile、fps_cap、loop)"""
+    if request.method == 'GET':
+        if camera_gateway is None:
+            return jsonify({'success': True, 'sources': [], 'stats': None})
+        return jsonify({'success': True, 'sources': camera_gateway.list(), 'stats': camera_gateway.stats()})
+    
+    if not face_core:
+        return jsonify({'success': False, 'message': '人脸识别服务未初始化'})
+    
+    try:
+        data = request.get_json() or {}
+        source = data.get('source')
+        if source is None or str(source).strip() == '':
+            return jsonify({'success': False, 'message': '缺少视频源'})
+        fps_cap = data.get('fps_cap')
+        
+        try:
+            success, result = get_camera_gateway().add(str(source).strip(), data.get('source_id'),
+                                                       data.get('profile'),
+                                                       float(fps_cap) if fps_cap is not None else None,
+                                                       bool(data.get('loop', False)))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
+        
+        if not success:
+            return jsonify({'success': False, 'message': result})
+        return jsonify({'success': True, 'source': result.status()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'添加视频源错误: {str(e)}'})
+
+@app.route('/api/gateway/sources/<source_id>', methods=['GET', 'DELETE'])
+@single_process_only
+def api_gateway_source(source_id):
+    """GET查询网关视频源状态；DELETE停止并移除"""
+    src = camera_gateway.get(source_id) if camera_gateway else None
+    if src is None:
+        return jsonify({'success': False, 'message': f'视频源 {source_id} 不存在'})
+    if request.method == 'DELETE':
+        camera_gateway.remove(source_id)
+        return jsonify({'success': True, 'message': f'已停止视频源: {source_id}'})
+    return jsonify({'success': True, 'source': src.status()})
+
+@app.route('/api/gateway/events', methods=['GET'])
+@single_process_only
+def api_gateway_events():
+    """网关识别事件: 返回序号大于since的事件；stream=1时以NDJSON持续推送新事件"""
+    if camera_gateway is None:
+        return jsonify({'success': True, 'events': []})
+    since = request.args.get('since', 0, type=int)
+    if request.args.get('stream') in ('1', 'true'):
+        return Response(ndjson_lines(camera_gateway.iter_events(since)), mimetype='application/x-ndjson')
+    return jsonify({'success': True, 'events': camera_gateway.events_since(since)})
+
+# API - 视频文件识别
+@app.route('/api/recognize_video', methods=['POST'])
+@single_process_only
+def api_recognize_video():
+    """上传视频文件创建识别任务
+
+    表单参数: stride(抽帧步长)、sample_mode(stride/motion)、motion_threshold、profile、workers。
+    stream=1 时直接以NDJSON流式返回任务事件，否则返回任务ID，之后可查询、订阅或取消。
+    """
+    if not face_core:
+        return jsonify({'success': False, 'message': '人脸识别服务未初始化'})
+    
+    try:
+        if 'video' not in request.files or not request.files['video'].filename:
+            return jsonify({'success': False, 'message': '缺少视频文件'})
+        
+        file = request.files['video']
+        ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+        if ext not in app.config['ALLOWED_VIDEO_EXTENSIONS']:
+            return jsonify({'success': False, 'message': '不支持的视频格式'})
+        
+        sample_mode = request.form.get('sample_mode', 'stride')
+        if sample_mode not in ('stride', 'motion'):
+            return jsonify({'success': False, 'message': 'sample_mode 只能是 stride 或 motion'})
+        
+        video_path = os.path.join(app.config['UPLOAD_TEMP'], f"video_{uuid.uuid4().hex}.{ext}")
+        file.save(video_path)
+        
+        try:
+            job = video_jobs.create(video_path,
+                                    profile=request.form.get('profile'),
+                                    stride=request.form.get('stride', app.config['VIDEO_DEFAULT_STRIDE'], type=int),
+                                    sample_mode=sample_mode,
+                                    motion_threshold=request.form.get('motion_threshold', 8.0, type=float),
+                                    workers=min(request.form.get('workers', app.config['VIDEO_WORKERS'], type=int),
+                                                app.config['VIDEO_WORKERS']),
+                                    decode_threads=app.config['VIDEO_DECODE_THREADS'],
+                                    original_name=secure_filename(file.filename))
+        except ValueError as e:
+            os.remove(video_path)
+            return jsonify({'success': False, 'message': str(e)})
+        
+        if request.form.get('stream') in ('1', 'true'):
+            return Response(ndjson_lines(job.iter_events()), mimetype='application/x-ndjson')
+        return jsonify({'success': True, 'job_id': job.job_id, 'status': job.status})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'创建视频识别任务错误: {str(e)}'})
+
+def ndjson_lines(events):
+    """把事件序列编码为NDJSON行"""
+    for event in events:
+        yield json.dumps(event, ensure_ascii=False) + '\n'
+
+@app.route('/api/video_jobs', methods=['GET'])
+@single_process_only
+def api_video_jobs():
+    """列出视频识别任务"""
+    return jsonify({'success': True, 'jobs': video_jobs.list()})
+
+@app.route('/api/video_jobs/<job_id>', methods=['GET', 'DELETE'])
+@single_process_only
+def api_video_job(job_id):
+    """GET查询任务状态和出现时间段；DELETE取消任务"""
+    job = video_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': f'任务 {job_id} 不存在'})
+    if request.method == 'DELETE':
+        job.cancel()
+        return jsonify({'success': True, 'message': f'已取消任务: {job_id}'})
+    return jsonify({'success': True, 'job': job.snapshot()})
+
+@app.route('/api/video_jobs/<job_id>/cancel', methods=['POST'])
+@single_process_only
+def api_video_job_cancel(job_id):
+    """取消视频识别任务"""
+    job = video_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': f'任务 {job_id} 不存在'})
+    job.cancel()
+    return jsonify({'success': True, 'message': f'已取消任务: {job_id}'})
+
+@app.route('/api/video_jobs/<job_id>/events')
+@single_process_only
+def api_video_job_events(job_id):
+    """以NDJSON流式输出任务的进度、识别结果和最终的出现时间段"""
+    job = video_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': f'任务 {job_id} 不存在'}), 404
+    return Response(ndjson_lines(job.iter_events()), mimetype='application/x-ndjson')
+
 # 显示人脸图像
 @app.route('/face_image/<path:filename>')
 def face_image(filename):
     """显示人脸图像"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=app.config['THUMBNAIL_MAX_AGE'])
+
+@app.route('/face_thumbnail/<path:filename>')
+def face_thumbnail(filename):
+    """显示人脸缩略图 (size参数指定边长)，支持ETag/Last-Modified条件请求"""
+    if face_core is None:
+        abort(503)
+    sizes = app.config['THUMBNAIL_SIZES']
+    size = request.args.get('size', sizes[0], type=int)
+    if size not in sizes:
+        abort(400)
+    thumb_path = face_core.thumbnails.get(filename, size)
+    if thumb_path is None:
+        abort(404)
+    return send_file(thumb_path, mimetype='image/jpeg', conditional=True, etag=True,
+                     max_age=app.config['THUMBNAIL_MAX_AGE'])
 
 # 应用启动
 if __name__ == '__main__':
@@ -942,14 +5950,107 @@ if __name__ == '__main__':
     parser.add_argument('--port', type=int, default=8888, help='服务器端口号(默认: 8888)')
     parser.add_argument('--host', type=str, default='0.0.0.0', help='服务器主机(默认: 0.0.0.0)')
     parser.add_argument('--debug', action='store_true', help='是否启用调试模式')
+    parser.add_argument('--index-type', type=str, default=app.config['FAISS_INDEX_TYPE'],
+                        choices=['auto'] + list(GalleryIndex.TYPES), help='FAISS索引类型(默认: auto)')
+    parser.add_argument('--nprobe', type=int, default=app.config['FAISS_NPROBE'], help='IVF索引检索的聚类数')
+    parser.add_argument('--ef-search', type=int, default=app.config['FAISS_EF_SEARCH'], help='HNSW索引检索宽度')
+    parser.add_argument('--index-report', action='store_true', help='输出索引召回率与延迟报告后退出')
+    parser.add_argument('--benchmark-profiles', action='store_true', help='输出各识别配置的延迟与一致率后退出')
+    parser.add_argument('--camera', action='append', default=[],
+                        help='启动时打开的服务器端视频源(设备编号、视频文件或流地址)，可多次指定')
+    parser.add_argument('--camera-loop', action='store_true', help='视频文件源播放结束后循环播放')
+    parser.add_argument('--camera-backend', type=str, default=app.config['CAMERA_BACKEND'],
+                        choices=['thread', 'gateway'], help='视频源接入方式(默认: thread)')
+    parser.add_argument('--gateway-sim', action='append', default=[],
+                        help='接入网关模拟压测: 用指定视频文件模拟多路摄像头后退出，可多次指定')
+    parser.add_argument('--sim-cameras', type=int, default=40, help='模拟的摄像头路数(默认: 40)')
+    parser.add_argument('--sim-seconds', type=int, default=30, help='模拟运行时间，秒(默认: 30)')
+    parser.add_argument('--sim-fps', type=float, default=app.config['GATEWAY_DEFAULT_FPS'],
+                        help=f"模拟时每路帧率上限(默认: {app.config['GATEWAY_DEFAULT_FPS']})")
+    parser.add_argument('--workers', type=int, default=app.config['RECOGNITION_WORKERS'],
+                        help='识别工作进程数(默认: 0，在请求线程中识别)')
+    parser.add_argument('--batch', action='store_true', help='启用识别请求微批处理')
+    parser.add_argument('--batch-size', type=int, default=app.config['BATCH_MAX_SIZE'],
+                        help=f"微批处理最大批大小(默认: {app.config['BATCH_MAX_SIZE']})")
+    parser.add_argument('--batch-wait-ms', type=float, default=app.config['BATCH_MAX_WAIT_MS'],
+                        help=f"微批处理最长等待时间，毫秒(默认: {app.config['BATCH_MAX_WAIT_MS']})")
+    parser.add_argument('--load-workers', type=int, default=app.config['GALLERY_LOAD_WORKERS'],
+                        help=f"冷启动加载人脸库时并行提取特征的进程数(默认: {app.config['GALLERY_LOAD_WORKERS']})")
+    parser.add_argument('--export-features', type=str, help='导出人脸库代表特征到文件后退出(.csv为旧版CSV格式)')
+    parser.add_argument('--import-features', type=str,
+                        help='从特征文件(二进制或旧版CSV)或其他节点的 /api/export_features 地址导入代表特征后退出')
+    parser.add_argument('--replace-imported', action='store_true', help='导入特征时替换全部已导入的特征')
+    parser.add_argument('--import-faces', type=str, help='从目录或zip文件(<姓名>/*.jpg)批量导入人脸后退出')
+    parser.add_argument('--import-workers', type=int, default=app.config['BULK_IMPORT_WORKERS'],
+                        help=f"批量导入的进程数(默认: {app.config['BULK_IMPORT_WORKERS']})")
+    parser.add_argument('--serve', action='store_true', help='生产模式: 预加载模型后派生多个HTTP工作进程')
+    parser.add_argument('--http-workers', type=int, default=app.config['SERVE_WORKERS'],
+                        help=f"生产模式HTTP工作进程数(默认: {app.config['SERVE_WORKERS']})")
+    parser.add_argument('--max-requests', type=int, default=app.config['SERVE_MAX_REQUESTS'],
+                        help='工作进程处理多少请求后回收重启(0表示不回收)')
+    parser.add_argument('--graceful-timeout', type=int, default=app.config['SERVE_GRACEFUL_TIMEOUT'],
+                        help='停止服务时等待进行中请求的最长时间，秒')
     args = parser.parse_args()
     
+    app.config['FAISS_INDEX_TYPE'] = args.index_type
+    app.config['CAMERA_BACKEND'] = args.camera_backend
+    app.config['FAISS_NPROBE'] = args.nprobe
+    app.config['FAISS_EF_SEARCH'] = args.ef_search
+    
     # 初始化人脸识别核心
-    init_success = init_face_core()
+    app.config['RECOGNITION_WORKERS'] = args.workers
+    app.config['GALLERY_LOAD_WORKERS'] = args.load_workers
+    app.config['RECOGNITION_BATCHING'] = args.batch or app.config['RECOGNITION_BATCHING']
+    app.config['BATCH_MAX_SIZE'] = args.batch_size
+    app.config['BATCH_MAX_WAIT_MS'] = args.batch_wait_ms
+    app.config['SERVE_MAX_REQUESTS'] = args.max_requests
+    app.config['SERVE_GRACEFUL_TIMEOUT'] = args.graceful_timeout
+    if args.serve:
+        # 生产模式下工作池和调度器在fork之后由各工作进程启动
+        init_success = init_face_core()
+    else:
+        init_success = init_face_core(args.workers, app.config['RECOGNITION_BATCHING'])
     if not init_success:
         print("人脸识别服务初始化失败，程序将退出")
         sys.exit(1)
     
+    if args.index_report:
+        face_core.index_report()
+        sys.exit(0)
+    
+    if args.benchmark_profiles:
+        face_core.benchmark_profiles()
+        sys.exit(0)
+    
+    if args.export_features:
+        export_features_to_path(args.export_features)
+        sys.exit(0)
+    
+    if args.import_features:
+        try:
+            import_features_from_source(args.import_features, args.replace_imported)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        sys.exit(0)
+    
+    if args.import_faces:
+        report = import_faces_from_path(args.import_faces, args.import_workers)
+        for item in report['rejections']:
+            print(f"  拒绝 {item['file']}: {item['reason']}")
+        sys.exit(0)
+    
+    if args.gateway_sim:
+        run_gateway_simulation(args.gateway_sim, args.sim_cameras, args.sim_seconds, args.sim_fps)
+        sys.exit(0)
+    
+    if args.serve:
+        serve(args.host, args.port, args.http_workers, args.camera, args.camera_loop)
+        sys.exit(0)
+    
+    # 启动服务器端视频源
+    start_cameras(args.camera, args.camera_loop)
+    
     # 打印启动信息
     print("\n" + "="*50)
     print(f"人脸识别服务器启动于 http://localhost:{args.port}")
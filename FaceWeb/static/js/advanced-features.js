@@ -10,7 +10,9 @@ const advancedConfig = {
         enabled: false,
         interval: 500,  // 识别间隔(毫秒)
         minConfidence: 0.65,  // 最小可信度
-        maxHistory: 10  // 历史记录最大数量
+        maxHistory: 10,  // 历史记录最大数量
+        // 摄像头会话ID，服务器据此跨帧跟踪人脸
+        cameraId: 'browser-' + Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 8)
     },
     
     // 分析配置
@@ -140,16 +142,32 @@ function performRealtimeRecognition() {
     
     appState.processingImage = true;
     
-    // 从Canvas获取图像数据
-    const imageData = appState.videoCanvas.toDataURL('image/jpeg');
+    // 从Canvas获取JPEG二进制数据，直接作为请求体发送 (不再Base64编码)
+    appState.videoCanvas.toBlob(blob => {
+        if (!blob) {
+            appState.processingImage = false;
+            return;
+        }
+        sendRealtimeFrame(blob);
+    }, 'image/jpeg', 0.85);
+}
+
+/**
+ * 发送实时识别帧
+ * 只请求人脸框数据 (mode=boxes)，叠加层由前端绘制
+ */
+function sendRealtimeFrame(blob) {
+    const params = new URLSearchParams({
+        mode: 'boxes',
+        camera_id: advancedConfig.realtime.cameraId
+    });
     
-    // 发送识别请求
-    fetch('/api/recognize', {
+    fetch('/api/recognize_frame?' + params.toString(), {
         method: 'POST',
         headers: {
-            'Content-Type': 'application/json'
+            'Content-Type': 'image/jpeg'
         },
-        body: JSON.stringify({ image: imageData })
+        body: blob
     })
     .then(response => response.json())
     .then(data => {
@@ -231,8 +249,8 @@ function updateRealtimeStats(data) {
     realTimeStats.averageConfidence = (realTimeStats.averageConfidence * 0.7) + (avgConfidence * 0.3);
     
     // 如果有性能数据，记录处理时间
-    if (data.performance && data.performance.detection_time) {
-        realTimeStats.processingTimes.push(data.performance.detection_time);
+    if (data.performance && data.performance.total_time) {
+        realTimeStats.processingTimes.push(data.performance.total_time);
         
         // 保持数组大小在可控范围内
         if (realTimeStats.processingTimes.length > 50) {
@@ -248,7 +266,7 @@ function updateRealtimeStats(data) {
     // 如果有性能数据，更新处理时间
     if (data.performance) {
         document.getElementById('time-cost').textContent = 
-            data.performance.detection_time + 'ms';
+            data.performance.total_time + 'ms';
     }
     
     // 计算FPS
@@ -15,6 +15,7 @@ const appState = {
     currentTab: 'recognition',
     processingImage: false,
     currentFaceName: '',
+    capturedBlob: null,
 };
 
 // 初始化页面
@@ -504,12 +505,9 @@ function recognizeFace() {
     const resultElement = document.getElementById('recognition-result');
     
     // 获取当前图像
-    let imageData;
+    let imageSrc = null;
     
-    if (appState.videoStream) {
-        // 从摄像头获取图像
-        imageData = appState.videoCanvas.toDataURL('image/jpeg');
-    } else {
+    if (!appState.videoStream) {
         // 从显示的图像获取
         const img = videoDisplay.querySelector('img');
         if (!img) {
@@ -517,20 +515,36 @@ function recognizeFace() {
             appState.processingImage = false;
             return;
         }
+        imageSrc = img.src;
         
         // 将图像绘制到Canvas
         appState.videoContext.clearRect(0, 0, 640, 480);
         appState.videoContext.drawImage(img, 0, 0, 640, 480);
-        imageData = appState.videoCanvas.toDataURL('image/jpeg');
     }
     
-    // 发送识别请求
+    // 以JPEG二进制文件上传 (multipart)，不再Base64编码
+    appState.videoCanvas.toBlob(blob => {
+        if (!blob) {
+            resultElement.textContent = '无法获取图像';
+            appState.processingImage = false;
+            return;
+        }
+        const formData = new FormData();
+        formData.append('image', blob, 'frame.jpg');
+        sendRecognizeRequest(formData, imageSrc);
+    }, 'image/jpeg', 0.9);
+}
+
+/**
+ * 发送识别请求并显示结果
+ */
+function sendRecognizeRequest(formData, imageSrc) {
+    const videoDisplay = document.getElementById('recognition-display');
+    const resultElement = document.getElementById('recognition-result');
+    
     fetch('/api/recognize', {
         method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({ image: imageData })
+        body: formData
     })
     .then(response => response.json())
     .then(data => {
@@ -550,7 +564,7 @@ function recognizeFace() {
             // 显示原始图像
             videoDisplay.innerHTML = '';
             const img = document.createElement('img');
-            img.src = imageData;
+            img.src = imageSrc;
             img.style.width = '100%';
             img.style.height = '100%';
             img.style.objectFit = 'contain';
@@ -905,20 +919,27 @@ function captureFaceImage() {
         }
     }
     
-    // 获取图像数据
-    const imageData = appState.videoCanvas.toDataURL('image/jpeg');
-    
-    // 显示预览
-    previewElement.innerHTML = '';
-    const previewImg = document.createElement('img');
-    previewImg.src = imageData;
-    previewImg.style.width = '100%';
-    previewImg.style.height = '100%';
-    previewImg.style.objectFit = 'cover';
-    previewElement.appendChild(previewImg);
-    
-    // 启用保存按钮
-    document.getElementById('btn-save-face').disabled = false;
+    // 获取JPEG二进制数据，保存时直接上传 (不再Base64编码)
+    appState.videoCanvas.toBlob(blob => {
+        if (!blob) {
+            document.getElementById('enrollment-status').innerHTML = '<div class="alert alert-warning">无法获取图像</div>';
+            return;
+        }
+        appState.capturedBlob = blob;
+        
+        // 显示预览
+        previewElement.innerHTML = '';
+        const previewImg = document.createElement('img');
+        previewImg.src = URL.createObjectURL(blob);
+        previewImg.onload = () => URL.revokeObjectURL(previewImg.src);
+        previewImg.style.width = '100%';
+        previewImg.style.height = '100%';
+        previewImg.style.objectFit = 'cover';
+        previewElement.appendChild(previewImg);
+        
+        // 启用保存按钮
+        document.getElementById('btn-save-face').disabled = false;
+    }, 'image/jpeg', 0.9);
 }
 
 /**
@@ -934,27 +955,23 @@ function saveFaceToDatabase() {
     const previewImg = previewElement.querySelector('img');
     const statusElement = document.getElementById('enrollment-status');
     
-    if (!previewImg) {
+    if (!previewImg || !appState.capturedBlob) {
         statusElement.innerHTML = '<div class="alert alert-warning">请先捕获人脸图像</div>';
         return;
     }
     
-    // 获取图像数据
-    const imageData = previewImg.src;
-    
     // 显示加载状态
     statusElement.innerHTML = '<div class="alert alert-info">正在保存人脸...</div>';
     
+    // 以JPEG文件上传 (multipart)
+    const formData = new FormData();
+    formData.append('face_name', appState.currentFaceName);
+    formData.append('image', appState.capturedBlob, 'capture.jpg');
+    
     // 发送保存请求
-    fetch('/api/add_face_from_camera', {
+    fetch('/api/add_face_image', {
         method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-            face_name: appState.currentFaceName,
-            image_data: imageData
-        })
+        body: formData
     })
     .then(response => response.json())
     .then(data => {
@@ -964,6 +981,7 @@ function saveFaceToDatabase() {
             
             // 清除预览
             previewElement.innerHTML = '';
+            appState.capturedBlob = null;
             
             // 禁用保存按钮
             document.getElementById('btn-save-face').disabled = true;